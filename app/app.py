@@ -1,13 +1,18 @@
+import time
+import_start = time.time()
+import_started = time.perf_counter()
 import streamlit as st
 import os
 # import pandas
-from utils.video_processing import process_video, save_processed_video_data
-from utils.prepare_vectordb import get_vectorstore
+# Video, scraping, LangChain and the vectorstore are imported by the modules below only when they are first used
+from utils.prepare_vectordb import get_vectorstore, list_ingested_shards
 from utils.session_state import initialize_session_state_variables
-from utils.chatbot import chat
-from utils.web_scraper import scrape_website
-import pytesseract
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+from utils.chatbot import chat, warm_up
+from utils.ingest_jobs import get_job_queue
+from utils import metrics
+import json
+# Modules stay imported across reruns, so only the first run of the process measures a real import time
+metrics.record_span("app_imports", import_start, time.perf_counter() - import_started)
 
 class ChatApp:
     def __init__(self):
@@ -20,24 +25,80 @@ class ChatApp:
         st.title("Chat with PDFS :books:")
         initialize_session_state_variables(st)
         self.docs_files = st.session_state.processed_documents
+        # Ingestion runs on a background worker, so the chat stays usable while documents are processed
+        self.jobs = get_job_queue()
 
     def get_text_based_response(self, user_input):
         from utils.chatbot import get_text_response
         return get_text_response(user_input)
 
+    def is_new_upload(self, uploaded_file):
+        # File uploaders keep their files across reruns, so each upload is only queued once per session
+        key = f"{uploaded_file.name}:{uploaded_file.size}"
+        if key in st.session_state.submitted_uploads:
+            return False
+        st.session_state.submitted_uploads.append(key)
+        return True
+
     def process_video(self, video_file):
         # Save video to a temporary file
         temp_video_path = os.path.join("videos", video_file.name)
         with open(temp_video_path, "wb") as f:
             f.write(video_file.read())
 
-        # Process the video
-        text_content, transcription_content = process_video(temp_video_path)
-        
-        # Save the extracted text and transcription
-        save_processed_video_data(text_content, transcription_content)
-        
-        st.success("Video processed successfully!")
+        # Process the video in the background
+        self.jobs.submit("video", {"path": temp_video_path})
+        st.success("Video queued for processing!")
+
+    def show_jobs(self):
+        st.subheader("Processing")
+        jobs = self.jobs.recent()
+        if not jobs:
+            st.caption("No documents processed yet.")
+        for job in jobs:
+            counters = ", ".join(f"{name.replace('_', ' ')}: {value}" for name, value in job["progress"].items())
+            status = f"{job['status']} ({job['stage']})" if job["status"] == "running" and job["stage"] else job["status"]
+            st.caption(f"#{job['id']} {job['kind']} · {status}" + (f" · {counters}" if counters else ""))
+            if job["error"]:
+                st.caption(f"Error: {job['error']}")
+        st.button("Refresh status")
+
+    def select_shards(self):
+        # Questions can be limited to some shards (documents, web pages, video...), so only those are searched.
+        # The shards are listed from the ingestion manifest, so the vectorstore does not have to be opened for it
+        shards = list_ingested_shards()
+        if len(shards) < 2:
+            return None
+        with st.sidebar:
+            scope = st.multiselect("Search in:", shards, default=shards)
+        return scope or shards
+
+    def get_vectordb(self, scope=None):
+        # Called when a question is asked. The shards are reopened every time, since background jobs may have
+        # created new ones. Open shards are shared, so this is cheap after the first question
+        store = get_vectorstore([], from_session_state=True)
+        st.session_state.vectordb = store
+        return store.select(scope) if store is not None and scope else store
+
+    def show_metrics(self):
+        # Time spent in every stage of the pipeline, to find where a slow answer or ingestion spent its time
+        with st.expander("Pipeline metrics", expanded=True):
+            summary = metrics.span_summary()
+            if summary:
+                rows = [f"{'stage':<20} {'calls':>6} {'total s':>9} {'mean ms':>9}"]
+                rows += [f"{name:<20} {values['count']:>6} {values['total_seconds']:>9.3f} {values['mean_seconds'] * 1000:>9.1f}" for name, values in summary.items()]
+                st.text("\n".join(rows))
+            else:
+                st.caption("Nothing measured yet.")
+            # Counters, and gauges such as the queue depth of the model clients
+            exported = metrics.export_json()
+            for counter in exported["counters"] + exported["gauges"]:
+                labels = ", ".join(f"{name}={value}" for name, value in counter["labels"].items())
+                st.caption(f"{counter['name']}{f' ({labels})' if labels else ''}: {counter['value']:g}")
+            st.write("Recent spans:")
+            st.text("\n".join(f"{entry['span']:<20} {entry['duration'] * 1000:9.1f} ms" + (f"  in {entry['parent']}" if entry["parent"] else "") for entry in metrics.recent_spans(20)))
+            st.download_button("Download Prometheus metrics", metrics.export_prometheus(), file_name="metrics.prom", mime="text/plain")
+            st.download_button("Download JSON metrics", json.dumps(metrics.export_json(), indent=2), file_name="metrics.json", mime="application/json")
 
     def run(self):
         upload_docs = os.listdir("docs")
@@ -51,31 +112,34 @@ class ChatApp:
 
             st.subheader("Upload PDF documents")
             pdf_docs = st.file_uploader("Select a PDF document and click on 'Process'", type=['pdf'], accept_multiple_files=True)
-            if pdf_docs:
-                # Save and process PDFs
-                pdf_file_paths = [f.name for f in pdf_docs]
-                for pdf_file in pdf_docs:
+            new_pdfs = [pdf_file for pdf_file in pdf_docs if self.is_new_upload(pdf_file)] if pdf_docs else []
+            if new_pdfs:
+                # Save PDFs and process them in the background
+                for pdf_file in new_pdfs:
                     with open(os.path.join("docs", pdf_file.name), "wb") as f:
                         f.write(pdf_file.read())
-                get_vectorstore(pdf_file_paths, from_session_state=False)
+                self.jobs.submit("documents", {"files": [f.name for f in new_pdfs]})
+                st.success("Documents queued for processing!")
             
             st.subheader("Scrape Website")
             url = st.text_input("Enter website URL:")
+            max_depth = st.number_input("Link depth to follow:", min_value=0, max_value=5, value=1)
+            max_pages = st.number_input("Maximum pages:", min_value=1, max_value=500, value=50)
             if st.button("Scrape Website"):
                 if url:
-                    scraped_text = scrape_website(url)
-                    if scraped_text and "Error" not in scraped_text:
-                        with open("docs/scraped_website.txt", "w") as f:
-                            f.write(scraped_text)
-                        st.success("Website scraped and content saved!")
-                    else:
-                        st.error("Please enter a valid URL.")
-                    get_vectorstore(upload_docs + ["scraped_website.txt"], scraped_text=scraped_text, from_session_state=False)
+                    self.jobs.submit("crawl", {"url": url, "max_depth": int(max_depth), "max_pages": int(max_pages)})
+                    st.success("Website queued for crawling!")
+                else:
+                    st.error("Please enter a valid URL.")
             
             st.subheader("Upload Video")
             video_file = st.file_uploader("Select a video file", type=['mp4', 'avi', 'mov'])
-            if video_file:
+            if video_file and self.is_new_upload(video_file):
                 self.process_video(video_file)
+
+            self.show_jobs()
+            if st.checkbox("Show debug metrics"):
+                self.show_metrics()
             
             # st.subheader("Direct Text Input")
             # user_input = st.text_input("Enter text prompt:")
@@ -85,16 +149,11 @@ class ChatApp:
             #         st.write(f"Response: {response}")
 
         if self.docs_files or st.session_state.uploaded_pdfs or os.path.exists("docs/scraped_website.txt") or os.path.exists("docs/video_text.txt"):
-            if len(upload_docs) > st.session_state.previous_upload_docs_length:
-                st.session_state.vectordb = get_vectorstore(upload_docs + ["scraped_website.txt", "video_text.txt"], from_session_state=True)
-                st.session_state.previous_upload_docs_length = len(upload_docs)
-            st.session_state.chat_history = chat(st.session_state.chat_history, st.session_state.vectordb)
-        if len(upload_docs) > st.session_state.previous_upload_docs_length or os.path.exists("docs/scraped_website.txt") or os.path.exists("docs/video_text.txt"):
-            upload_docs.append("scraped_website.txt")
-            upload_docs.append("video_text.txt")  # Ensure video data is included
-            persist_directory = "Vector_DB - Documents"
-            st.session_state.vectordb = get_vectorstore(upload_docs, from_session_state=True)
-            st.session_state.previous_upload_docs_length = len(upload_docs)
+            scope = self.select_shards()
+            # The vectorstore is only opened when a question is asked
+            st.session_state.chat_memory = chat(st.session_state.chat_memory, lambda: self.get_vectordb(scope))
+            # Load the models and the vectorstore in the background once the page is shown, so the first answer does not wait for them
+            warm_up()
 
         if not self.docs_files and not st.session_state.uploaded_pdfs and not os.path.exists("docs/scraped_website.txt") and not os.path.exists("docs/video_text.txt"):
             st.info("Upload a PDF file, scrape a website, or upload a video to interact with the content.")
@@ -0,0 +1,154 @@
+from utils.prepare_vectordb import open_sharded_store, PERSIST_DIRECTORY
+from utils.chatbot import get_context_retriever_chain, get_response
+from utils import chatbot, metrics, prepare_vectordb
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import argparse
+import json
+import sys
+import time
+
+# Questions queued per worker. Bounds memory however many questions the input has
+QUEUED_PER_WORKER = 2
+
+def read_questions(path):
+    """
+    Read questions from a JSONL file
+
+    Every line is an object with a question and optionally an id, a chat_history of [role, text] pairs (role is
+    human or ai) and a summary of the earlier conversation. Lines that cannot be read are reported and skipped.
+
+    Parameters:
+    - path (str): Path of the file, or - to read standard input
+
+    Yields:
+    - dict: The questions. Questions without an id get their line number
+    """
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping line {number}: {e}", file=sys.stderr)
+                continue
+            if not isinstance(record, dict) or not record.get("question"):
+                print(f"Skipping line {number}: no question", file=sys.stderr)
+                continue
+            record.setdefault("id", number)
+            yield record
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def to_messages(chat_history):
+    """
+    Convert [role, text] pairs to chat messages
+
+    Parameters:
+    - chat_history (list): Pairs of (role, text), oldest first
+
+    Returns:
+    - list: HumanMessage and AIMessage objects
+    """
+    from langchain_core.messages import AIMessage, HumanMessage
+    return [AIMessage(content=text) if role == "ai" else HumanMessage(content=text) for role, text in chat_history]
+
+def answer_question(record, vectordb, use_cache=False):
+    """
+    Answer one question. Errors are recorded in the result instead of stopping the batch
+
+    Parameters:
+    - record (dict): The question, as read by read_questions
+    - vectordb: Vector database used for context retrieval
+    - use_cache (bool): Flag to indicate if answers to similar questions can be reused
+
+    Returns:
+    - dict: The id, question, answer, sources, latency in seconds and error of the question
+    """
+    start = time.perf_counter()
+    result = {"id": record["id"], "question": record["question"]}
+    try:
+        answer, context = get_response(record["question"], to_messages(record.get("chat_history", [])), vectordb, use_cache=use_cache, summary=record.get("summary", ""))
+        sources = [{"source": doc.metadata.get("source"), "page": doc.metadata.get("page"), "chunk_id": doc.metadata.get("chunk_id")} for doc in context]
+        result.update({"answer": answer, "sources": sources, "error": None})
+    except Exception as e:
+        print(f"Error answering question {record['id']}: {e}", file=sys.stderr)
+        result.update({"answer": None, "sources": [], "error": str(e)})
+    result["latency_seconds"] = time.perf_counter() - start
+    return result
+
+def run_batch(questions, vectordb, output, max_workers=4, use_cache=False):
+    """
+    Answer questions concurrently and write the results as JSONL, in the order of the questions
+
+    Every worker shares the same vectorstore, chat model and retrieval chain.
+
+    Parameters:
+    - questions (iterable): Questions, as read by read_questions. Consumed lazily
+    - vectordb: Vector database used for context retrieval
+    - output (file): File the results are written to, one JSON object per line
+    - max_workers (int): Number of questions answered at the same time
+    - use_cache (bool): Flag to indicate if answers to similar questions can be reused
+
+    Returns:
+    - dict: Number of questions and errors, total seconds, throughput and latency percentiles
+    """
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+
+    def write(result):
+        nonlocal errors
+        latencies.append(result["latency_seconds"])
+        errors += result["error"] is not None
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for record in questions:
+            pending.append(executor.submit(answer_question, record, vectordb, use_cache))
+            if len(pending) >= max_workers * QUEUED_PER_WORKER:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+    seconds = time.perf_counter() - started
+    return {"questions": len(latencies), "errors": errors, "seconds": seconds, "questions_per_second": len(latencies) / seconds if seconds else None,
+            "latency": metrics.latency_summary(latencies)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions against the vectorstore, without the Streamlit app.")
+    parser.add_argument("input", help="JSONL file with one {\"question\": ...} object per line, or - for standard input")
+    parser.add_argument("--output", default="-", help="JSONL file the answers are written to. Defaults to standard output")
+    parser.add_argument("--workers", type=int, default=4, help="Number of questions answered at the same time")
+    parser.add_argument("--persist-directory", default=PERSIST_DIRECTORY, help="Directory of the vectorstore")
+    parser.add_argument("--shards", help="Comma separated shards to search. Defaults to every shard")
+    parser.add_argument("--use-cache", action="store_true", help="Reuse the cached answers of similar questions")
+    parser.add_argument("--embedding-backend", choices=["google", "fake"], default=prepare_vectordb.EMBEDDING_BACKEND, help="Embedder of the questions. Must match the one the vectorstore was built with")
+    parser.add_argument("--llm-backend", choices=["google", "fake"], default=chatbot.LLM_BACKEND, help="Chat model that answers")
+    parser.add_argument("--vector-backend", choices=["chroma", "numpy"], default=prepare_vectordb.VECTOR_BACKEND, help="Vectorstore the corpus was ingested into")
+    args = parser.parse_args()
+    prepare_vectordb.EMBEDDING_BACKEND = args.embedding_backend
+    prepare_vectordb.VECTOR_BACKEND = args.vector_backend
+    chatbot.LLM_BACKEND = args.llm_backend
+
+    vectordb = open_sharded_store(args.persist_directory, args.shards.split(",") if args.shards else None)
+    # Build the shared model and retrieval chain before the workers start
+    get_context_retriever_chain(vectordb)
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        summary = run_batch(read_questions(args.input), vectordb, output, args.workers, args.use_cache)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    latency = summary["latency"]
+    print(f"Answered {summary['questions']} questions ({summary['errors']} errors) in {summary['seconds']:.1f}s, {summary['questions_per_second'] or 0:.1f} questions/s", file=sys.stderr)
+    if summary["questions"]:
+        print(f"Latency: p50 {latency['p50_ms']:.1f} ms · p95 {latency['p95_ms']:.1f} ms · p99 {latency['p99_ms']:.1f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import os
+
+# The benchmark runs fully offline with deterministic backends. They must be selected before the app modules are imported
+os.environ.setdefault("EMBEDDING_BACKEND", "fake")
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+from langchain_core.documents import Document
+from utils.ingest_manifest import hash_file
+from utils.prepare_vectordb import extract_pdf_text, get_text_chunks, iter_pdf_documents, ingest_sources, open_sharded_store, PDF_WORKERS
+from utils.resources import invalidate
+from utils import prepare_vectordb
+from utils.chatbot import build_retriever, get_response
+from utils import metrics
+import argparse
+import json
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+WORDS_PER_LINE = 12
+
+def make_vocabulary(size, rng):
+    """
+    Generate a vocabulary of pseudo words
+
+    Parameters:
+    - size (int): Number of words
+    - rng (random.Random): Random generator
+
+    Returns:
+    - list: The words
+    """
+    return ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(size)]
+
+def make_page(vocabulary, words, rng):
+    """
+    Generate the lines of a page of text
+
+    Parameters:
+    - vocabulary (list): Words the page is made of
+    - words (int): Number of words of the page
+    - rng (random.Random): Random generator
+
+    Returns:
+    - list: Lines of the page
+    """
+    page = rng.choices(vocabulary, k=words)
+    return [" ".join(page[start:start + WORDS_PER_LINE]) for start in range(0, words, WORDS_PER_LINE)]
+
+def write_pdf(path, pages):
+    """
+    Write a minimal PDF with one text page per list of lines
+
+    Parameters:
+    - path (str): Path of the PDF
+    - pages (list): Lines of every page
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        escaped = (line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines)
+        stream = ("BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({line}) Tj T*" for line in escaped) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids))
+
+    content = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(content)
+
+def generate_corpus(directory, pdf_count, pages_per_pdf, text_count, words_per_page, seed):
+    """
+    Generate a synthetic corpus of PDFs and text files
+
+    Parameters:
+    - directory (str): Directory where the documents are written
+    - pdf_count (int): Number of PDFs
+    - pages_per_pdf (int): Number of pages of every PDF
+    - text_count (int): Number of text files, each as long as one PDF
+    - words_per_page (int): Number of words of every page
+    - seed (int): Seed of the random generator, so runs compare the same corpus
+
+    Returns:
+    - tuple: (PDF file names, text file names, sample lines used to build queries)
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(5000, rng)
+    os.makedirs(directory, exist_ok=True)
+    pdfs, texts, samples = [], [], []
+    for number in range(pdf_count):
+        pages = [make_page(vocabulary, words_per_page, rng) for _ in range(pages_per_pdf)]
+        name = f"synthetic_{number:04d}.pdf"
+        write_pdf(os.path.join(directory, name), pages)
+        pdfs.append(name)
+        samples.extend(rng.choice(page) for page in pages)
+    for number in range(text_count):
+        pages = [make_page(vocabulary, words_per_page, rng) for _ in range(pages_per_pdf)]
+        name = f"synthetic_{number:04d}.txt"
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write("\n\n".join("\n".join(page) for page in pages))
+        texts.append(name)
+        samples.extend(rng.choice(page) for page in pages)
+    return pdfs, texts, samples
+
+def prompt_token_summary():
+    """
+    Get the mean estimated prompt size of the questions answered by the model
+
+    Returns:
+    - dict: Number of model calls and mean prompt tokens
+    """
+    histogram = next((entry for entry in metrics.export_json()["histograms"] if entry["name"] == "prompt_tokens"), None)
+    if histogram is None:
+        return {"count": 0, "mean": None}
+    return {"count": histogram["count"], "mean": histogram["sum"] / histogram["count"]}
+
+def peak_rss_mb():
+    """
+    Get the peak resident memory of this process and of its finished child processes (PDF workers)
+
+    Returns:
+    - dict: Peak RSS in megabytes of the process and of its children, or None where it cannot be measured
+    """
+    try:
+        import resource
+    except ImportError:
+        # The resource module is not available on Windows
+        return {"self": None, "children": None}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit}
+
+def directory_size_mb(path):
+    """
+    Measure the size of the files in a directory
+
+    Parameters:
+    - path (str): The directory
+
+    Returns:
+    - float: Total size in MB
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 1e6
+
+def measure_startup(slowest=5):
+    """
+    Measure the time a new process takes to import the app, with Python's import time report
+
+    Parameters:
+    - slowest (int): Number of slowest modules imported by the app that are reported
+
+    Returns:
+    - dict: Total import seconds and the slowest modules imported directly by the app
+    """
+    app_directory = os.path.dirname(os.path.abspath(__file__))
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=app_directory, capture_output=True, text=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # Header line
+        imports.append((name.rstrip(), int(cumulative) / 1e6))
+    total = next((seconds for name, seconds in imports if name.strip() == "app"), None)
+    # Modules imported by the app itself are indented by one level in the report
+    direct = sorted(((name.strip(), seconds) for name, seconds in imports if name.startswith("   ") and not name.startswith("    ")), key=lambda entry: -entry[1])
+    return {"import_seconds": total, "slowest_imports": [{"module": name, "seconds": seconds} for name, seconds in direct[:slowest]]}
+
+def git_commit():
+    """
+    Get the commit the benchmark runs on, so results can be compared between commits
+
+    Returns:
+    - str: The commit hash, or None outside a git checkout
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(workdir, pdf_count=20, pages_per_pdf=20, text_count=5, words_per_page=400, queries=200, workers=PDF_WORKERS, seed=0):
+    """
+    Generate a corpus and measure ingestion throughput and query latency on it
+
+    Ingestion goes through the real extraction, chunking and vectorstore code, and queries go through the real
+    retriever and chain, with the offline embedder and chat model.
+
+    Parameters:
+    - workdir (str): Empty directory where the corpus and the vectorstore are created
+    - pdf_count (int): Number of PDFs
+    - pages_per_pdf (int): Number of pages of every document
+    - text_count (int): Number of text files
+    - words_per_page (int): Number of words of every page
+    - queries (int): Number of questions asked
+    - workers (int): Number of processes used to parse the PDFs
+    - seed (int): Seed of the corpus and of the questions
+
+    Returns:
+    - dict: The measurements
+    """
+    startup = measure_startup()
+    # The app reads documents from docs/ relative to the working directory
+    os.chdir(workdir)
+    persist_directory = os.path.join(workdir, "vectordb")
+    pdfs, texts, samples = generate_corpus("docs", pdf_count, pages_per_pdf, text_count, words_per_page, seed)
+    text_docs = []
+    for name in texts:
+        path = os.path.join("docs", name)
+        with open(path, "r", encoding="utf-8") as f:
+            text_docs.append(Document(page_content=f.read(), metadata={"source": path, "page": 0}))
+
+    start = time.perf_counter()
+    pages = extract_pdf_text(pdfs, max_workers=workers)
+    extract_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = get_text_chunks(pages + text_docs)
+    chunk_seconds = time.perf_counter() - start
+
+    def sources():
+        pdf_paths = [os.path.join("docs", name) for name in pdfs]
+        for pdf_path, pdf_pages in iter_pdf_documents(pdf_paths, workers):
+            yield pdf_path, hash_file(pdf_path), pdf_pages
+        for doc in text_docs:
+            yield doc.metadata["source"], hash_file(doc.metadata["source"]), [doc]
+
+    start = time.perf_counter()
+    vectordb, _ = ingest_sources(sources(), persist_directory)
+    ingest_seconds = time.perf_counter() - start
+    stored_chunks = vectordb.count()
+
+    # Reopen the vectorstore from disk, as a new process would, and time it up to the first answered query
+    invalidate()
+    start = time.perf_counter()
+    vectordb = open_sharded_store(persist_directory)
+    open_seconds = time.perf_counter() - start
+    build_retriever(vectordb).invoke(" ".join(samples[0].split()[:6]))
+    first_query_seconds = time.perf_counter() - start - open_seconds
+
+    rng = random.Random(seed + 1)
+    questions = [" ".join(rng.choice(samples).split()[:6]) for _ in range(queries)]
+    retriever = build_retriever(vectordb)
+    retrieval_latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        retriever.invoke(question)
+        retrieval_latencies.append(time.perf_counter() - start)
+    response_latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        get_response(question, [], vectordb, use_cache=False)
+        response_latencies.append(time.perf_counter() - start)
+
+    return {
+        "corpus": {"pdfs": pdf_count, "text_files": text_count, "pages": len(pages) + text_count * pages_per_pdf, "chunks": len(chunks), "stored_chunks": stored_chunks},
+        "extract": {"seconds": extract_seconds, "pages_per_second": len(pages) / extract_seconds if extract_seconds else None},
+        "chunk": {"seconds": chunk_seconds, "chunks_per_second": len(chunks) / chunk_seconds if chunk_seconds else None},
+        "ingest": {"seconds": ingest_seconds, "chunks_per_second": stored_chunks / ingest_seconds if ingest_seconds else None},
+        "startup": startup,
+        "store": {"backend": prepare_vectordb.VECTOR_BACKEND, "open_seconds": open_seconds, "first_query_seconds": first_query_seconds, "disk_mb": directory_size_mb(persist_directory)},
+        "retrieval": metrics.latency_summary(retrieval_latencies),
+        "response": metrics.latency_summary(response_latencies),
+        "peak_rss_mb": peak_rss_mb(),
+        "prompt_tokens": prompt_token_summary(),
+        "spans": metrics.span_summary(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure ingestion throughput and query latency on a synthetic corpus, offline.")
+    parser.add_argument("--pdfs", type=int, default=20, help="Number of synthetic PDFs")
+    parser.add_argument("--pages", type=int, default=20, help="Number of pages of every document")
+    parser.add_argument("--text-files", type=int, default=5, help="Number of synthetic text files")
+    parser.add_argument("--words-per-page", type=int, default=400, help="Number of words of every page")
+    parser.add_argument("--queries", type=int, default=200, help="Number of questions asked")
+    parser.add_argument("--workers", type=int, default=PDF_WORKERS, help="Number of processes used to parse the PDFs")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and of the questions")
+    parser.add_argument("--vector-backend", choices=["chroma", "numpy"], default=prepare_vectordb.VECTOR_BACKEND, help="Vectorstore the corpus is ingested into")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are written to")
+    args = parser.parse_args()
+    prepare_vectordb.VECTOR_BACKEND = args.vector_backend
+
+    output = os.path.abspath(args.output)
+    with tempfile.TemporaryDirectory(prefix="rag-benchmark-") as workdir:
+        results = run_benchmark(workdir, args.pdfs, args.pages, args.text_files, args.words_per_page, args.queries, args.workers, args.seed)
+        # Leave the temporary directory before it is removed
+        os.chdir(os.path.dirname(output))
+    report = {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "config": vars(args), "results": results}
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Extraction: {results['extract']['pages_per_second']:.1f} pages/s")
+    print(f"Chunking: {results['chunk']['chunks_per_second']:.1f} chunks/s")
+    print(f"Ingestion: {results['ingest']['chunks_per_second']:.1f} chunks/s ({results['corpus']['stored_chunks']} chunks)")
+    for name in ("retrieval", "response"):
+        latency = results[name]
+        print(f"{name.capitalize()} latency: p50 {latency['p50_ms']:.1f} ms · p95 {latency['p95_ms']:.1f} ms · p99 {latency['p99_ms']:.1f} ms")
+    if results["startup"]["import_seconds"] is not None:
+        print(f"App import: {results['startup']['import_seconds'] * 1000:.0f} ms")
+    store = results["store"]
+    print(f"Vectorstore ({store['backend']}): opened in {store['open_seconds'] * 1000:.1f} ms, first query {store['first_query_seconds'] * 1000:.1f} ms, {store['disk_mb']:.1f} MB on disk")
+    print(f"Prompt size: {results['prompt_tokens']['mean'] or 0:.0f} tokens on average")
+    if results["peak_rss_mb"]["self"] is not None:
+        print(f"Peak RSS: {results['peak_rss_mb']['self']:.1f} MB (PDF workers: {results['peak_rss_mb']['children']:.1f} MB)")
+    print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    main()
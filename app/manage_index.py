@@ -0,0 +1,69 @@
+from utils.prepare_vectordb import PERSIST_DIRECTORY
+from utils.index_maintenance import build_ivf_indexes, compact_vectorstore, reconcile_docs, remove_sources
+from utils.snapshot import export_snapshot, import_snapshot
+from utils import prepare_vectordb
+import argparse
+
+def format_latency(latency):
+    """
+    Format a latency summary for the console
+
+    Parameters:
+    - latency (dict): Summary from metrics.latency_summary
+
+    Returns:
+    - str: p50 and p95 in milliseconds
+    """
+    if not latency["count"]:
+        return "no queries"
+    return f"p50 {latency['p50_ms']:.1f} ms · p95 {latency['p95_ms']:.1f} ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove documents from the vectorstore, reconcile it with the docs folder, compact it, partition the NumPy backend into IVF lists and export or import snapshots.")
+    parser.add_argument("--persist-directory", default=PERSIST_DIRECTORY, help="Directory of the vectorstore")
+    parser.add_argument("--embedding-backend", choices=["google", "fake"], default=prepare_vectordb.EMBEDDING_BACKEND, help="Embedder of new documents. Must match the one the vectorstore was built with")
+    parser.add_argument("--vector-backend", choices=["chroma", "numpy"], default=prepare_vectordb.VECTOR_BACKEND, help="Vectorstore the corpus was ingested into")
+    commands = parser.add_subparsers(dest="command", required=True)
+    remove = commands.add_parser("remove", help="Remove every chunk of some sources")
+    remove.add_argument("sources", nargs="+", help="Sources as recorded at ingestion, e.g. docs/file.pdf")
+    reconcile = commands.add_parser("reconcile", help="Remove the sources whose file was deleted from the docs folder and ingest new or changed files")
+    reconcile.add_argument("--docs-directory", default="docs", help="The docs folder. Run from the app directory to match the paths the app records")
+    compact = commands.add_parser("compact", help="Rebuild the vectorstore without the space of deleted chunks. Ingestion waits until it is done")
+    compact.add_argument("--sample-queries", type=int, default=50, help="Stored vectors per shard used to measure the search latency")
+    ivf = commands.add_parser("build-ivf", help="Partition the vectors of the NumPy backend so searches only scan the closest lists")
+    ivf.add_argument("--lists", type=int, default=None, help="Number of lists per shard. Defaults to the square root of the number of chunks")
+    export = commands.add_parser("export", help="Write the whole index to one snapshot file")
+    export.add_argument("snapshot", help="Path of the snapshot file")
+    load = commands.add_parser("import", help="Load a snapshot into an empty vectorstore directory, without embedding")
+    load.add_argument("snapshot", help="Path of the snapshot file")
+    args = parser.parse_args()
+    prepare_vectordb.EMBEDDING_BACKEND = args.embedding_backend
+    prepare_vectordb.VECTOR_BACKEND = args.vector_backend
+
+    if args.command == "remove":
+        remove_sources(args.sources, args.persist_directory)
+    elif args.command == "reconcile":
+        result = reconcile_docs(args.docs_directory, args.persist_directory)
+        print(f"Removed {len(result['removed_sources'])} deleted sources ({result['deleted_chunks']} chunks), ingested {result['ingested_sources']} new or changed files.")
+        for source in result["removed_sources"]:
+            print(f"  removed {source}")
+    elif args.command == "build-ivf":
+        partitioned = build_ivf_indexes(args.persist_directory, args.lists)
+        for shard, chunks in partitioned.items():
+            print(f"Partitioned {chunks} chunks of shard '{shard}'.")
+    elif args.command == "export":
+        header = export_snapshot(args.snapshot, args.persist_directory)
+        chunks = sum(shard["count"] for shard in header["shards"].values())
+        print(f"Exported index version {header['index_version']} ({chunks} chunks in {len(header['shards'])} shards) to {args.snapshot}")
+    elif args.command == "import":
+        header = import_snapshot(args.snapshot, args.persist_directory)
+        chunks = sum(shard["count"] for shard in header["shards"].values())
+        print(f"Imported index version {header['index_version']} ({chunks} chunks in {len(header['shards'])} shards) into {args.persist_directory}")
+    else:
+        report = compact_vectorstore(args.persist_directory, args.sample_queries)
+        print(f"Dropped {report['dropped_chunks']} orphaned chunks.")
+        print(f"Size: {report['bytes_before'] / 1e6:.1f} MB -> {report['bytes_after'] / 1e6:.1f} MB, reclaimed {report['reclaimed_bytes'] / 1e6:.1f} MB")
+        print(f"Search latency: {format_latency(report['latency_before'])} -> {format_latency(report['latency_after'])}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import hashlib
+import threading
+import time
+import numpy as np
+
+class SemanticAnswerCache:
+    """
+    Cache of answers looked up by the meaning of the question.
+
+    Each answer is stored with the embedding of its question, its sources and how long it took to generate. A new
+    question reuses the answer of the most similar cached question if the cosine similarity is above the threshold.
+    Entries are scoped by index version, by the last messages of the chat history and by the summary of the earlier
+    conversation, and the whole cache is dropped when the index version changes, so answers never outlive the corpus
+    they were built from.
+    """
+    def __init__(self, embedding, threshold=0.95, max_entries=1000, history_window=2):
+        """
+        Parameters:
+        - embedding (Embeddings): Embedder used for the questions
+        - threshold (float): Minimum cosine similarity for two questions to share an answer
+        - max_entries (int): Maximum number of answers kept. The oldest ones are dropped first
+        - history_window (int): Number of previous chat messages that must match for an answer to be reused
+        """
+        self.embedding = embedding
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.history_window = history_window
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._scopes = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _scope_key(self, chat_history, summary):
+        recent = chat_history[-self.history_window:] if self.history_window else []
+        digest = hashlib.sha256()
+        digest.update(f"{summary}\0".encode("utf-8"))
+        for message in recent:
+            digest.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _check_version(self, index_version):
+        # Drop every answer once ingestion changed the corpus
+        if index_version != self.index_version:
+            self._scopes.clear()
+            self._size = 0
+            self.index_version = index_version
+
+    def _embed(self, question):
+        vector = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, question, chat_history, index_version, summary=""):
+        """
+        Find the answer of a similar question asked with the same recent history and summary on the same index version
+
+        Parameters:
+        - question (str): The user's question
+        - chat_history (list): List of previous chat messages
+        - index_version (int): Current version of the index
+        - summary (str, optional): Summary of the conversation before the chat history
+
+        Returns:
+        - tuple: (answer, context) of the cached answer, or None on a miss
+        """
+        start = time.perf_counter()
+        vector = self._embed(question)
+        with self._lock:
+            self._check_version(index_version)
+            scope = self._scopes.get(self._scope_key(chat_history, summary))
+            if scope is None or not scope["entries"]:
+                self.misses += 1
+                return None
+            similarities = np.stack(scope["vectors"]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry = scope["entries"][best]
+            self.hits += 1
+            self.seconds_saved += max(0.0, entry["latency"] - (time.perf_counter() - start))
+            return entry["answer"], entry["context"]
+
+    def store(self, question, chat_history, index_version, answer, context, latency, summary=""):
+        """
+        Store the answer to a question
+
+        Parameters:
+        - question (str): The user's question
+        - chat_history (list): Chat history the question was asked with
+        - index_version (int): Version of the index the answer was generated from
+        - answer (str): The generated answer
+        - context (list): Documents the answer was based on
+        - latency (float): Seconds it took to generate the answer
+        - summary (str, optional): Summary of the conversation the question was asked after
+        """
+        vector = self._embed(question)
+        with self._lock:
+            self._check_version(index_version)
+            scope = self._scopes.setdefault(self._scope_key(chat_history, summary), {"vectors": [], "entries": []})
+            scope["vectors"].append(vector)
+            scope["entries"].append({"answer": answer, "context": context, "latency": latency, "stored_at": time.time()})
+            self._size += 1
+            if self._size > self.max_entries:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        oldest_key = None
+        oldest_time = None
+        for key, scope in self._scopes.items():
+            if scope["entries"] and (oldest_time is None or scope["entries"][0]["stored_at"] < oldest_time):
+                oldest_key, oldest_time = key, scope["entries"][0]["stored_at"]
+        scope = self._scopes[oldest_key]
+        del scope["vectors"][0]
+        del scope["entries"][0]
+        if not scope["entries"]:
+            del self._scopes[oldest_key]
+        self._size -= 1
+
+    def stats(self):
+        """
+        Get the cache counters
+
+        Returns:
+        - dict: Hits, misses, hit rate, seconds saved and number of cached answers
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "seconds_saved": self.seconds_saved, "entries": self._size}
@@ -0,0 +1,230 @@
+from array import array
+import json
+import os
+import re
+import threading
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    """
+    Split a text into lowercase terms
+
+    Parameters:
+    - text (str): Text to tokenize
+
+    Returns:
+    - list: Terms of the text
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+def _as_numpy(postings, dtype):
+    # Postings are numpy views after loading and arrays once they were updated
+    return postings if isinstance(postings, np.ndarray) else np.frombuffer(postings, dtype=dtype)
+
+class BM25Index:
+    """
+    In-process BM25 inverted index over the chunks of the vectorstore.
+
+    Only chunk IDs and postings are kept: the text of the chunks stays in Chroma. The postings of every term are
+    stored in compact arrays of document positions and term frequencies and scored with NumPy. Chunks can be added
+    and deleted incrementally; deleted chunks are masked out until the index is compacted.
+    """
+    def __init__(self, k1=1.5, b=0.75):
+        """
+        Parameters:
+        - k1 (float): Term frequency saturation
+        - b (float): Strength of the document length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self.terms = {}
+        self.postings_docs = []
+        self.postings_freqs = []
+        self.chunk_ids = []
+        self.positions = {}
+        self.doc_lengths = array("I")
+        self.deleted = array("B")
+        self.live_count = 0
+        self.live_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self.live_count
+
+    def add(self, chunk_id, text):
+        """
+        Index a chunk. A chunk that is already indexed is replaced
+
+        Parameters:
+        - chunk_id (str): ID of the chunk
+        - text (str): Text of the chunk
+        """
+        counts = {}
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0) + 1
+        with self._lock:
+            if chunk_id in self.positions:
+                self.delete([chunk_id])
+            position = len(self.chunk_ids)
+            for term, count in counts.items():
+                term_id = self.terms.get(term)
+                if term_id is None:
+                    term_id = self.terms[term] = len(self.postings_docs)
+                    self.postings_docs.append(array("I"))
+                    self.postings_freqs.append(array("I"))
+                elif isinstance(self.postings_docs[term_id], np.ndarray):
+                    self.postings_docs[term_id] = array("I", self.postings_docs[term_id].tobytes())
+                    self.postings_freqs[term_id] = array("I", self.postings_freqs[term_id].tobytes())
+                self.postings_docs[term_id].append(position)
+                self.postings_freqs[term_id].append(count)
+            length = sum(counts.values())
+            self.chunk_ids.append(chunk_id)
+            self.positions[chunk_id] = position
+            self.doc_lengths.append(length)
+            self.deleted.append(0)
+            self.live_count += 1
+            self.live_length += length
+
+    def delete(self, chunk_ids):
+        """
+        Remove chunks from the index
+
+        Parameters:
+        - chunk_ids (list): IDs of the chunks to remove. Unknown IDs are ignored
+        """
+        with self._lock:
+            for chunk_id in chunk_ids:
+                position = self.positions.pop(chunk_id, None)
+                if position is None:
+                    continue
+                self.deleted[position] = 1
+                self.live_count -= 1
+                self.live_length -= self.doc_lengths[position]
+
+    def search(self, query, k=4):
+        """
+        Find the chunks that best match a query
+
+        Parameters:
+        - query (str): The query
+        - k (int): Number of chunks to return
+
+        Returns:
+        - list: Pairs of (chunk_id, score), best first
+        """
+        with self._lock:
+            if not self.live_count:
+                return []
+            doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32).astype(np.float32)
+            deleted = np.frombuffer(self.deleted, dtype=np.uint8).astype(bool)
+            average_length = self.live_length / self.live_count
+            scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+            for term in set(tokenize(query)):
+                term_id = self.terms.get(term)
+                if term_id is None:
+                    continue
+                docs = _as_numpy(self.postings_docs[term_id], np.uint32)
+                freqs = _as_numpy(self.postings_freqs[term_id], np.uint32).astype(np.float32)
+                document_frequency = int(np.count_nonzero(~deleted[docs]))
+                if not document_frequency:
+                    continue
+                idf = np.log(1 + (self.live_count - document_frequency + 0.5) / (document_frequency + 0.5))
+                # A document appears at most once in the postings of a term, so plain fancy indexing is safe
+                scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + self.k1 * (1 - self.b + self.b * doc_lengths[docs] / average_length))
+            scores[deleted] = 0
+            k = min(k, int(np.count_nonzero(scores)))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.chunk_ids[position], float(scores[position])) for position in top]
+
+    def compact(self):
+        """Rebuild the postings without the deleted chunks"""
+        with self._lock:
+            if self.live_count == len(self.chunk_ids):
+                return
+            deleted = np.frombuffer(self.deleted, dtype=np.uint8).astype(bool)
+            new_positions = np.cumsum(~deleted, dtype=np.int64) - 1
+            terms = {}
+            postings_docs = []
+            postings_freqs = []
+            for term, term_id in self.terms.items():
+                docs = _as_numpy(self.postings_docs[term_id], np.uint32)
+                keep = ~deleted[docs]
+                if not keep.any():
+                    continue
+                terms[term] = len(postings_docs)
+                postings_docs.append(array("I", new_positions[docs[keep]].astype(np.uint32).tobytes()))
+                postings_freqs.append(array("I", _as_numpy(self.postings_freqs[term_id], np.uint32)[keep].tobytes()))
+            live = np.flatnonzero(~deleted)
+            self.terms = terms
+            self.postings_docs = postings_docs
+            self.postings_freqs = postings_freqs
+            self.chunk_ids = [self.chunk_ids[position] for position in live]
+            self.positions = {chunk_id: position for position, chunk_id in enumerate(self.chunk_ids)}
+            self.doc_lengths = array("I", np.frombuffer(self.doc_lengths, dtype=np.uint32)[live].tobytes())
+            self.deleted = array("B", bytes(len(self.chunk_ids)))
+
+    def save(self, directory):
+        """
+        Write the index to a directory. The postings are concatenated into flat arrays with one offset per term
+
+        Parameters:
+        - directory (str): Directory where the index is stored
+        """
+        with self._lock:
+            # Compact when more than a quarter of the indexed chunks were deleted
+            if len(self.chunk_ids) and self.live_count < 0.75 * len(self.chunk_ids):
+                self.compact()
+            os.makedirs(directory, exist_ok=True)
+            term_list = sorted(self.terms, key=self.terms.get)
+            docs = [_as_numpy(self.postings_docs[self.terms[term]], np.uint32) for term in term_list]
+            freqs = [_as_numpy(self.postings_freqs[self.terms[term]], np.uint32) for term in term_list]
+            offsets = np.zeros(len(term_list) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(postings) for postings in docs])
+            empty = np.zeros(0, dtype=np.uint32)
+            arrays_path = os.path.join(directory, "postings.npz")
+            with open(arrays_path + ".tmp", "wb") as f:
+                np.savez(f, offsets=offsets, docs=np.concatenate(docs) if docs else empty, freqs=np.concatenate(freqs) if freqs else empty,
+                         doc_lengths=np.frombuffer(self.doc_lengths, dtype=np.uint32), deleted=np.frombuffer(self.deleted, dtype=np.uint8))
+            terms_path = os.path.join(directory, "terms.json")
+            with open(terms_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"k1": self.k1, "b": self.b, "terms": term_list, "chunk_ids": self.chunk_ids}, f)
+            os.replace(arrays_path + ".tmp", arrays_path)
+            os.replace(terms_path + ".tmp", terms_path)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Read an index from a directory
+
+        Parameters:
+        - directory (str): Directory where the index is stored
+
+        Returns:
+        - BM25Index: The index, empty if the directory does not contain one
+        """
+        terms_path = os.path.join(directory, "terms.json")
+        arrays_path = os.path.join(directory, "postings.npz")
+        if not os.path.exists(terms_path) or not os.path.exists(arrays_path):
+            return cls()
+        with open(terms_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        with np.load(arrays_path) as arrays:
+            offsets, docs, freqs = arrays["offsets"], arrays["docs"], arrays["freqs"]
+            index.doc_lengths = array("I", arrays["doc_lengths"].astype(np.uint32).tobytes())
+            index.deleted = array("B", arrays["deleted"].astype(np.uint8).tobytes())
+        index.terms = {term: term_id for term_id, term in enumerate(data["terms"])}
+        # Slices are views of the flat arrays; a term is copied into its own array only when it gets new postings
+        index.postings_docs = [docs[offsets[i]:offsets[i + 1]] for i in range(len(data["terms"]))]
+        index.postings_freqs = [freqs[offsets[i]:offsets[i + 1]] for i in range(len(data["terms"]))]
+        index.chunk_ids = data["chunk_ids"]
+        deleted = np.frombuffer(index.deleted, dtype=np.uint8).astype(bool)
+        index.positions = {chunk_id: position for position, chunk_id in enumerate(index.chunk_ids) if not deleted[position]}
+        index.live_count = len(index.positions)
+        index.live_length = int(np.frombuffer(index.doc_lengths, dtype=np.uint32)[~deleted].sum())
+        return index
@@ -0,0 +1,111 @@
+from collections import deque
+
+# Number of recent messages passed to the model word for word. Older ones are folded into the summary
+WINDOW_MESSAGES = 10
+# Messages folded into the summary at once, so the summary is not rewritten after every turn
+FOLD_MESSAGES = 4
+SUMMARY_MAX_TOKENS = 300
+# Messages kept for display. The model only sees the window and the summary
+TRANSCRIPT_MAX_MESSAGES = 200
+
+SUMMARY_PROMPT = """Update the summary of a conversation between a user and a chatbot that answers questions about documents.
+Keep the facts, names and open questions that later questions may refer to. Answer with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+def summarize_messages(llm, summary, messages, max_tokens=SUMMARY_MAX_TOKENS):
+    """
+    Fold messages into the summary of a conversation with the chat model
+
+    Parameters:
+    - llm: Chat model used to write the summary
+    - summary (str): Current summary, empty at the start of the conversation
+    - messages (list): Tuples of (role, text) to fold into the summary
+    - max_tokens (int): Approximate size of the summary
+
+    Returns:
+    - str: The updated summary
+    """
+    lines = "\n".join(f"{'User' if role == 'human' else 'Chatbot'}: {text}" for role, text in messages)
+    prompt = SUMMARY_PROMPT.format(max_words=max_tokens * 3 // 4, summary=summary or "(empty)", messages=lines)
+    return llm.invoke(prompt).content.strip()
+
+class ConversationMemory:
+    """
+    Memory of a chat session with a bounded size.
+
+    The last messages are kept word for word, and older ones are folded into a summary that is updated
+    incrementally, so the history sent with every question stays the same size however long the conversation
+    runs. Messages are stored as (role, text) tuples.
+    """
+    def __init__(self, window_messages=WINDOW_MESSAGES, fold_messages=FOLD_MESSAGES, summary_max_tokens=SUMMARY_MAX_TOKENS, transcript_max_messages=TRANSCRIPT_MAX_MESSAGES):
+        """
+        Parameters:
+        - window_messages (int): Number of recent messages kept word for word
+        - fold_messages (int): Number of messages folded into the summary at once
+        - summary_max_tokens (int): Approximate maximum size of the summary
+        - transcript_max_messages (int): Number of messages kept for display
+        """
+        self.window_messages = window_messages
+        self.fold_messages = fold_messages
+        self.summary_max_tokens = summary_max_tokens
+        self.summary = ""
+        self.turns = 0
+        self._recent = deque()
+        self.transcript = deque(maxlen=transcript_max_messages)
+
+    def add_turn(self, question, answer):
+        """
+        Add a question and its answer to the memory
+
+        Parameters:
+        - question (str): The user's question
+        - answer (str): The chatbot's answer
+        """
+        for message in (("human", question), ("ai", answer)):
+            self._recent.append(message)
+            self.transcript.append(message)
+        self.turns += 1
+
+    def needs_folding(self):
+        """
+        Check if the recent window is full and its oldest messages should be folded into the summary
+
+        Returns:
+        - bool: True if fold should be called
+        """
+        return len(self._recent) > self.window_messages
+
+    def fold(self, summarize):
+        """
+        Fold the oldest messages of the window into the summary
+
+        If the summarizer fails, the messages are appended to the summary as they are and the summary is cut to its
+        maximum size, so the memory stays bounded either way.
+
+        Parameters:
+        - summarize (callable): Called as summarize(summary, messages) and returns the updated summary
+        """
+        count = max(len(self._recent) - self.window_messages, min(self.fold_messages, len(self._recent)))
+        folded = [self._recent.popleft() for _ in range(count)]
+        try:
+            summary = summarize(self.summary, folded)
+        except Exception as e:
+            print(f"Error summarizing the conversation: {e}")
+            summary = "\n".join([self.summary] + [f"{role}: {text}" for role, text in folded]).strip()
+        # Roughly 4 characters per token. When cut, the oldest part of the summary is dropped
+        self.summary = summary[-self.summary_max_tokens * 4:]
+
+    def messages(self):
+        """
+        Get the recent messages in the format of the prompt
+
+        Returns:
+        - list: HumanMessage and AIMessage objects, oldest first
+        """
+        from langchain_core.messages import AIMessage, HumanMessage
+        return [HumanMessage(content=text) if role == "human" else AIMessage(content=text) for role, text in self._recent]
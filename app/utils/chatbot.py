@@ -1,29 +1,152 @@
 import streamlit as st
 from collections import defaultdict
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import AIMessage, HumanMessage
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+# LangChain and the Gemini client are imported where they are used, so the chat renders before they load
 from dotenv import load_dotenv
+from utils.resources import get_resource
+from utils.answer_cache import SemanticAnswerCache
+from utils.prepare_vectordb import ShardedStore, get_committed_version, get_bm25_index, get_vectorstore
+from utils.chat_memory import summarize_messages
+from utils import metrics
 import os
-def get_context_retriever_chain(vectordb):
+import threading
+import time
+
+LLM_MODEL = "gemini-pro"
+LLM_TEMPERATURE = 0.2
+# Set LLM_BACKEND=fake to answer with a fixed offline response (benchmarks and runs without an API key)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "google")
+FAKE_ANSWER = "This answer was generated by the offline fake model."
+# Questions whose embeddings are at least this similar share the same cached answer
+ANSWER_CACHE_THRESHOLD = 0.95
+# Retrieved chunks are reranked for diversity and packed into this many estimated tokens of context
+RETRIEVAL_CANDIDATES = 12
+CONTEXT_TOKEN_BUDGET = 2000
+# Older messages of the conversation reach the model through this line of the system prompt
+SUMMARY_TEMPLATE = " Summary of the earlier conversation: {summary}"
+# Number of per-answer timings kept in the session
+MAX_RESPONSE_METRICS = 100
+
+def get_llm():
+    """
+    Get the chat model shared by every session. It is built once per process and rebuilt if its configuration changes
+
+    Requests go through the shared llm client, which coalesces identical requests in flight, caps their
+    concurrency and retries them.
+
+    Returns:
+    - ResilientChatModel: The chat model
+    """
+    def build():
+        from utils.resilient_client import ResilientChatModel, get_client
+        # Load environment variables (gets api keys for the models)
+        load_dotenv()
+        if LLM_BACKEND == "fake":
+            from utils.fakes import FakeChatModel
+            model = FakeChatModel(responses=[FAKE_ANSWER])
+        else:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            model = ChatGoogleGenerativeAI(model=LLM_MODEL, temperature=LLM_TEMPERATURE, convert_system_message_to_human=True)
+        return ResilientChatModel(model=model, client=get_client("llm"))
+
+    return get_resource("llm", build, fingerprint=(LLM_BACKEND, LLM_MODEL, LLM_TEMPERATURE))
+
+def get_scope(vectordb):
+    """
+    Get the name of the shards a vector database searches, so caches and chains are kept apart per scope
+
+    Parameters:
+    - vectordb: Vector database used for context retrieval
+
+    Returns:
+    - str: The shard names, or "default" for a single collection
+    """
+    return ",".join(vectordb.names) if isinstance(vectordb, ShardedStore) else "default"
+
+def get_answer_cache(vectordb):
+    """
+    Get the semantic answer cache shared by every session searching the same shards
+
+    Parameters:
+    - vectordb: Vector database whose embedder is used for the questions
+
+    Returns:
+    - SemanticAnswerCache: The answer cache
+    """
+    embedding = vectordb.embeddings
+    return get_resource(f"answer_cache:{get_scope(vectordb)}", lambda: SemanticAnswerCache(embedding, threshold=ANSWER_CACHE_THRESHOLD), fingerprint=(embedding, ANSWER_CACHE_THRESHOLD))
+
+def record_cache_stats(cache, vectordb):
+    """
+    Export the hit rate, seconds saved and number of answers of an answer cache as gauges, labelled with its scope
+
+    Parameters:
+    - cache (SemanticAnswerCache): The answer cache
+    - vectordb: Vector database the cache belongs to
+    """
+    stats = cache.stats()
+    scope = get_scope(vectordb)
+    metrics.set_gauge("answer_cache_hit_rate", stats["hit_rate"], scope=scope)
+    metrics.set_gauge("answer_cache_seconds_saved", stats["seconds_saved"], scope=scope)
+    metrics.set_gauge("answer_cache_entries", stats["entries"], scope=scope)
+
+def get_context_retriever_chain(vectordb, llm=None):
     """
     Create a context retriever chain for generating responses based on the chat history and vector database
 
+    When no model is given, the chain built with the shared model is reused until the vector database or the model changes.
+
     Parameters:
     - vectordb: Vector database used for context retrieval
+    - llm (optional): Chat model used to answer. Defaults to Gemini Pro
 
     Returns:
     - retrieval_chain: Context retriever chain for generating responses
     """
-    # Load environment variables (gets api keys for the models)
-    load_dotenv()
-    # Initialize the model, set the retreiver and prompt for the chatbot
-    llm = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.2, convert_system_message_to_human=True)
-    retriever = vectordb.as_retriever()
+    if llm is None:
+        shared_llm = get_llm()
+        return get_resource(f"retrieval_chain:{get_scope(vectordb)}", lambda: build_context_retriever_chain(vectordb, shared_llm), fingerprint=(vectordb, shared_llm))
+    return build_context_retriever_chain(vectordb, llm)
+
+def build_retriever(vectordb):
+    """
+    Build the retriever of a vector database
+
+    Vector hits are fused with BM25 hits so exact names and identifiers are found, and only the last committed index
+    version is queried, so background ingestion never exposes half written content. The best chunks are packed into
+    a token budget, so the prompt size does not depend on the chunk size. The shards of a sharded store are searched
+    concurrently.
+
+    Parameters:
+    - vectordb (Chroma or ShardedStore): Vector database used for context retrieval
+
+    Returns:
+    - BaseRetriever: The retriever
+    """
+    from utils.hybrid_retriever import HybridRetriever, ShardedRetriever
+    max_version = get_committed_version(vectordb)
+    if isinstance(vectordb, ShardedStore):
+        retrievers = [HybridRetriever(vectordb=shard, index=get_bm25_index(shard), max_version=max_version, k=RETRIEVAL_CANDIDATES) for shard in vectordb.shards.values()]
+        return ShardedRetriever(retrievers=retrievers, k=RETRIEVAL_CANDIDATES, token_budget=CONTEXT_TOKEN_BUDGET)
+    return HybridRetriever(vectordb=vectordb, index=get_bm25_index(vectordb), max_version=max_version, k=RETRIEVAL_CANDIDATES, token_budget=CONTEXT_TOKEN_BUDGET)
+
+def build_context_retriever_chain(vectordb, llm):
+    """
+    Build a context retriever chain for generating responses based on the chat history and vector database
+
+    Parameters:
+    - vectordb: Vector database used for context retrieval
+    - llm: Chat model used to answer
+
+    Returns:
+    - retrieval_chain: Context retriever chain for generating responses
+    """
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain.chains import create_retrieval_chain
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    # Set the retreiver and prompt for the chatbot
+    retriever = build_retriever(vectordb)
     prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a chatbot. You'll receive a prompt that includes a chat history and retrieved content from the vectorDB based on the user's question. Your task is to respond to the user's question using the information from the vectordb, relying as little as possible on your own knowledge. If for some reason you don't know the answer for the question, or the question cannot be answered because there's no context, ask the user for more details. Do not invent an answer. Answer the questions from this context: {context}"),
+        ("system", "You are a chatbot. You'll receive a prompt that includes a chat history and retrieved content from the vectorDB based on the user's question. Your task is to respond to the user's question using the information from the vectordb, relying as little as possible on your own knowledge. If for some reason you don't know the answer for the question, or the question cannot be answered because there's no context, ask the user for more details. Do not invent an answer. Answer the questions from this context: {context}{summary}"),
         MessagesPlaceholder(variable_name="chat_history"),
         ("human", "{input}")
     ])
@@ -32,7 +155,19 @@ def get_context_retriever_chain(vectordb):
     retrieval_chain = create_retrieval_chain(retriever, chain)
     return retrieval_chain
 
-def get_response(question, chat_history, vectordb):
+def format_summary(summary):
+    """
+    Format the summary of the earlier conversation for the system prompt
+
+    Parameters:
+    - summary (str): Summary of the messages that are no longer passed word for word
+
+    Returns:
+    - str: The text added to the system prompt, empty if there is no summary
+    """
+    return SUMMARY_TEMPLATE.format(summary=summary) if summary else ""
+
+def get_response(question, chat_history, vectordb, llm=None, use_cache=True, summary=""):
     """
     Generate a response to the user's question based on the chat history and vector database
 
@@ -40,48 +175,189 @@ def get_response(question, chat_history, vectordb):
     - question (str): The user's question
     - chat_history (list): List of previous chat messages
     - vectordb: Vector database used for context retrieval
+    - llm (optional): Chat model used to answer. Defaults to Gemini Pro
+    - use_cache (bool): Flag to indicate if answers to similar questions can be reused
+    - summary (str, optional): Summary of the conversation before the chat history
 
     Returns:
     - response: The generated response
     - context: The context associated with the response
     """
-    chain = get_context_retriever_chain(vectordb)
-    response = chain.invoke({"input": question, "chat_history": chat_history})
-    return response["answer"], response["context"]
+    from utils.tracing import TracingCallbackHandler
+    with metrics.span("answer"):
+        if use_cache:
+            cache = get_answer_cache(vectordb)
+            index_version = get_committed_version(vectordb)
+            with metrics.span("answer_cache_lookup"):
+                cached = cache.lookup(question, chat_history, index_version, summary)
+            record_cache_stats(cache, vectordb)
+            if cached is not None:
+                metrics.increment("answer_cache_hits_total")
+                return cached
+            metrics.increment("answer_cache_misses_total")
+        start = time.perf_counter()
+        chain = get_context_retriever_chain(vectordb, llm)
+        with metrics.span("retrieval_chain"):
+            response = chain.invoke({"input": question, "chat_history": chat_history, "summary": format_summary(summary)}, config={"callbacks": [TracingCallbackHandler()]})
+        if use_cache:
+            cache.store(question, chat_history, index_version, response["answer"], response["context"], time.perf_counter() - start, summary)
+            record_cache_stats(cache, vectordb)
+        return response["answer"], response["context"]
 
-def chat(chat_history, vectordb):
+def stream_response(question, chat_history, vectordb, llm=None, use_cache=True, summary=""):
     """
-    Handle the chat functionality of the application
+    Generate a response to the user's question, yielding the answer token by token as the model produces it
 
     Parameters:
+    - question (str): The user's question
     - chat_history (list): List of previous chat messages
     - vectordb: Vector database used for context retrieval
+    - llm (optional): Chat model used to answer. Defaults to Gemini Pro
+    - use_cache (bool): Flag to indicate if answers to similar questions can be reused
+    - summary (str, optional): Summary of the conversation before the chat history
+
+    Yields:
+    - tuple: ("context", documents) once retrieval finishes, ("token", text) for every piece of the answer and
+      ("metrics", dict) at the end with the time to retrieval, time to first token, total latency in seconds,
+      the estimated prompt tokens sent to the model and whether the answer came from the cache
+    """
+    from utils.tracing import TracingCallbackHandler
+    started_at = time.time()
+    start = time.perf_counter()
+    response_metrics = {"time_to_retrieval": None, "time_to_first_token": None, "total": None, "prompt_tokens": 0, "cache_hit": False}
+    if use_cache:
+        cache = get_answer_cache(vectordb)
+        index_version = get_committed_version(vectordb)
+        cached = cache.lookup(question, chat_history, index_version, summary)
+        record_cache_stats(cache, vectordb)
+        if cached is not None:
+            answer, context = cached
+            elapsed = time.perf_counter() - start
+            response_metrics.update({"time_to_retrieval": elapsed, "time_to_first_token": elapsed, "total": elapsed, "cache_hit": True})
+            metrics.increment("answer_cache_hits_total")
+            metrics.record_span("answer", started_at, elapsed, cache_hit=True)
+            yield "context", context
+            yield "token", answer
+            yield "metrics", response_metrics
+            return
+        metrics.increment("answer_cache_misses_total")
+    chain = get_context_retriever_chain(vectordb, llm)
+    answer = ""
+    context = []
+    tracing = TracingCallbackHandler()
+    for part in chain.stream({"input": question, "chat_history": chat_history, "summary": format_summary(summary)}, config={"callbacks": [tracing]}):
+        if "context" in part:
+            response_metrics["time_to_retrieval"] = time.perf_counter() - start
+            context = part["context"]
+            yield "context", context
+        if part.get("answer"):
+            if response_metrics["time_to_first_token"] is None:
+                response_metrics["time_to_first_token"] = time.perf_counter() - start
+                metrics.observe("time_to_first_token_seconds", response_metrics["time_to_first_token"])
+            answer += part["answer"]
+            yield "token", part["answer"]
+    response_metrics["total"] = time.perf_counter() - start
+    response_metrics["prompt_tokens"] = tracing.prompt_tokens
+    # The generator is consumed across Streamlit writes, so the span is recorded once the answer is complete
+    metrics.record_span("answer", started_at, response_metrics["total"], cache_hit=False)
+    if use_cache:
+        cache.store(question, chat_history, index_version, answer, context, response_metrics["total"], summary)
+        record_cache_stats(cache, vectordb)
+    yield "metrics", response_metrics
+
+def warm_up():
+    """
+    Load the chat model, the vectorstore and the retrieval chain on a background thread, once per process
+
+    The page is rendered without them, and the first question finds them ready. Errors are only printed, the first
+    question reports them to the user.
+    """
+    def load():
+        try:
+            with metrics.span("warm_up"):
+                get_llm()
+                vectordb = get_vectorstore([], from_session_state=True)
+                if vectordb is not None:
+                    get_context_retriever_chain(vectordb)
+        except Exception as e:
+            print(f"Error warming up the chatbot: {e}")
+
+    def build():
+        thread = threading.Thread(target=load, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    get_resource("warm_up", build)
+
+def display_sources(context):
+    """
+    Display the sources of a response on the sidebar
+
+    Parameters:
+    - context (list): Documents retrieved for the response
+    """
+    with st.sidebar:
+        metadata_dict = defaultdict(list)
+        labels = {}
+        for metadata in [doc.metadata for doc in context]:
+            # Chunks of text files have a character offset instead of a page
+            if "page" not in metadata and "offset" in metadata:
+                labels[metadata['source']] = "Offsets"
+                metadata_dict[metadata['source']].append(metadata["offset"])
+            else:
+                metadata_dict[metadata['source']].append(metadata.get('page', 0))
+        for source, pages in metadata_dict.items():
+            st.write(f"Source: {source}")
+            st.write(f"{labels.get(source, 'Pages')}: {', '.join(map(str, pages))}")
+
+def chat(memory, vectordb):
+    """
+    Handle the chat functionality of the application
+
+    Parameters:
+    - memory (ConversationMemory): Memory of the session's conversation, updated in place
+    - vectordb: Vector database used for context retrieval, or a function returning it. The function is only called
+      when a question is asked, so the vectorstore is not opened to render the page
 
     Returns:
-    - chat_history: Updated chat history
+    - memory: The updated memory
     """
     user_query = st.chat_input("Ask a question:")
-    if user_query is not None and user_query != "":
-        # Generate response based on user's query, chat history and vectorstore
-        response, context = get_response(user_query, chat_history, vectordb)
-        # Update chat history. The model uses up to 10 previous messages to incorporate into the response
-        chat_history = chat_history + [HumanMessage(content=user_query), AIMessage(content=response)]
-        # Display source of the response on sidebar
-        with st.sidebar:
-                metadata_dict = defaultdict(list)
-                for metadata in [doc.metadata for doc in context]:
-                    metadata_dict[metadata['source']].append(metadata['page'])
-                for source, pages in metadata_dict.items():
-                    st.write(f"Source: {source}")
-                    st.write(f"Pages: {', '.join(map(str, pages))}")
     # Display chat history
-    for message in chat_history:
-            with st.chat_message("AI" if isinstance(message, AIMessage) else "Human"):
-                st.write(message.content)
-    return chat_history
+    for role, text in memory.transcript:
+            with st.chat_message("AI" if role == "ai" else "Human"):
+                st.write(text)
+    if user_query is not None and user_query != "":
+        with st.chat_message("Human"):
+            st.write(user_query)
+        if callable(vectordb):
+            vectordb = vectordb()
+        # Stream the response based on user's query, recent messages, summary of the older ones and vectorstore
+        response_metrics = {}
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-import os
+        def answer_tokens():
+            for kind, value in stream_response(user_query, memory.messages(), vectordb, summary=memory.summary):
+                if kind == "context":
+                    # Display source of the response on sidebar as soon as retrieval finishes
+                    display_sources(value)
+                elif kind == "token":
+                    yield value
+                else:
+                    response_metrics.update(value)
+
+        with st.chat_message("AI"):
+            response = st.write_stream(answer_tokens())
+            if response_metrics["cache_hit"]:
+                st.caption(f"Answered from cache in {response_metrics['total']:.2f}s")
+            else:
+                st.caption(f"Retrieval {response_metrics['time_to_retrieval']:.2f}s · first token {response_metrics['time_to_first_token'] or response_metrics['total']:.2f}s · total {response_metrics['total']:.2f}s · prompt ~{response_metrics['prompt_tokens']} tokens")
+        st.session_state.response_metrics = st.session_state.response_metrics[-MAX_RESPONSE_METRICS + 1:] + [response_metrics]
+        # Update the memory. The model gets the last messages word for word and a summary of the older ones
+        memory.add_turn(user_query, response)
+        if memory.needs_folding():
+            with metrics.span("summarize_history"):
+                memory.fold(lambda summary, messages: summarize_messages(get_llm(), summary, messages))
+    return memory
 
 def get_text_response(user_input):
     """
@@ -105,6 +381,7 @@ def get_text_response(user_input):
 
 
     # Initialize the model with system message conversion to human message
+    from langchain_google_genai import ChatGoogleGenerativeAI
     llm = ChatGoogleGenerativeAI(
         model="gemini-1.5-pro", 
         temperature=0,
@@ -0,0 +1,118 @@
+from langchain_core.documents import Document
+from utils.embedding_pipeline import estimate_tokens
+import numpy as np
+
+# Weight of relevance against redundancy when passages are selected. 1 only looks at relevance
+MMR_LAMBDA = 0.7
+# Longest overlap looked for when two neighbouring chunks are merged
+MAX_MERGE_OVERLAP = 2000
+
+def select_mmr(scores, vectors, lambda_mult=MMR_LAMBDA):
+    """
+    Order candidates by maximal marginal relevance, so passages that repeat an already selected one come last
+
+    Parameters:
+    - scores (list): Relevance score of every candidate, higher is better
+    - vectors (list): Embedding of every candidate
+    - lambda_mult (float): Weight of relevance against redundancy
+
+    Returns:
+    - list: Indexes of the candidates, in the order they should be used
+    """
+    if not scores:
+        return []
+    relevance = np.asarray(scores, dtype=np.float64)
+    relevance = relevance / (relevance.max() or 1.0)
+    matrix = np.asarray(vectors, dtype=np.float64)
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    similarity = matrix @ matrix.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    remaining = set(range(len(scores))) - set(selected)
+    while remaining:
+        candidates = list(remaining)
+        values = lambda_mult * relevance[candidates] - (1 - lambda_mult) * redundancy[candidates]
+        best = candidates[int(np.argmax(values))]
+        selected.append(best)
+        remaining.discard(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+def join_overlapping(first, second, max_overlap=MAX_MERGE_OVERLAP):
+    """
+    Join two consecutive chunks, writing the text they share through the splitter overlap only once
+
+    Parameters:
+    - first (str): Text of the first chunk
+    - second (str): Text of the chunk that follows it
+    - max_overlap (int): Longest overlap looked for
+
+    Returns:
+    - str: The joined text
+    """
+    for size in range(min(len(first), len(second), max_overlap), 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+def merge_neighbours(docs):
+    """
+    Merge chunks that follow each other in the same source into one passage
+
+    Chunks without a chunk index are kept as they are. Every passage keeps the position of its first chunk in the
+    list, so the most relevant passages stay first.
+
+    Parameters:
+    - docs (list): Selected chunks, most relevant first
+
+    Returns:
+    - list: The passages
+    """
+    order = {id(doc): position for position, doc in enumerate(docs)}
+    by_source = {}
+    passages = []
+    for doc in docs:
+        if doc.metadata.get("chunk_index") is None:
+            passages.append((order[id(doc)], doc))
+        else:
+            by_source.setdefault(doc.metadata.get("source"), []).append(doc)
+    for chunks in by_source.values():
+        chunks.sort(key=lambda doc: doc.metadata["chunk_index"])
+        group = [chunks[0]]
+        for doc in chunks[1:] + [None]:
+            if doc is not None and doc.metadata["chunk_index"] == group[-1].metadata["chunk_index"] + 1:
+                group.append(doc)
+                continue
+            text = group[0].page_content
+            for member in group[1:]:
+                text = join_overlapping(text, member.page_content)
+            metadata = dict(group[0].metadata)
+            if len(group) > 1:
+                metadata["merged_chunks"] = len(group)
+            passages.append((min(order[id(member)] for member in group), Document(page_content=text, metadata=metadata)))
+            group = [doc]
+    return [doc for _, doc in sorted(passages, key=lambda passage: passage[0])]
+
+def pack_context(docs, token_budget):
+    """
+    Fit passages into a token budget, in order of preference, merging neighbouring chunks
+
+    A passage that does not fit is skipped and the next ones are still tried. The first passage is always kept,
+    cut to the budget if it is too long on its own.
+
+    Parameters:
+    - docs (list): Candidate chunks, in order of preference
+    - token_budget (int): Maximum estimated tokens of the packed context
+
+    Returns:
+    - list: The packed passages
+    """
+    selected = []
+    for doc in docs:
+        trial = merge_neighbours(selected + [doc])
+        if not selected or sum(estimate_tokens(passage.page_content) for passage in trial) <= token_budget:
+            selected.append(doc)
+    passages = merge_neighbours(selected)
+    if passages and estimate_tokens(passages[0].page_content) > token_budget:
+        passages[0] = Document(page_content=passages[0].page_content[:token_budget * 4], metadata=passages[0].metadata)
+    return passages
@@ -0,0 +1,311 @@
+from collections import Counter
+from utils.bm25_index import tokenize
+import hashlib
+import numpy as np
+import os
+import sqlite3
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Chunks whose 64 bit SimHash signatures differ in at most this many bits are near duplicates
+SIMHASH_MAX_DISTANCE = 3
+# Signatures are split into this many bands for the lookup. Two signatures within SIMHASH_MAX_DISTANCE bits share at
+# least one band exactly, as long as there are more bands than allowed differing bits
+SIMHASH_BANDS = 4
+# Near duplicates are detected on overlapping runs of this many words
+SHINGLE_WORDS = 3
+
+def text_hash(text):
+    """
+    Hash a text for exact duplicate detection, ignoring case and whitespace
+
+    Parameters:
+    - text (str): Text of a chunk
+
+    Returns:
+    - str: Hex digest of the normalized text
+    """
+    return hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).hexdigest()
+
+def simhash(text, shingle_words=SHINGLE_WORDS):
+    """
+    Compute the 64 bit SimHash signature of a text, over its word shingles
+
+    Texts that share most of their shingles get signatures that differ in few bits.
+
+    Parameters:
+    - text (str): Text of a chunk
+    - shingle_words (int): Number of words per shingle
+
+    Returns:
+    - int: The signature, as a signed 64 bit integer so it can be stored in SQLite
+    """
+    words = tokenize(text)
+    shingles = [" ".join(words[start:start + shingle_words]) for start in range(max(1, len(words) - shingle_words + 1))]
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little") for shingle in shingles], dtype=np.uint64)
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    # Every bit of the signature is set when most shingle hashes have it set
+    signature = int(np.packbits(bits.sum(axis=0) * 2 > len(shingles), bitorder="little").view(np.uint64)[0])
+    return signature - (1 << 64) if signature >= 1 << 63 else signature
+
+def hamming_distance(first, second):
+    """
+    Count the bits that differ between two signatures
+
+    Parameters:
+    - first (int): A signature
+    - second (int): Another signature
+
+    Returns:
+    - int: Number of differing bits
+    """
+    return bin((first ^ second) & ((1 << 64) - 1)).count("1")
+
+def acquire_file_lock(path):
+    """
+    Take an exclusive lock on a file, waiting for as long as another process or thread holds it
+
+    Parameters:
+    - path (str): Path of the lock file. Created if missing
+
+    Returns:
+    - file: The open lock file. The lock is held until release_file_lock is called with it
+    """
+    handle = open(path, "a+b")
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("Waiting for another ingestion or maintenance run to finish...")
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        return handle
+    handle.seek(0)
+    while True:
+        # msvcrt gives up after 10 seconds, so the lock is requested until it is granted
+        try:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+            return handle
+        except OSError:
+            pass
+
+def release_file_lock(handle):
+    """
+    Release a lock taken with acquire_file_lock
+
+    Parameters:
+    - handle (file): The open lock file
+    """
+    if fcntl is None:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    handle.close()
+
+def signature_bands(signature, bands=SIMHASH_BANDS):
+    """
+    Split a signature into the bands used for the lookup
+
+    Parameters:
+    - signature (int): The signature
+    - bands (int): Number of bands
+
+    Returns:
+    - list: Value of every band
+    """
+    width = 64 // bands
+    unsigned = signature & ((1 << 64) - 1)
+    return [(unsigned >> (band * width)) & ((1 << width) - 1) for band in range(bands)]
+
+class DedupIndex:
+    """
+    Persistent index of the chunks stored in the vectorstore, used to skip duplicate chunks before they are embedded.
+
+    Every stored chunk is recorded with the hash of its normalized text and its SimHash signature, and every source
+    records the chunks it uses, with the number of times it uses each. A chunk that is identical or nearly identical
+    to a stored chunk of the same shard is not embedded again: its source references the stored chunk instead. When a
+    changed source is ingested again, only identical chunks of its previous version are reused. A stored chunk is
+    only deleted once no source references it anymore.
+
+    The changes of an ingestion run are kept in one transaction, committed with the manifest. The changes of a
+    source that fails are rolled back. A lock file next to the index is held while it is open, so other writers of the
+    vectorstore wait for as long as it takes instead of failing when the SQLite busy timeout expires.
+    """
+    def __init__(self, path, max_distance=SIMHASH_MAX_DISTANCE, detect=True):
+        """
+        Parameters:
+        - path (str): Path of the SQLite file of the index
+        - max_distance (int): Maximum number of differing signature bits between near duplicates
+        - detect (bool): Flag to indicate if duplicates are looked for. If not, every chunk is only recorded
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Another ingestion run waits here until this one closes the index
+        self._lock_file = acquire_file_lock(path + ".lock")
+        try:
+            # Transactions are managed explicitly
+            self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, shard TEXT NOT NULL, owner TEXT NOT NULL, text_hash TEXT NOT NULL, simhash INTEGER NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS chunks_text_hash ON chunks (shard, text_hash)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS bands (shard TEXT NOT NULL, band INTEGER NOT NULL, value INTEGER NOT NULL, chunk_id TEXT NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS bands_value ON bands (shard, band, value)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS bands_chunk ON bands (chunk_id)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS refs (chunk_id TEXT NOT NULL, source TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (chunk_id, source))")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS refs_source ON refs (source)")
+            self.max_distance = max_distance
+            self.detect = detect
+            self.touched = set()
+            self._source_refs = None
+            self._connection.execute("BEGIN IMMEDIATE")
+        except Exception:
+            release_file_lock(self._lock_file)
+            raise
+
+    def start_source(self):
+        """Start recording the chunks of a source"""
+        self._source_refs = Counter()
+        self._connection.execute("SAVEPOINT source")
+
+    def check(self, shard, chunk_id, source, text):
+        """
+        Look for a stored chunk that duplicates a new chunk. If there is none, the new chunk is recorded as stored
+
+        Parameters:
+        - shard (str): Shard the chunk is written to
+        - chunk_id (str): ID of the new chunk
+        - source (str): Source of the new chunk
+        - text (str): Text of the new chunk
+
+        Returns:
+        - tuple: (chunk_id, kind) of the stored chunk it duplicates, kind being exact or near, or (None, None)
+        """
+        digest = text_hash(text)
+        row = self._connection.execute("SELECT chunk_id FROM chunks WHERE shard = ? AND text_hash = ? LIMIT 1", (shard, digest)).fetchone() if self.detect else None
+        if row is not None:
+            self._source_refs[row[0]] += 1
+            return row[0], "exact"
+        signature = simhash(text)
+        bands = signature_bands(signature)
+        best = None
+        # The chunks of the version of the source being replaced only count as exact duplicates, otherwise an
+        # edited chunk would be matched to its own previous text and the edit would never be stored
+        for band, value in enumerate(bands if self.detect else []):
+            for candidate_id, candidate_signature in self._connection.execute(
+                    "SELECT chunks.chunk_id, chunks.simhash FROM bands JOIN chunks ON chunks.chunk_id = bands.chunk_id WHERE bands.shard = ? AND bands.band = ? AND bands.value = ? "
+                    "AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.chunk_id = chunks.chunk_id AND refs.source = ?)", (shard, band, value, source)):
+                distance = hamming_distance(signature, candidate_signature)
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (candidate_id, distance)
+        if best is not None:
+            self._source_refs[best[0]] += 1
+            return best[0], "near"
+        self._connection.execute("INSERT OR REPLACE INTO chunks (chunk_id, shard, owner, text_hash, simhash) VALUES (?, ?, ?, ?, ?)", (chunk_id, shard, source, digest, signature))
+        self._connection.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+        self._connection.executemany("INSERT INTO bands (shard, band, value, chunk_id) VALUES (?, ?, ?, ?)", [(shard, band, value, chunk_id) for band, value in enumerate(bands)])
+        self._source_refs[chunk_id] += 1
+        return None, None
+
+    def finish_source(self, source):
+        """
+        Replace the chunks referenced by a source with the ones recorded since start_source
+
+        Parameters:
+        - source (str): The source
+        """
+        previous = [chunk_id for (chunk_id,) in self._connection.execute("SELECT chunk_id FROM refs WHERE source = ?", (source,))]
+        self._connection.execute("DELETE FROM refs WHERE source = ?", (source,))
+        self._connection.executemany("INSERT INTO refs (chunk_id, source, count) VALUES (?, ?, ?)", [(chunk_id, source, count) for chunk_id, count in self._source_refs.items()])
+        self._connection.execute("RELEASE source")
+        self.touched.update(previous)
+        self.touched.update(self._source_refs)
+        self._source_refs = None
+
+    def abort_source(self):
+        """Forget what was recorded since start_source, after the source failed"""
+        self._connection.execute("ROLLBACK TO source")
+        self._connection.execute("RELEASE source")
+        self._source_refs = None
+
+    def remove_source(self, source):
+        """
+        Drop the references of a source that is no longer in the vectorstore
+
+        Parameters:
+        - source (str): The source
+        """
+        self.touched.update(chunk_id for (chunk_id,) in self._connection.execute("SELECT chunk_id FROM refs WHERE source = ?", (source,)))
+        self._connection.execute("DELETE FROM refs WHERE source = ?", (source,))
+
+    def unreferenced(self, chunk_ids):
+        """
+        Keep the chunks that no source references anymore and forget them, so the caller can delete them
+
+        Parameters:
+        - chunk_ids (list): IDs of chunks a source no longer uses
+
+        Returns:
+        - list: The IDs that can be deleted from the vectorstore
+        """
+        unused = []
+        for chunk_id in dict.fromkeys(chunk_ids):
+            if self._connection.execute("SELECT 1 FROM refs WHERE chunk_id = ? LIMIT 1", (chunk_id,)).fetchone() is None:
+                unused.append(chunk_id)
+                self._connection.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,))
+                self._connection.execute("DELETE FROM bands WHERE chunk_id = ?", (chunk_id,))
+                self.touched.discard(chunk_id)
+        return unused
+
+    def update_references(self, open_vectorstore):
+        """
+        Record on every chunk whose references changed the other sources that contain it and its number of duplicates
+
+        The sources are written to the duplicate_sources metadata, separated by "; ", and the number of skipped
+        copies to duplicate_count. A chunk whose source no longer uses it is attributed to a source that does.
+
+        Parameters:
+        - open_vectorstore (callable): Called with a shard name, returns its vectorstore
+
+        Returns:
+        - int: Number of chunks updated
+        """
+        by_shard = {}
+        for chunk_id in self.touched:
+            row = self._connection.execute("SELECT shard, owner FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row is None:
+                continue
+            refs = self._connection.execute("SELECT source, count FROM refs WHERE chunk_id = ? ORDER BY source", (chunk_id,)).fetchall()
+            if not refs:
+                continue
+            shard, owner = row
+            if owner not in dict(refs):
+                owner = refs[0][0]
+                self._connection.execute("UPDATE chunks SET owner = ? WHERE chunk_id = ?", (owner, chunk_id))
+            others = [source for source, _ in refs if source != owner]
+            by_shard.setdefault(shard, {})[chunk_id] = {"source": owner, "duplicate_sources": "; ".join(others), "duplicate_count": sum(count for _, count in refs) - 1}
+        updated = 0
+        for shard, changes in by_shard.items():
+            vectordb = open_vectorstore(shard)
+            ids = list(changes)
+            for start in range(0, len(ids), 500):
+                stored = vectordb.get(ids=ids[start:start + 500], include=["metadatas"])
+                if not stored["ids"]:
+                    continue
+                metadatas = [{**(metadata or {}), **changes[chunk_id]} for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])]
+                vectordb._collection.update(ids=stored["ids"], metadatas=metadatas)
+                updated += len(stored["ids"])
+        self.touched.clear()
+        return updated
+
+    def commit(self):
+        """Commit the changes and start the transaction of the next changes"""
+        self._connection.execute("COMMIT")
+        self._connection.execute("BEGIN IMMEDIATE")
+
+    def close(self):
+        """Roll back what was not committed and close the index"""
+        try:
+            self._connection.execute("ROLLBACK")
+            self._connection.close()
+        finally:
+            release_file_lock(self._lock_file)
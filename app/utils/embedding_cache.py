@@ -0,0 +1,152 @@
+from langchain_core.embeddings import Embeddings
+from utils import metrics
+from array import array
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+def normalize_text(text):
+    """
+    Normalize a text before hashing it, so texts that only differ in whitespace share the same cache entry
+
+    Parameters:
+    - text (str): Text to normalize
+
+    Returns:
+    - str: Normalized text
+    """
+    return " ".join(text.split())
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that keeps every computed vector in a local SQLite file.
+
+    Vectors are keyed by the model name, the kind of embedding (document or query) and the hash of the normalized
+    text, and are stored as float32 blobs. When the cache grows past max_entries the least recently used vectors
+    are evicted. Only the texts that are not in the cache are sent to the wrapped embedder.
+    """
+    def __init__(self, embedding, path, max_entries=200_000, model_name=None):
+        """
+        Parameters:
+        - embedding (Embeddings): The embedder whose results are cached
+        - path (str): Path of the SQLite file used as cache
+        - max_entries (int): Maximum number of vectors kept in the cache
+        - model_name (str, optional): Name used in the cache key. Defaults to the model attribute of the embedder
+        """
+        self.embedding = embedding
+        self.path = path
+        self.max_entries = max_entries
+        self.model_name = model_name or getattr(embedding, "model", None) or type(embedding).__name__
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._database = None
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @property
+    def _connection(self):
+        # Opened again on use after close, for vectorstores that still hold the embedder
+        if self._database is None:
+            self._database = sqlite3.connect(self.path, check_same_thread=False)
+        return self._database
+
+    def _key(self, kind, text):
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        # Query in slices to stay under SQLite's limit of bound parameters
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        if found:
+            now = time.time()
+            self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items]
+        self._connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+        self._size += len(rows)
+        # Evict the least recently used vectors. The size is recounted first because another thread may have stored the same keys
+        if self._size > self.max_entries:
+            self._size = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._size > self.max_entries:
+            excess = self._size - self.max_entries
+            self._connection.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+            self._size -= excess
+
+    def _embed(self, kind, texts, embed_function):
+        keys = [self._key(kind, text) for text in texts]
+        with self._lock:
+            found = self._lookup(keys)
+            self._connection.commit()
+            missed = sum(1 for key in keys if key not in found)
+            self.hits += len(keys) - missed
+            self.misses += missed
+            metrics.increment("embedding_cache_hits_total", len(keys) - missed)
+            metrics.increment("embedding_cache_misses_total", missed)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_function(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(computed.items())
+                self._connection.commit()
+            found.update(computed)
+        return [list(found[key]) for key in keys]
+
+    def embed_documents(self, texts):
+        """
+        Embed a list of documents, only calling the wrapped embedder for the texts that are not cached
+
+        Parameters:
+        - texts (list): Texts to embed
+
+        Returns:
+        - list: One vector per text
+        """
+        return self._embed("document", texts, self.embedding.embed_documents)
+
+    def embed_query(self, text):
+        """
+        Embed a query, using the cached vector if the same query was embedded before
+
+        Parameters:
+        - text (str): Query to embed
+
+        Returns:
+        - list: The query vector
+        """
+        return self._embed("query", [text], lambda texts: [self.embedding.embed_query(texts[0])])[0]
+
+    def stats(self):
+        """
+        Get the cache counters
+
+        Returns:
+        - dict: Hits, misses, hit rate and number of cached vectors
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "entries": self._size}
+
+    def close(self):
+        """Close the SQLite connection. It is opened again if the embedder is used"""
+        with self._lock:
+            if self._database is not None:
+                self._database.close()
+                self._database = None
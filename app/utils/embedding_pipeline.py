@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from utils import metrics
+
+# Google's embedding endpoint accepts up to 100 texts per request
+MAX_BATCH_SIZE = 100
+MAX_BATCH_TOKENS = 20_000
+MAX_WORKERS = 4
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text (roughly 4 characters per token)
+
+    Parameters:
+    - text (str): Text to measure
+
+    Returns:
+    - int: Estimated number of tokens
+    """
+    return len(text) // 4 + 1
+
+def batch_chunks(chunks, max_batch_size=MAX_BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS):
+    """
+    Group chunks into batches bounded by number of chunks and estimated tokens
+
+    Parameters:
+    - chunks (iterable): Pairs of (chunk_id, Document). Consumed lazily
+    - max_batch_size (int): Maximum number of chunks per batch
+    - max_batch_tokens (int): Maximum estimated tokens per batch. A single larger chunk still gets its own batch
+
+    Yields:
+    - list: Batch of (chunk_id, Document) pairs
+    """
+    batch = []
+    batch_tokens = 0
+    for chunk_id, chunk in chunks:
+        tokens = estimate_tokens(chunk.page_content)
+        if batch and (len(batch) >= max_batch_size or batch_tokens + tokens > max_batch_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append((chunk_id, chunk))
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def upsert_embeddings(vectordb, ids, chunks, vectors):
+    """
+    Write chunks whose vectors were already computed to the vectorstore
+
+    Parameters:
+    - vectordb (Chroma): The vectorstore to write to
+    - ids (list): Chunk IDs
+    - chunks (list): Chunk documents
+    - vectors (list): One vector per chunk
+    """
+    vectordb._collection.upsert(ids=ids, embeddings=vectors, documents=[chunk.page_content for chunk in chunks], metadatas=[chunk.metadata for chunk in chunks])
+
+def embed_and_store(vectordb, embedding, chunks, max_workers=MAX_WORKERS, max_batch_size=MAX_BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS, progress=None):
+    """
+    Embed chunks in concurrent batches and write each batch to the vectorstore as soon as its vectors arrive
+
+    At most two batches per worker are in flight at any time, so memory stays flat however many chunks are ingested.
+
+    Parameters:
+    - vectordb (Chroma): The vectorstore to write to
+    - embedding (Embeddings): Embedder used to compute the vectors
+    - chunks (iterable): Pairs of (chunk_id, Document). Consumed lazily
+    - max_workers (int): Number of embedding requests sent concurrently
+    - max_batch_size (int): Maximum number of chunks per request
+    - max_batch_tokens (int): Maximum estimated tokens per request
+    - progress (callable, optional): Called as progress("embed", chunks_embedded=n) after every stored batch
+
+    Returns:
+    - int: Number of chunks stored
+    """
+    stored = 0
+    in_flight = {}
+
+    def embed_batch(texts):
+        with metrics.span("embed_batch", size=len(texts)):
+            return embedding.embed_documents(texts)
+
+    def write_completed(futures):
+        nonlocal stored
+        for future in futures:
+            batch = in_flight.pop(future)
+            vectors = future.result()
+            upsert_embeddings(vectordb, [chunk_id for chunk_id, _ in batch], [chunk for _, chunk in batch], vectors)
+            stored += len(batch)
+            metrics.increment("chunks_embedded_total", len(batch))
+            if progress:
+                progress("embed", chunks_embedded=stored)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in batch_chunks(chunks, max_batch_size, max_batch_tokens):
+            # Wait for a batch to finish before submitting more than the pipeline can hold
+            if len(in_flight) >= max_workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                write_completed(done)
+            texts = [chunk.page_content for _, chunk in batch]
+            metrics.increment("embedding_requests_total")
+            metrics.increment("embedding_tokens_sent_total", sum(estimate_tokens(text) for text in texts))
+            in_flight[executor.submit(embed_batch, texts)] = batch
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            write_completed(done)
+    return stored
@@ -0,0 +1,113 @@
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from utils.transcription import TranscriptionBackend
+import numpy as np
+import hashlib
+import math
+import os
+import random
+import re
+import threading
+import time
+
+# Seconds every call to a fake model API takes, and fraction of calls that fail as if the API throttled them.
+# They let the resilient client be exercised offline
+FAKE_BACKEND_LATENCY = float(os.getenv("FAKE_BACKEND_LATENCY", "0"))
+FAKE_BACKEND_FAILURE_RATE = float(os.getenv("FAKE_BACKEND_FAILURE_RATE", "0"))
+
+_calls_lock = threading.Lock()
+
+class FakeRateLimitError(Exception):
+    """Error raised by the fake backends when they simulate throttling"""
+
+def simulate_call(backend):
+    """
+    Count a call to a fake backend, wait its latency and fail it at its failure rate
+
+    Parameters:
+    - backend: The fake backend, with calls, latency and failure_rate attributes
+    """
+    with _calls_lock:
+        backend.calls += 1
+    if backend.latency:
+        time.sleep(backend.latency)
+    if backend.failure_rate and random.random() < backend.failure_rate:
+        raise FakeRateLimitError("429 Resource has been exhausted (simulated by the fake backend)")
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic embedder that works offline, used for benchmarks and local runs without an API key.
+
+    Every word is hashed into one of the dimensions of the vector, so texts that share words get similar vectors
+    and similarity search still returns meaningful results.
+    """
+    def __init__(self, size=256, model="fake-hashing-embedding", latency=FAKE_BACKEND_LATENCY, failure_rate=FAKE_BACKEND_FAILURE_RATE):
+        """
+        Parameters:
+        - size (int): Number of dimensions of the vectors
+        - model (str): Name reported as the model of the embedder
+        - latency (float): Seconds every call takes
+        - failure_rate (float): Fraction of calls that fail with FakeRateLimitError
+        """
+        self.size = size
+        self.model = model
+        self.latency = latency
+        self.failure_rate = failure_rate
+        # Number of calls received, to check how many requests reached the backend
+        self.calls = 0
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.size
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        """
+        Embed a list of documents
+
+        Parameters:
+        - texts (list): Texts to embed
+
+        Returns:
+        - list: One vector per text
+        """
+        simulate_call(self)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        """
+        Embed a query
+
+        Parameters:
+        - text (str): Query to embed
+
+        Returns:
+        - list: The query vector
+        """
+        simulate_call(self)
+        return self._embed(text)
+
+class FakeChatModel(FakeListChatModel):
+    """Offline chat model that cycles through fixed responses, with the latency and failures of a real API"""
+    latency: float = FAKE_BACKEND_LATENCY
+    failure_rate: float = FAKE_BACKEND_FAILURE_RATE
+    # Number of calls received, to check how many requests reached the backend
+    calls: int = 0
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        simulate_call(self)
+        return super()._call(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        simulate_call(self)
+        yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+class FakeTranscriptionBackend(TranscriptionBackend):
+    """Deterministic transcription backend that works offline. It describes each segment instead of recognizing speech"""
+    def transcribe(self, samples, sample_rate):
+        loudness = float(np.sqrt(np.mean(np.square(samples.astype(np.float64))))) if len(samples) else 0.0
+        return f"{len(samples) / sample_rate:.1f} seconds of audio at loudness {loudness:.0f}"
@@ -0,0 +1,176 @@
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.documents import Document
+from typing import Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from utils.context_packing import select_mmr, pack_context, MMR_LAMBDA
+from utils import metrics
+
+# Number of shards searched at the same time
+SHARD_WORKERS = 4
+
+def chunk_key(doc):
+    """
+    Get the key identifying a retrieved chunk. Chunks stored before chunk IDs existed fall back to their content
+
+    Parameters:
+    - doc (Document): A retrieved chunk
+
+    Returns:
+    - str: Key of the chunk
+    """
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever that merges vector search hits with BM25 hits by reciprocal rank fusion.
+
+    Dense retrieval finds passages with a similar meaning, while BM25 finds the ones that contain the exact
+    identifiers and names of the question. Every hit scores 1 / (rrf_k + rank) in each list it appears in. When
+    max_version is set, chunks written by an ingestion that is not committed yet are left out.
+
+    When token_budget is set, the k best fused chunks are ordered by maximal marginal relevance to drop redundant
+    ones, and packed into the budget with neighbouring chunks merged into one passage.
+    """
+    vectordb: Any
+    index: Any
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    max_version: Optional[int] = None
+    token_budget: Optional[int] = None
+    mmr_lambda: float = MMR_LAMBDA
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def search(self, query, query_vector=None):
+        """
+        Find the k best chunks of the collection by fusing vector and BM25 hits
+
+        Parameters:
+        - query (str): The question
+        - query_vector (list, optional): Embedding of the question, when it was already computed
+
+        Returns:
+        - list: Pairs of (Document, fused score), best first
+        """
+        scores = {}
+        documents = {}
+        where = {"index_version": {"$lte": self.max_version}} if self.max_version is not None else None
+        if query_vector is None:
+            with metrics.span("embed_query"):
+                query_vector = self.vectordb.embeddings.embed_query(query)
+        with metrics.span("vector_search"):
+            vector_hits = self.vectordb.similarity_search_by_vector(query_vector, k=self.fetch_k, filter=where)
+        for rank, doc in enumerate(vector_hits):
+            key = chunk_key(doc)
+            documents[key] = doc
+            scores[key] = scores.get(key, 0.0) + 1 / (self.rrf_k + rank + 1)
+        with metrics.span("bm25_search"):
+            lexical_hits = self.index.search(query, self.fetch_k)
+        if where is not None:
+            # The BM25 index gets the chunks of a running ingestion as soon as they are embedded, so the hits are
+            # loaded with the version filter before they are ranked, and the uncommitted ones do not take a place
+            self._fetch_documents([chunk_id for chunk_id, _ in lexical_hits if chunk_id not in documents], where, documents)
+            lexical_hits = [hit for hit in lexical_hits if hit[0] in documents]
+        for rank, (chunk_id, _) in enumerate(lexical_hits):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (self.rrf_k + rank + 1)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        # Chunks found only by BM25 are loaded from the vectorstore
+        self._fetch_documents([key for key in ranked if key not in documents], where, documents)
+        # Chunks stored before chunk IDs existed can be found under two keys, so duplicates are dropped by content
+        results = []
+        seen = set()
+        for key in ranked:
+            doc = documents.get(key)
+            if doc is not None and doc.page_content not in seen:
+                seen.add(doc.page_content)
+                results.append((doc, scores[key]))
+        return results
+
+    def _fetch_documents(self, ids, where, documents):
+        # Loads chunks found only by BM25 from the vectorstore into documents, by chunk ID
+        if not ids:
+            return
+        with metrics.span("fetch_chunks"):
+            stored = self.vectordb.get(ids=ids, where=where, include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            documents[chunk_id] = Document(page_content=text, metadata=metadata)
+
+    def get_vectors(self, docs):
+        """
+        Get the embeddings of chunks of the collection
+
+        Vectors are read back from the vectorstore. Chunks without an ID are embedded again, which the embedding cache answers.
+
+        Parameters:
+        - docs (list): Chunks returned by search
+
+        Returns:
+        - list: One vector per chunk
+        """
+        ids = [doc.metadata.get("chunk_id") for doc in docs]
+        stored = self.vectordb._collection.get(ids=[chunk_id for chunk_id in ids if chunk_id], include=["embeddings"])
+        vectors = dict(zip(stored["ids"], stored["embeddings"]))
+        missing = [doc.page_content for doc, chunk_id in zip(docs, ids) if chunk_id not in vectors]
+        embedded = iter(self.vectordb.embeddings.embed_documents(missing) if missing else [])
+        return [vectors[chunk_id] if chunk_id in vectors else next(embedded) for chunk_id in ids]
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        results = self.search(query)
+        if self.token_budget is None or not results:
+            return [doc for doc, _ in results]
+        with metrics.span("pack_context"):
+            docs = [doc for doc, _ in results]
+            order = select_mmr([score for _, score in results], self.get_vectors(docs), self.mmr_lambda)
+            return pack_context([docs[position] for position in order], self.token_budget)
+
+class ShardedRetriever(BaseRetriever):
+    """
+    Retriever that searches several shards concurrently and merges their best chunks.
+
+    The question is embedded once and sent to the hybrid retriever of every shard in parallel. The fused hits of all
+    shards are merged by score, and when token_budget is set they are ordered by maximal marginal relevance and
+    packed into the budget like a single hybrid retriever does.
+    """
+    retrievers: List[HybridRetriever]
+    k: int = 4
+    token_budget: Optional[int] = None
+    mmr_lambda: float = MMR_LAMBDA
+    max_workers: int = SHARD_WORKERS
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        if not self.retrievers:
+            return []
+        with metrics.span("embed_query"):
+            query_vector = self.retrievers[0].vectordb.embeddings.embed_query(query)
+        with metrics.span("shard_fan_out", shards=len(self.retrievers)):
+            if len(self.retrievers) == 1:
+                shard_results = [self.retrievers[0].search(query, query_vector)]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(self.retrievers))) as executor:
+                    shard_results = list(executor.map(lambda retriever: retriever.search(query, query_vector), self.retrievers))
+        candidates = sorted(((score, position, doc) for position, results in enumerate(shard_results) for doc, score in results), key=lambda candidate: candidate[0], reverse=True)
+        merged = []
+        seen = set()
+        for score, position, doc in candidates:
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                merged.append((score, position, doc))
+            if len(merged) == self.k:
+                break
+        if self.token_budget is None or not merged:
+            return [doc for _, _, doc in merged]
+        with metrics.span("pack_context"):
+            # Vectors are read from the shard every chunk came from
+            vectors = [None] * len(merged)
+            for position, retriever in enumerate(self.retrievers):
+                members = [index for index, (_, owner, _) in enumerate(merged) if owner == position]
+                if members:
+                    for index, vector in zip(members, retriever.get_vectors([merged[index][2] for index in members])):
+                        vectors[index] = vector
+            order = select_mmr([score for score, _, _ in merged], vectors, self.mmr_lambda)
+            return pack_context([merged[index][2] for index in order], self.token_budget)
@@ -0,0 +1,331 @@
+from utils.prepare_vectordb import (DEFAULT_SHARD, PERSIST_DIRECTORY, WEB_DOCS_DIRECTORY, get_bm25_dirname, get_bm25_index, get_manifest,
+                                    ingest_sources, iter_file_sources, list_shards, open_dedup_index, open_vectorstore)
+from utils.source_loaders import get_loader
+from utils import metrics, prepare_vectordb
+import os
+import sqlite3
+import time
+
+# Stored vectors used as queries to measure the search latency before and after compaction
+LATENCY_SAMPLE_QUERIES = 50
+# Suffix of the collection a Chroma shard is copied to while it is compacted
+COMPACT_SUFFIX = "__compact"
+# Number of chunks read and written per batch while a shard is compacted
+COMPACT_BATCH_SIZE = 1000
+
+def directory_size(path):
+    """
+    Get the size of the files of a directory
+
+    Parameters:
+    - path (str): The directory
+
+    Returns:
+    - int: Size in bytes
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def delete_chunks(persist_directory, dedup, stale_ids):
+    """
+    Delete chunks that no source uses anymore from the shards and their BM25 indexes, then update the references
+    of the chunks that other sources still use
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+    - dedup (DedupIndex): Index of the stored chunks
+    - stale_ids (dict): IDs of the chunks to delete, by shard. Chunks that a source still references are kept
+
+    Returns:
+    - int: Number of chunks deleted
+    """
+    deleted = 0
+    for shard, ids in stale_ids.items():
+        ids = dedup.unreferenced(ids)
+        if ids:
+            vectordb = open_vectorstore(persist_directory, shard)
+            index = get_bm25_index(vectordb)
+            vectordb.delete(ids=ids)
+            index.delete(ids)
+            index.save(os.path.join(persist_directory, get_bm25_dirname(vectordb)))
+            deleted += len(ids)
+    dedup.update_references(lambda shard: open_vectorstore(persist_directory, shard))
+    dedup.commit()
+    return deleted
+
+def remove_sources(sources, persist_directory=PERSIST_DIRECTORY):
+    """
+    Remove every chunk of some sources from the vectorstore and forget the sources
+
+    Chunks that another source also contains are kept and attributed to that source. Chunks of a source ingested
+    before the manifest existed are found by their source metadata.
+
+    Parameters:
+    - sources (list): Sources to remove, as recorded in the manifest (e.g. docs/file.pdf)
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - int: Number of chunks deleted
+    """
+    dedup = open_dedup_index(persist_directory)
+    try:
+        manifest = get_manifest(persist_directory)
+        stale_ids = {}
+        removed = []
+        for source in sources:
+            shard = manifest.get_shard(source) or DEFAULT_SHARD
+            known = source in manifest.sources
+            ids = manifest.remove(source)
+            if shard in list_shards(persist_directory):
+                ids += open_vectorstore(persist_directory, shard).get(where={"source": source}, include=[])["ids"]
+            if not known and not ids:
+                print(f"Source '{source}' is not in the vectorstore.")
+                continue
+            dedup.remove_source(source)
+            stale_ids.setdefault(shard, []).extend(ids)
+            removed.append(source)
+        if not removed:
+            return 0
+        # Like ingestion, the manifest is committed before the chunks are deleted
+        dedup.commit()
+        manifest.commit()
+        deleted = delete_chunks(persist_directory, dedup, stale_ids)
+        metrics.increment("sources_removed_total", len(removed))
+        print(f"Removed {len(removed)} sources and {deleted} chunks.")
+        return deleted
+    finally:
+        dedup.close()
+
+def is_under(path, directory):
+    """
+    Check if a path is inside a directory, at any depth
+
+    Parameters:
+    - path (str): The path, e.g. a source recorded in the manifest
+    - directory (str): The directory
+
+    Returns:
+    - bool: True if the path is inside the directory
+    """
+    try:
+        return os.path.commonpath([os.path.normpath(path), os.path.normpath(directory)]) == os.path.normpath(directory)
+    except ValueError:
+        # One path is absolute and the other relative
+        return False
+
+def reconcile_docs(docs_directory="docs", persist_directory=PERSIST_DIRECTORY, progress=None):
+    """
+    Make the vectorstore match the files of the docs folder and its subfolders: sources whose file was deleted are
+    removed, and new or changed files are ingested
+
+    Sources that do not come from the docs folder, such as scraped text, are left alone. So are the copies of the
+    crawled pages in WEB_DOCS_DIRECTORY: the crawler ingests them under their URL.
+
+    Parameters:
+    - docs_directory (str): The docs folder, as the sources were recorded (relative to the app directory by default)
+    - persist_directory (str): Directory of the vectorstore
+    - progress (callable, optional): Called as progress(stage, **counters) while the files are ingested
+
+    Returns:
+    - dict: Names of the removed sources, number of chunks deleted and number of sources ingested
+    """
+    manifest = get_manifest(persist_directory)
+    docs_directory = os.path.normpath(docs_directory)
+    # Files of the subfolders of docs are in scope too, they are the ones grouped in their own shards
+    missing = [source for source in manifest.sources if is_under(source, docs_directory) and not is_under(source, WEB_DOCS_DIRECTORY)
+               and not os.path.isfile(source)]
+    deleted = remove_sources(missing, persist_directory) if missing else 0
+    files = sorted(os.path.join(root, name) for root, _, names in os.walk(docs_directory) if not is_under(root, WEB_DOCS_DIRECTORY) for name in names)
+    files = [path for path in files if get_loader(path)]
+    _, ingested = ingest_sources(iter_file_sources(files, get_manifest(persist_directory)), persist_directory, progress)
+    return {"removed_sources": missing, "deleted_chunks": deleted, "ingested_sources": ingested}
+
+def sample_query_vectors(persist_directory, count=LATENCY_SAMPLE_QUERIES):
+    """
+    Take stored vectors of every shard to use as queries, so measuring the latency does not call the embedder
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+    - count (int): Number of vectors per shard
+
+    Returns:
+    - dict: Lists of vectors, by shard
+    """
+    samples = {}
+    for shard in list_shards(persist_directory):
+        vectors = open_vectorstore(persist_directory, shard).get(limit=count, include=["embeddings"])["embeddings"]
+        if vectors is not None and len(vectors):
+            samples[shard] = [list(vector) for vector in vectors]
+    return samples
+
+def measure_query_latency(persist_directory, samples, k=4):
+    """
+    Measure the search latency of the shards, after one warm-up query per shard
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+    - samples (dict): Query vectors by shard, from sample_query_vectors
+    - k (int): Number of chunks returned per query
+
+    Returns:
+    - dict: Latency summary in milliseconds, from metrics.latency_summary
+    """
+    latencies = []
+    for shard, vectors in samples.items():
+        vectordb = open_vectorstore(persist_directory, shard)
+        vectordb.similarity_search_by_vector(vectors[0], k=k)
+        for vector in vectors:
+            start = time.perf_counter()
+            vectordb.similarity_search_by_vector(vector, k=k)
+            latencies.append(time.perf_counter() - start)
+    return metrics.latency_summary(latencies)
+
+def recover_chroma_compaction(client):
+    """
+    Finish or undo the compaction of Chroma shards that was interrupted. A copy whose shard was already dropped
+    takes its place, other copies are dropped
+
+    Parameters:
+    - client: The Chroma client of the vectorstore
+    """
+    names = {collection.name for collection in client.list_collections()}
+    for name in names:
+        if not name.endswith(COMPACT_SUFFIX):
+            continue
+        original = name[:-len(COMPACT_SUFFIX)]
+        if original in names:
+            client.delete_collection(name)
+        else:
+            client.get_collection(name).modify(name=original)
+
+def compact_chroma_shard(vectordb, orphan_ids):
+    """
+    Rebuild the collection of a Chroma shard without some chunks. The stored vectors are copied, nothing is embedded
+
+    Chroma never shrinks its index or its SQLite file when chunks are deleted, so the live chunks are copied to a
+    new collection that replaces the old one.
+
+    Parameters:
+    - vectordb (Chroma): The vectorstore of the shard
+    - orphan_ids (set): IDs of the chunks left out of the new collection
+    """
+    client = vectordb._client
+    collection = vectordb._collection
+    copy = client.create_collection(collection.name + COMPACT_SUFFIX, metadata=collection.metadata)
+    total = collection.count()
+    for offset in range(0, total, COMPACT_BATCH_SIZE):
+        batch = collection.get(limit=COMPACT_BATCH_SIZE, offset=offset, include=["embeddings", "documents", "metadatas"])
+        keep = [position for position, chunk_id in enumerate(batch["ids"]) if chunk_id not in orphan_ids]
+        if keep:
+            copy.add(ids=[batch["ids"][position] for position in keep], embeddings=[batch["embeddings"][position] for position in keep],
+                     documents=[batch["documents"][position] for position in keep], metadatas=[batch["metadatas"][position] for position in keep])
+    client.delete_collection(collection.name)
+    copy.modify(name=collection.name)
+
+def vacuum_chroma(persist_directory):
+    """
+    Shrink the SQLite file of Chroma to its live rows
+
+    Chroma keeps the full-text entries of the chunks of a dropped collection, so they are deleted and the full-text
+    index is merged before the file is rewritten.
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+    """
+    connection = sqlite3.connect(os.path.join(persist_directory, "chroma.sqlite3"), isolation_level=None)
+    try:
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'embedding_fulltext_search'").fetchone():
+            connection.execute("DELETE FROM embedding_fulltext_search WHERE rowid NOT IN (SELECT id FROM embeddings)")
+            connection.execute("INSERT INTO embedding_fulltext_search (embedding_fulltext_search) VALUES ('optimize')")
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+
+def compact_vectorstore(persist_directory=PERSIST_DIRECTORY, sample_queries=LATENCY_SAMPLE_QUERIES):
+    """
+    Compact the vectorstore offline: drop the chunks that no source uses, rebuild every shard without the space
+    left by deleted chunks and compact the BM25 indexes
+
+    A chunk is kept when the manifest lists it or when it was stored before index versions existed. Chunks left by
+    an ingestion run that failed before its commit are dropped. Ingestion waits while the vectorstore is compacted.
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+    - sample_queries (int): Number of stored vectors per shard used to measure the search latency
+
+    Returns:
+    - dict: Chunks dropped, size in bytes before and after, bytes reclaimed and search latency before and after
+    """
+    dedup = open_dedup_index(persist_directory)
+    try:
+        bytes_before = directory_size(persist_directory)
+        if prepare_vectordb.VECTOR_BACKEND == "chroma":
+            recover_chroma_compaction(open_vectorstore(persist_directory)._client)
+        samples = sample_query_vectors(persist_directory, sample_queries)
+        latency_before = measure_query_latency(persist_directory, samples)
+        manifest = get_manifest(persist_directory)
+        referenced = {chunk_id for source in manifest.sources for chunk_id in manifest.get_chunk_ids(source)}
+        dropped = 0
+        with metrics.span("compact"):
+            for shard in list_shards(persist_directory):
+                vectordb = open_vectorstore(persist_directory, shard)
+                stored = vectordb.get(include=["metadatas"])
+                orphan_ids = {chunk_id for chunk_id, metadata in zip(stored["ids"], stored["metadatas"])
+                              if chunk_id not in referenced and (metadata or {}).get("index_version", 0) != 0}
+                orphan_ids = set(dedup.unreferenced(orphan_ids))
+                # Opened before the rebuild, which leaves the Chroma object of the shard pointing to the dropped collection
+                index = get_bm25_index(vectordb)
+                if prepare_vectordb.VECTOR_BACKEND == "numpy":
+                    vectordb.delete(ids=list(orphan_ids))
+                    vectordb.compact()
+                else:
+                    compact_chroma_shard(vectordb, orphan_ids)
+                index.delete(orphan_ids)
+                index.compact()
+                index.save(os.path.join(persist_directory, get_bm25_dirname(vectordb)))
+                dropped += len(orphan_ids)
+            if prepare_vectordb.VECTOR_BACKEND == "chroma":
+                vacuum_chroma(persist_directory)
+            dedup.commit()
+            # A new index version makes every process reopen the rebuilt shards
+            manifest.commit()
+        latency_after = measure_query_latency(persist_directory, samples)
+        bytes_after = directory_size(persist_directory)
+        return {"dropped_chunks": dropped, "bytes_before": bytes_before, "bytes_after": bytes_after, "reclaimed_bytes": bytes_before - bytes_after,
+                "latency_before": latency_before, "latency_after": latency_after}
+    finally:
+        dedup.close()
+
+def build_ivf_indexes(persist_directory=PERSIST_DIRECTORY, n_lists=None):
+    """
+    Partition the vectors of every shard of the NumPy backend into IVF lists, so searches only scan the lists
+    closest to the query
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+    - n_lists (int, optional): Number of lists per shard. Defaults to the square root of the number of chunks
+
+    Returns:
+    - dict: Number of chunks partitioned, by shard
+    """
+    if prepare_vectordb.VECTOR_BACKEND != "numpy":
+        raise ValueError("IVF indexes are only available with the NumPy vector backend (VECTOR_BACKEND=numpy)")
+    dedup = open_dedup_index(persist_directory)
+    try:
+        partitioned = {}
+        with metrics.span("build_ivf"):
+            for shard in list_shards(persist_directory):
+                vectordb = open_vectorstore(persist_directory, shard)
+                vectordb.build_ivf(n_lists)
+                partitioned[shard] = vectordb.count()
+            # A new index version makes every process reopen the shards with their centroids
+            get_manifest(persist_directory).commit()
+        return partitioned
+    finally:
+        dedup.close()
@@ -0,0 +1,210 @@
+from utils.prepare_vectordb import PERSIST_DIRECTORY, get_manifest, ingest_sources, iter_file_sources
+from utils.resources import get_resource
+import json
+import os
+import sqlite3
+import threading
+import time
+
+JOBS_FILENAME = "ingest_jobs.sqlite3"
+# Progress is written to the queue at most this often, so reporting does not slow ingestion down
+PROGRESS_INTERVAL = 0.5
+
+class JobQueue:
+    """
+    Persistent queue of ingestion jobs stored in SQLite.
+
+    Every job has a kind, a JSON payload, a status (queued, running, done or failed) and the stage and counters it
+    last reported. Jobs that were running when the process stopped are queued again when the queue is opened.
+    """
+    def __init__(self, path):
+        """
+        Parameters:
+        - path (str): Path of the SQLite file of the queue
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        with self._lock:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL,
+                stage TEXT, progress TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)""")
+            self._connection.execute("UPDATE jobs SET status = 'queued', stage = NULL WHERE status = 'running'")
+            self._connection.commit()
+
+    def submit(self, kind, payload):
+        """
+        Add a job to the queue
+
+        Parameters:
+        - kind (str): Kind of job (documents, crawl or video)
+        - payload (dict): Arguments of the job
+
+        Returns:
+        - int: ID of the job
+        """
+        now = time.time()
+        with self._available:
+            cursor = self._connection.execute("INSERT INTO jobs (kind, payload, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)", (kind, json.dumps(payload), now, now))
+            self._connection.commit()
+            self._available.notify()
+            return cursor.lastrowid
+
+    def claim(self, timeout=None):
+        """
+        Take the oldest queued job and mark it as running, waiting for one if the queue is empty
+
+        Parameters:
+        - timeout (float, optional): Seconds to wait for a job
+
+        Returns:
+        - tuple: (job_id, kind, payload), or None if no job arrived in time
+        """
+        with self._available:
+            while True:
+                row = self._connection.execute("SELECT id, kind, payload FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self._connection.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row[0]))
+                    self._connection.commit()
+                    return row[0], row[1], json.loads(row[2])
+                if not self._available.wait(timeout):
+                    return None
+
+    def report(self, job_id, stage, progress):
+        """
+        Record the stage a job is in and its counters
+
+        Parameters:
+        - job_id (int): ID of the job
+        - stage (str): Current stage (extract, chunk, embed or persist)
+        - progress (dict): Counters of the stage
+        """
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ?", (stage, json.dumps(progress), time.time(), job_id))
+            self._connection.commit()
+
+    def finish(self, job_id, error=None):
+        """
+        Mark a job as done, or as failed if an error is given
+
+        Parameters:
+        - job_id (int): ID of the job
+        - error (str, optional): Error that stopped the job
+        """
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?", ("failed" if error else "done", error, time.time(), job_id))
+            self._connection.commit()
+
+    def recent(self, limit=5):
+        """
+        Get the most recent jobs
+
+        Parameters:
+        - limit (int): Number of jobs returned
+
+        Returns:
+        - list: One dict per job, newest first
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT id, kind, payload, status, stage, progress, error, updated_at FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [{"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "status": row[3], "stage": row[4],
+                 "progress": json.loads(row[5]) if row[5] else {}, "error": row[6], "updated_at": row[7]} for row in rows]
+
+def ingest_docs_files(names, progress):
+    """
+    Ingest files of the docs folder. Unlike get_vectorstore, errors are raised, so the job is marked as failed
+
+    Parameters:
+    - names (list): Names of the files in the docs folder
+    - progress (callable): Called as progress(stage, **counters)
+
+    Returns:
+    - int: Number of files that were new or changed
+    """
+    paths = [os.path.join("docs", name) for name in names]
+    _, changed_sources = ingest_sources(iter_file_sources(paths, get_manifest(PERSIST_DIRECTORY)), PERSIST_DIRECTORY, progress)
+    return changed_sources
+
+def run_job(kind, payload, progress):
+    """
+    Run an ingestion job
+
+    Parameters:
+    - kind (str): Kind of job (documents, crawl or video)
+    - payload (dict): Arguments of the job
+    - progress (callable): Called as progress(stage, **counters)
+    """
+    if kind == "documents":
+        ingest_docs_files(payload["files"], progress)
+    elif kind == "crawl":
+        from utils.web_scraper import crawl_website
+        crawl_website(payload["url"], max_depth=payload["max_depth"], max_pages=payload["max_pages"], progress=progress)
+    elif kind == "video":
+        from utils.video_processing import process_video, save_processed_video_data
+        progress("extract", source=payload["path"])
+        text_content, transcription_content = process_video(payload["path"])
+        save_processed_video_data(text_content, transcription_content)
+        ingest_docs_files(["video_text.txt", "video_transcription.txt"], progress)
+    else:
+        raise ValueError(f"Unknown ingestion job kind '{kind}'")
+
+class IngestionWorker(threading.Thread):
+    """
+    Background thread that runs the jobs of the queue one after another.
+
+    Ingestion writes chunks tagged with the next index version and only commits the version at the end, so the chat
+    keeps answering from the last committed version while a job runs.
+    """
+    def __init__(self, jobs):
+        """
+        Parameters:
+        - jobs (JobQueue): Queue the jobs are taken from
+        """
+        super().__init__(name="ingestion-worker", daemon=True)
+        self.jobs = jobs
+
+    def run(self):
+        while True:
+            claimed = self.jobs.claim()
+            if claimed is None:
+                continue
+            job_id, kind, payload = claimed
+            counters = {}
+            current_stage = None
+            last_report = 0.0
+
+            def progress(stage, **values):
+                nonlocal current_stage, last_report
+                counters.update(values)
+                now = time.monotonic()
+                if stage != current_stage or now - last_report >= PROGRESS_INTERVAL:
+                    current_stage = stage
+                    last_report = now
+                    self.jobs.report(job_id, stage, counters)
+
+            try:
+                run_job(kind, payload, progress)
+                if current_stage:
+                    self.jobs.report(job_id, current_stage, counters)
+                self.jobs.finish(job_id)
+            except Exception as e:
+                print(f"Error running ingestion job {job_id}: {e}")
+                self.jobs.finish(job_id, error=str(e))
+
+def get_job_queue(persist_directory=PERSIST_DIRECTORY):
+    """
+    Get the job queue of the process, starting its worker on first use
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore, where the queue file is kept
+
+    Returns:
+    - JobQueue: The queue
+    """
+    def build():
+        jobs = JobQueue(os.path.join(persist_directory, JOBS_FILENAME))
+        IngestionWorker(jobs).start()
+        return jobs
+
+    return get_resource("ingestion_jobs", build, fingerprint=persist_directory)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+
+def hash_file(file_path, block_size=1 << 20):
+    """
+    Compute the SHA-256 hash of a file without reading it fully into memory
+
+    Parameters:
+    - file_path (str): Path to the file
+    - block_size (int): Number of bytes read per iteration
+
+    Returns:
+    - str: Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_text(text):
+    """
+    Compute the SHA-256 hash of a text
+
+    Parameters:
+    - text (str): Text to hash
+
+    Returns:
+    - str: Hex digest of the text
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def make_chunk_id(source, content_hash, index):
+    """
+    Build a deterministic ID for a chunk, so re-ingesting the same content always produces the same IDs
+
+    Parameters:
+    - source (str): Source the chunk belongs to (file path or URL)
+    - content_hash (str): Hash of the source content
+    - index (int): Position of the chunk inside the source
+
+    Returns:
+    - str: Chunk ID
+    """
+    return hashlib.sha1(f"{source}|{content_hash}|{index}".encode("utf-8")).hexdigest()
+
+# Version read by read_index_version, cached by path, inode and modification time of the manifest
+_version_cache = {}
+
+def read_index_version(path):
+    """
+    Read the version of a manifest without loading its sources. The file is only parsed again when it changes
+
+    Parameters:
+    - path (str): Path of the manifest file
+
+    Returns:
+    - int: Version of the index, 0 if nothing was ingested yet
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0
+    # The manifest is replaced on every save, so the inode changes even when two saves share a timestamp
+    key = (stat.st_ino, stat.st_mtime_ns)
+    cached = _version_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            version = json.load(f).get("version", 0)
+    except (OSError, ValueError):
+        return 0
+    _version_cache[path] = (key, version)
+    return version
+
+class IngestionManifest:
+    """
+    Persistent record of every source ingested into the vectorstore.
+
+    For each source it stores the hash of its content, the shard it was written to and the IDs of its chunks, so
+    ingestion can skip unchanged sources and replace the chunks of changed ones. The version is increased every time the
+    corpus changes, which lets other components know when the index is different.
+    """
+    def __init__(self, path, fingerprint=None):
+        """
+        Parameters:
+        - path (str): Path of the JSON file where the manifest is stored
+        - fingerprint (str, optional): Fingerprint of the chunking configuration. Sources ingested with a different fingerprint are considered changed
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.version = 0
+        self.sources = {}
+        self.load()
+
+    def load(self):
+        """Load the manifest from disk, if it exists"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading ingestion manifest '{self.path}': {e}")
+            return
+        self.version = data.get("version", 0)
+        self.sources = data.get("sources", {})
+
+    def save(self):
+        """Write the manifest to disk. The file is replaced atomically so a crash never leaves it half written"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "sources": self.sources}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def is_unchanged(self, source, content_hash):
+        """
+        Check if a source was already ingested with the same content
+
+        Parameters:
+        - source (str): Source to check
+        - content_hash (str): Hash of the current content of the source
+
+        Returns:
+        - bool: True if the source does not need to be ingested again
+        """
+        entry = self.sources.get(source)
+        return entry is not None and entry["content_hash"] == content_hash and entry.get("fingerprint") == self.fingerprint
+
+    def get_chunk_ids(self, source):
+        """
+        Get the IDs of the chunks stored for a source
+
+        Parameters:
+        - source (str): Source to look up
+
+        Returns:
+        - list: Chunk IDs, empty if the source is unknown
+        """
+        entry = self.sources.get(source)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def get_shard(self, source):
+        """
+        Get the shard the chunks of a source are stored in
+
+        Parameters:
+        - source (str): Source to look up
+
+        Returns:
+        - str: Name of the shard, or None if the source is unknown or was ingested before shards existed
+        """
+        entry = self.sources.get(source)
+        return entry.get("shard") if entry else None
+
+    def record(self, source, content_hash, chunk_ids, shard=None):
+        """
+        Record the content hash and chunk IDs of a source that was just ingested
+
+        Parameters:
+        - source (str): Source that was ingested
+        - content_hash (str): Hash of the ingested content
+        - chunk_ids (list): IDs of the chunks stored for the source
+        - shard (str, optional): Shard the chunks were stored in
+        """
+        entry = {"content_hash": content_hash, "fingerprint": self.fingerprint, "chunk_ids": list(chunk_ids)}
+        if shard is not None:
+            entry["shard"] = shard
+        self.sources[source] = entry
+
+    def remove(self, source):
+        """
+        Forget a source
+
+        Parameters:
+        - source (str): Source to remove
+
+        Returns:
+        - list: Chunk IDs that were stored for the source
+        """
+        entry = self.sources.pop(source, None)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def commit(self):
+        """Increase the version and save the manifest. Called once per ingestion run that changed the corpus"""
+        self.version += 1
+        self.save()
@@ -0,0 +1,238 @@
+from collections import deque
+from contextlib import contextmanager
+import bisect
+import json
+import os
+import threading
+import time
+
+# Prefix of every metric in the Prometheus export
+METRIC_PREFIX = "rag_"
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Upper bounds of the buckets of the token count histograms
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+# Number of finished spans kept in memory for the debug panel
+RECENT_SPANS = 200
+# Set METRICS_LOG to a file path to append every finished span to it as a JSON line
+METRICS_LOG = os.getenv("METRICS_LOG")
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_recent_spans = deque(maxlen=RECENT_SPANS)
+_active = threading.local()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def increment(name, value=1, **labels):
+    """
+    Add to a counter
+
+    Parameters:
+    - name (str): Name of the counter, e.g. chunks_embedded_total
+    - value (float): Amount added
+    - labels: Labels of the counter
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    """
+    Set the current value of a gauge
+
+    Parameters:
+    - name (str): Name of the gauge, e.g. client_queue_depth
+    - value (float): Current value
+    - labels: Labels of the gauge
+    """
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """
+    Record a value in a histogram
+
+    Parameters:
+    - name (str): Name of the histogram, e.g. span_seconds
+    - value (float): Value recorded
+    - buckets (tuple): Upper bounds of the buckets, used when the histogram is created
+    - labels: Labels of the histogram
+    """
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        position = bisect.bisect_left(histogram["buckets"], value)
+        if position < len(histogram["counts"]):
+            histogram["counts"][position] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+def record_span(name, start, duration, parent=None, **attributes):
+    """
+    Record a finished span, in the span_seconds histogram and in the list of recent spans
+
+    Parameters:
+    - name (str): Name of the span
+    - start (float): Wall clock time the span started at
+    - duration (float): Duration in seconds
+    - parent (str, optional): Name of the span it ran in
+    - attributes: Extra values describing the span
+    """
+    observe("span_seconds", duration, span=name)
+    entry = {"span": name, "start": start, "duration": duration, "parent": parent, "thread": threading.current_thread().name, **attributes}
+    with _lock:
+        _recent_spans.append(entry)
+    if METRICS_LOG:
+        with _lock, open(METRICS_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a block of code as a span. Spans opened inside it on the same thread are recorded as its children
+
+    Parameters:
+    - name (str): Name of the span, e.g. vector_search
+    - attributes: Extra values describing the span
+    """
+    stack = getattr(_active, "stack", None)
+    if stack is None:
+        stack = _active.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    start = time.time()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stack.pop()
+        record_span(name, start, time.perf_counter() - started, parent, **attributes)
+
+def recent_spans(limit=RECENT_SPANS):
+    """
+    Get the most recent finished spans
+
+    Parameters:
+    - limit (int): Maximum number of spans returned
+
+    Returns:
+    - list: Spans, newest first
+    """
+    with _lock:
+        spans = list(_recent_spans)
+    return spans[::-1][:limit]
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+def export_prometheus():
+    """
+    Export the counters, gauges and histograms in the Prometheus text format
+
+    Returns:
+    - str: The metrics
+    """
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((key, dict(value, counts=list(value["counts"]))) for key, value in _histograms.items())
+    lines = []
+    declared = set()
+    for (name, labels), value in counters:
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+        lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in gauges:
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+        lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in histograms:
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+def export_json():
+    """
+    Export the counters, gauges, histograms and recent spans as a JSON serializable dict
+
+    Returns:
+    - dict: The metrics
+    """
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(_counters.items())]
+        gauges = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(_gauges.items())]
+        histograms = [{"name": name, "labels": dict(labels), "buckets": list(value["buckets"]), "counts": list(value["counts"]), "sum": value["sum"], "count": value["count"]}
+                      for (name, labels), value in sorted(_histograms.items())]
+    return {"counters": counters, "gauges": gauges, "histograms": histograms, "recent_spans": recent_spans()}
+
+def span_summary():
+    """
+    Summarize the time spent in every span
+
+    Returns:
+    - dict: Number of calls, total and mean seconds of every span name
+    """
+    with _lock:
+        spans = [(dict(labels)["span"], value["count"], value["sum"]) for (name, labels), value in _histograms.items() if name == "span_seconds"]
+    return {name: {"count": count, "total_seconds": total, "mean_seconds": total / count if count else 0.0} for name, count, total in sorted(spans)}
+
+def percentile(values, fraction):
+    """
+    Get a percentile of a list of values, by nearest rank
+
+    Parameters:
+    - values (list): Measured values
+    - fraction (float): Percentile between 0 and 1
+
+    Returns:
+    - float: The percentile, or None if there are no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def latency_summary(latencies):
+    """
+    Summarize latencies in milliseconds
+
+    Parameters:
+    - latencies (list): Latencies in seconds
+
+    Returns:
+    - dict: Count, mean, p50, p95 and p99 in milliseconds
+    """
+    summary = {"count": len(latencies), "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else None}
+    for name, fraction in (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+        value = percentile(latencies, fraction)
+        summary[name] = value * 1000 if value is not None else None
+    return summary
+
+def reset():
+    """Drop every recorded metric and span"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _recent_spans.clear()
@@ -0,0 +1,596 @@
+from langchain_core.vectorstores import VectorStore
+from langchain_core.documents import Document
+import numpy as np
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+
+# Vectors are stored in fixed size segment files, so the index grows by adding files instead of rewriting them
+SEGMENT_ROWS = 16384
+# Rows multiplied at once during a search. Bounds the memory of the temporary float32 copy
+BLOCK_ROWS = 4096
+VECTOR_DTYPES = ("float16", "int8")
+# Number of IVF lists searched for every query when the index is partitioned
+IVF_PROBES = 8
+# Filtered searches first look at this many times k candidates, and widen the search if too few pass the filter
+SEARCH_OVERSAMPLE = 4
+
+def matches_filter(metadata, where):
+    """
+    Check if metadata matches a Chroma style where filter
+
+    Supports field equality, the $eq, $ne, $gt, $gte, $lt, $lte, $in and $nin operators, and $and / $or lists.
+
+    Parameters:
+    - metadata (dict): Metadata of a chunk
+    - where (dict): The filter
+
+    Returns:
+    - bool: True if the metadata matches
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            operators = condition if isinstance(condition, dict) else {"$eq": condition}
+            for operator, expected in operators.items():
+                if operator == "$eq":
+                    matched = value == expected
+                elif operator == "$ne":
+                    matched = value != expected
+                elif operator == "$in":
+                    matched = value in expected
+                elif operator == "$nin":
+                    matched = value not in expected
+                elif value is None:
+                    matched = False
+                elif operator == "$gt":
+                    matched = value > expected
+                elif operator == "$gte":
+                    matched = value >= expected
+                elif operator == "$lt":
+                    matched = value < expected
+                elif operator == "$lte":
+                    matched = value <= expected
+                else:
+                    raise ValueError(f"Unsupported filter operator '{operator}'")
+                if not matched:
+                    return False
+    return True
+
+def normalize_rows(vectors):
+    """
+    Scale vectors to unit length, so dot products are cosine similarities
+
+    Parameters:
+    - vectors (numpy.ndarray): Matrix with one vector per row
+
+    Returns:
+    - numpy.ndarray: The normalized float32 matrix
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store kept in memory-mapped NumPy matrices, with texts and metadata in a SQLite side table.
+
+    Vectors are normalized and stored as float16 or as int8 with one scale per row, so the index takes a half or a
+    quarter of the space of float32 vectors and opening it only maps the files. Searches multiply the query with
+    the matrix block by block. For large collections, build_ivf partitions the vectors around k-means centroids and
+    searches only look at the lists closest to the query.
+
+    Besides LangChain's VectorStore interface, the store has the collection methods of Chroma (upsert, update, get,
+    count), so the ingestion code works with either store.
+    """
+    def __init__(self, persist_directory, embedding_function, collection_name="langchain", dtype="int8", directory_name="numpy_index"):
+        """
+        Parameters:
+        - persist_directory (str): Directory of the vectorstore
+        - embedding_function (Embeddings): Embedder used for texts and queries
+        - collection_name (str): Name of the collection, one subdirectory per collection
+        - dtype (str): Storage type of new collections, float16 or int8. Existing collections keep their type
+        - directory_name (str): Name of the directory of the collections inside the persist directory
+        """
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector type '{dtype}', expected one of {VECTOR_DTYPES}")
+        self.persist_directory = persist_directory
+        self.name = collection_name
+        self.directory = os.path.join(persist_directory, directory_name, collection_name)
+        self._embedding = embedding_function
+        self._lock = threading.RLock()
+        self._segments = {}
+        os.makedirs(self.directory, exist_ok=True)
+        self._database = None
+        self._connection.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, row INTEGER NOT NULL, document TEXT, metadata TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS chunks_row ON chunks (row)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+        meta = dict(self._connection.execute("SELECT key, value FROM meta").fetchall())
+        self.dtype = meta.get("dtype", dtype)
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        self.rows = int(meta.get("rows", 0))
+        centroids_path = os.path.join(self.directory, "centroids.npy")
+        self._centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        self._finish_compaction()
+
+    @property
+    def _connection(self):
+        # Opened again on use after close, for readers that still hold the store
+        if self._database is None:
+            self._database = sqlite3.connect(os.path.join(self.directory, "store.sqlite3"), check_same_thread=False)
+        return self._database
+
+    @_connection.setter
+    def _connection(self, connection):
+        self._database = connection
+
+    @staticmethod
+    def list_collections(persist_directory, directory_name="numpy_index"):
+        """
+        List the collections stored in a directory
+
+        Parameters:
+        - persist_directory (str): Directory of the vectorstore
+        - directory_name (str): Name of the directory of the collections inside the persist directory
+
+        Returns:
+        - list: Names of the collections
+        """
+        root = os.path.join(persist_directory, directory_name)
+        if not os.path.isdir(root):
+            return []
+        return sorted(name for name in os.listdir(root) if os.path.exists(os.path.join(root, name, "store.sqlite3")))
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # Same attributes as LangChain's Chroma wrapper, which the ingestion code reads
+    @property
+    def _collection(self):
+        return self
+
+    @property
+    def _persist_directory(self):
+        return self.persist_directory
+
+    def _segment_path(self, number, kind):
+        return os.path.join(self.directory, f"segment_{number:05d}_{kind}.npy")
+
+    def _segment(self, number):
+        # Segments are mapped on first use, so opening the store does not read any vector
+        segment = self._segments.get(number)
+        if segment is None:
+            kinds = {"vectors": (np.dtype(self.dtype), (SEGMENT_ROWS, self.dim)), "scales": (np.float32, (SEGMENT_ROWS,)),
+                     "alive": (np.uint8, (SEGMENT_ROWS,)), "lists": (np.int32, (SEGMENT_ROWS,))}
+            segment = {}
+            for kind, (dtype, shape) in kinds.items():
+                path = self._segment_path(number, kind)
+                if os.path.exists(path):
+                    segment[kind] = np.load(path, mmap_mode="r+")
+                else:
+                    segment[kind] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+                    if kind == "lists":
+                        segment[kind][:] = -1
+            self._segments[number] = segment
+        return segment
+
+    def _quantize(self, vectors):
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+
+    def _read_vectors(self, rows):
+        vectors = np.empty((len(rows), self.dim), dtype=np.float32)
+        for position, row in enumerate(rows):
+            segment = self._segment(row // SEGMENT_ROWS)
+            offset = row % SEGMENT_ROWS
+            vectors[position] = segment["vectors"][offset].astype(np.float32) * segment["scales"][offset]
+        return vectors
+
+    def _assign_lists(self, vectors):
+        if self._centroids is None:
+            return np.full(len(vectors), -1, dtype=np.int32)
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _save_meta(self):
+        values = {"dtype": self.dtype, "rows": str(self.rows)}
+        if self.dim is not None:
+            values["dim"] = str(self.dim)
+        self._connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values.items())
+
+    def _rows_of(self, ids):
+        rows = {}
+        unique_ids = list(dict.fromkeys(ids))
+        for start in range(0, len(unique_ids), 500):
+            batch = unique_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.update(self._connection.execute(f"SELECT id, row FROM chunks WHERE id IN ({placeholders})", batch).fetchall())
+        return rows
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        """
+        Add chunks with their vectors, replacing the chunks that have the same IDs
+
+        Parameters:
+        - ids (list): Chunk IDs
+        - embeddings (list): One vector per chunk
+        - documents (list, optional): Text of every chunk
+        - metadatas (list, optional): Metadata of every chunk
+        """
+        if not ids:
+            return
+        vectors = normalize_rows(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match collection dimensionality {self.dim}")
+            rows = self._rows_of(ids)
+            positions = []
+            for chunk_id in ids:
+                if chunk_id not in rows:
+                    rows[chunk_id] = self.rows
+                    self.rows += 1
+                positions.append(rows[chunk_id])
+            quantized, scales = self._quantize(vectors)
+            lists = self._assign_lists(vectors)
+            for position, row in enumerate(positions):
+                segment = self._segment(row // SEGMENT_ROWS)
+                offset = row % SEGMENT_ROWS
+                segment["vectors"][offset] = quantized[position]
+                segment["scales"][offset] = scales[position]
+                segment["alive"][offset] = 1
+                segment["lists"][offset] = lists[position]
+            self._connection.executemany("INSERT OR REPLACE INTO chunks (id, row, document, metadata) VALUES (?, ?, ?, ?)",
+                                         [(chunk_id, row, document, json.dumps(metadata or {})) for chunk_id, row, document, metadata in zip(ids, positions, documents, metadatas)])
+            self._save_meta()
+            self._connection.commit()
+
+    add = upsert
+
+    def update(self, ids, embeddings=None, documents=None, metadatas=None):
+        """
+        Update stored chunks. Only the given fields are changed
+
+        Parameters:
+        - ids (list): Chunk IDs
+        - embeddings (list, optional): New vectors
+        - documents (list, optional): New texts
+        - metadatas (list, optional): New metadata
+        """
+        with self._lock:
+            if embeddings is not None:
+                stored = self.get(ids=ids, include=["documents", "metadatas"])
+                current = dict(zip(stored["ids"], zip(stored["documents"], stored["metadatas"])))
+                self.upsert(ids, embeddings, documents or [current.get(chunk_id, (None, None))[0] for chunk_id in ids], metadatas or [current.get(chunk_id, (None, None))[1] for chunk_id in ids])
+                return
+            if documents is not None:
+                self._connection.executemany("UPDATE chunks SET document = ? WHERE id = ?", list(zip(documents, ids)))
+            if metadatas is not None:
+                self._connection.executemany("UPDATE chunks SET metadata = ? WHERE id = ?", [(json.dumps(metadata or {}), chunk_id) for metadata, chunk_id in zip(metadatas, ids)])
+            self._connection.commit()
+
+    def delete(self, ids=None, **kwargs):
+        """
+        Delete chunks. Their rows are only marked as free, compact reclaims the space
+
+        Parameters:
+        - ids (list): IDs of the chunks to delete
+
+        Returns:
+        - bool: True once the chunks are deleted
+        """
+        if not ids:
+            return True
+        with self._lock:
+            for chunk_id, row in self._rows_of(ids).items():
+                self._segment(row // SEGMENT_ROWS)["alive"][row % SEGMENT_ROWS] = 0
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                self._connection.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+            self._connection.commit()
+        return True
+
+    def count(self):
+        """
+        Count the stored chunks
+
+        Returns:
+        - int: Number of chunks
+        """
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def get(self, ids=None, where=None, limit=None, offset=None, where_document=None, include=("documents", "metadatas")):
+        """
+        Get stored chunks, in the same format as Chroma
+
+        Parameters:
+        - ids (list, optional): IDs of the chunks. Defaults to every chunk, in insertion order
+        - where (dict, optional): Metadata filter
+        - limit (int, optional): Maximum number of chunks returned
+        - offset (int, optional): Number of matching chunks skipped
+        - where_document: Not supported, must be None
+        - include (list): Fields returned among documents, metadatas and embeddings
+
+        Returns:
+        - dict: Lists of ids, documents, metadatas and embeddings. Fields that were not included are None
+        """
+        if where_document:
+            raise ValueError("where_document filters are not supported")
+        # The connection is shared with the writers, and the rows must not move before their vectors are read
+        with self._lock:
+            if ids is not None:
+                records = []
+                unique_ids = list(dict.fromkeys(ids))
+                for start in range(0, len(unique_ids), 500):
+                    batch = unique_ids[start:start + 500]
+                    records.extend(self._connection.execute(f"SELECT id, row, document, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))}) ORDER BY row", batch).fetchall())
+            elif where is None:
+                records = self._connection.execute("SELECT id, row, document, metadata FROM chunks ORDER BY row LIMIT ? OFFSET ?", (-1 if limit is None else limit, offset or 0)).fetchall()
+                limit = offset = None
+            else:
+                records = self._connection.execute("SELECT id, row, document, metadata FROM chunks ORDER BY row").fetchall()
+            records = [(chunk_id, row, document, json.loads(metadata)) for chunk_id, row, document, metadata in records]
+            if where:
+                records = [record for record in records if matches_filter(record[3], where)]
+            records = records[offset or 0:][:limit] if limit is not None else records[offset or 0:]
+            vectors = self._read_vectors([row for _, row, _, _ in records]) if "embeddings" in include and records else []
+        return {"ids": [record[0] for record in records],
+                "documents": [record[2] for record in records] if "documents" in include else None,
+                "metadatas": [record[3] for record in records] if "metadatas" in include else None,
+                "embeddings": [vector.tolist() for vector in vectors] if "embeddings" in include else None}
+
+    def _top_rows(self, query, count, probes=IVF_PROBES):
+        # Multiply the query with every live row, block by block, keeping the best rows of every block
+        probed = None
+        if self._centroids is not None:
+            probed = np.argsort(-(self._centroids @ query))[:probes]
+        best_rows = []
+        best_scores = []
+        with self._lock:
+            for number in range((self.rows + SEGMENT_ROWS - 1) // SEGMENT_ROWS):
+                segment = self._segment(number)
+                used = min(SEGMENT_ROWS, self.rows - number * SEGMENT_ROWS)
+                for start in range(0, used, BLOCK_ROWS):
+                    end = min(start + BLOCK_ROWS, used)
+                    mask = segment["alive"][start:end].astype(bool)
+                    if probed is not None:
+                        lists = segment["lists"][start:end]
+                        mask &= np.isin(lists, probed) | (lists < 0)
+                    local = np.flatnonzero(mask)
+                    if not len(local):
+                        continue
+                    if len(local) == end - start:
+                        block, scales = segment["vectors"][start:end], segment["scales"][start:end]
+                    else:
+                        block, scales = segment["vectors"][start + local], segment["scales"][start + local]
+                    scores = (block.astype(np.float32) @ query) * scales
+                    if len(scores) > count:
+                        keep = np.argpartition(-scores, count - 1)[:count]
+                        local, scores = local[keep], scores[keep]
+                    best_rows.append(local + number * SEGMENT_ROWS + start)
+                    best_scores.append(scores)
+        if not best_rows:
+            return []
+        rows = np.concatenate(best_rows)
+        scores = np.concatenate(best_scores)
+        order = np.argsort(-scores)[:count]
+        return list(zip(rows[order].tolist(), scores[order].tolist()))
+
+    def _search(self, embedding, k, where=None):
+        if self.dim is None or not self.rows:
+            return []
+        query = normalize_rows([embedding])[0]
+        if len(query) != self.dim:
+            raise ValueError(f"Embedding dimension {len(query)} does not match collection dimensionality {self.dim}")
+        wanted = k if not where else k * SEARCH_OVERSAMPLE
+        while True:
+            # The rows are looked up under the same lock as the scan, so a compaction cannot move them in between
+            with self._lock:
+                top = self._top_rows(query, wanted)
+                records = {}
+                rows = [row for row, _ in top]
+                for start in range(0, len(rows), 500):
+                    batch = rows[start:start + 500]
+                    records.update((row, (chunk_id, document, metadata)) for chunk_id, row, document, metadata in
+                                   self._connection.execute(f"SELECT id, row, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch).fetchall())
+            results = []
+            for row, score in top:
+                if row in records:
+                    chunk_id, document, metadata = records[row]
+                    metadata = json.loads(metadata)
+                    if matches_filter(metadata, where):
+                        results.append((Document(page_content=document or "", metadata=metadata), score))
+            # Widen the search while the filter leaves fewer than k chunks and some rows were not looked at
+            if len(results) >= k or len(top) < wanted or wanted >= self.rows:
+                return results[:k]
+            wanted *= SEARCH_OVERSAMPLE
+
+    def build_ivf(self, n_lists=None, iterations=10, sample_size=50_000, seed=0):
+        """
+        Partition the vectors around k-means centroids, so searches only look at the closest lists
+
+        Chunks added later are assigned to their closest centroid. Call again after large changes of the collection.
+
+        Parameters:
+        - n_lists (int, optional): Number of lists. Defaults to the square root of the number of chunks
+        - iterations (int): Number of k-means iterations
+        - sample_size (int): Number of vectors the centroids are computed from
+        - seed (int): Seed of the random generator
+        """
+        with self._lock:
+            live_rows = [row for (row,) in self._connection.execute("SELECT row FROM chunks ORDER BY row").fetchall()]
+            if not live_rows:
+                return
+            n_lists = min(n_lists or max(1, int(np.sqrt(len(live_rows)))), len(live_rows))
+            rng = np.random.default_rng(seed)
+            sample = self._read_vectors(sorted(rng.choice(live_rows, size=min(sample_size, len(live_rows)), replace=False).tolist()))
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for list_number in range(n_lists):
+                    members = sample[assignment == list_number]
+                    # Empty lists are moved to a random vector
+                    centroids[list_number] = members.mean(axis=0) if len(members) else sample[rng.integers(len(sample))]
+                centroids = normalize_rows(centroids)
+            self._centroids = centroids.astype(np.float32)
+            path = os.path.join(self.directory, "centroids.npy")
+            np.save(path + ".tmp.npy", self._centroids)
+            os.replace(path + ".tmp.npy", path)
+            for number in range((self.rows + SEGMENT_ROWS - 1) // SEGMENT_ROWS):
+                segment = self._segment(number)
+                used = min(SEGMENT_ROWS, self.rows - number * SEGMENT_ROWS)
+                for start in range(0, used, BLOCK_ROWS):
+                    end = min(start + BLOCK_ROWS, used)
+                    block = segment["vectors"][start:end].astype(np.float32) * segment["scales"][start:end, None]
+                    segment["lists"][start:end] = self._assign_lists(block)
+            self.persist()
+
+    def compact(self):
+        """
+        Rewrite the segments without the rows of deleted chunks, so the files shrink to the stored chunks
+
+        The new segments are written beside the current ones and the new rows are committed to the side table
+        before the files are swapped. A compaction interrupted after the commit is finished when the store is opened.
+
+        Returns:
+        - int: Number of freed rows that were reclaimed
+        """
+        with self._lock:
+            records = self._connection.execute("SELECT id, row FROM chunks ORDER BY row").fetchall()
+            freed = self.rows - len(records)
+            if not freed:
+                return 0
+            compact_directory = self.directory + ".compact"
+            shutil.rmtree(compact_directory, ignore_errors=True)
+            os.makedirs(compact_directory)
+            old_rows = np.array([row for _, row in records], dtype=np.int64)
+            kinds = {"vectors": (np.dtype(self.dtype), (self.dim,)), "scales": (np.float32, ()), "alive": (np.uint8, ()), "lists": (np.int32, ())}
+            for number in range((len(records) + SEGMENT_ROWS - 1) // SEGMENT_ROWS):
+                rows = old_rows[number * SEGMENT_ROWS:(number + 1) * SEGMENT_ROWS]
+                for kind, (dtype, shape) in kinds.items():
+                    target = np.lib.format.open_memmap(os.path.join(compact_directory, os.path.basename(self._segment_path(number, kind))), mode="w+", dtype=dtype, shape=(SEGMENT_ROWS,) + shape)
+                    if kind == "lists":
+                        target[:] = -1
+                    # Copy the rows segment by segment of the current layout
+                    for old_number in np.unique(rows // SEGMENT_ROWS):
+                        positions = np.flatnonzero(rows // SEGMENT_ROWS == old_number)
+                        target[positions] = self._segment(int(old_number))[kind][rows[positions] % SEGMENT_ROWS]
+                    target.flush()
+                    del target
+            self._connection.executemany("UPDATE chunks SET row = ? WHERE id = ?", [(row, chunk_id) for row, (chunk_id, _) in enumerate(records)])
+            self.rows = len(records)
+            self._save_meta()
+            # Marks the swap as pending, in the same transaction as the new rows
+            self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('compaction', 'pending')")
+            self._connection.commit()
+            self._finish_compaction()
+            self._connection.execute("VACUUM")
+            return freed
+
+    def _finish_compaction(self):
+        # Swap in the segments written by compact once its rows are committed, or drop them if they never were
+        compact_directory = self.directory + ".compact"
+        pending = self._connection.execute("SELECT value FROM meta WHERE key = 'compaction'").fetchone() is not None
+        if pending:
+            self._segments = {}
+            if os.path.isdir(compact_directory):
+                for name in os.listdir(compact_directory):
+                    os.replace(os.path.join(compact_directory, name), os.path.join(self.directory, name))
+            # The segments past the committed rows belonged to the old layout
+            segments = (self.rows + SEGMENT_ROWS - 1) // SEGMENT_ROWS
+            for name in os.listdir(self.directory):
+                if name.startswith("segment_") and int(name.split("_")[1]) >= segments:
+                    os.remove(os.path.join(self.directory, name))
+            self._connection.execute("DELETE FROM meta WHERE key = 'compaction'")
+            self._connection.commit()
+        shutil.rmtree(compact_directory, ignore_errors=True)
+
+    def persist(self):
+        """Flush the mapped matrices and the side table to disk"""
+        with self._lock:
+            for segment in self._segments.values():
+                for array in segment.values():
+                    array.flush()
+            self._save_meta()
+            self._connection.commit()
+
+    def close(self):
+        """Flush the store and release its SQLite connection and mapped files. They are opened again if the store is used"""
+        with self._lock:
+            if self._database is None:
+                return
+            self.persist()
+            self._segments = {}
+            self._database.close()
+            self._database = None
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """
+        Embed texts and add them to the store
+
+        Parameters:
+        - texts (iterable): Texts to add
+        - metadatas (list, optional): Metadata of every text
+        - ids (list, optional): IDs of the texts. Random IDs are used if not given
+
+        Returns:
+        - list: IDs of the added texts
+        """
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self.upsert(ids, self._embedding.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self._search(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        # Scores are cosine distances like Chroma's, lower is closer
+        return [(doc, 1.0 - score) for doc, score in self._search(self._embedding.embed_query(query), k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1.0 - distance
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, collection_name="langchain", dtype="int8", **kwargs):
+        """
+        Create a store from texts
+
+        Parameters:
+        - texts (list): Texts to add
+        - embedding (Embeddings): Embedder used for texts and queries
+        - metadatas (list, optional): Metadata of every text
+        - ids (list, optional): IDs of the texts
+        - persist_directory (str): Directory of the vectorstore
+        - collection_name (str): Name of the collection
+        - dtype (str): Storage type of the vectors, float16 or int8
+
+        Returns:
+        - NumpyVectorStore: The store
+        """
+        if persist_directory is None:
+            raise ValueError("persist_directory is required")
+        store = cls(persist_directory, embedding, collection_name=collection_name, dtype=dtype)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -1,25 +1,68 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import Chroma
+# LangChain, the Gemini client, Chroma and the embedders are imported where they are used, so importing this module
+# (and rendering the app) does not wait for them
 from dotenv import load_dotenv
+from utils.ingest_manifest import IngestionManifest, hash_file, hash_text, make_chunk_id, read_index_version
+from utils.resources import get_resource
+from utils.embedding_pipeline import embed_and_store
+from utils.bm25_index import BM25Index
+from utils.dedup import DedupIndex
+from utils.source_loaders import extract_pdf_text, iter_pdf_documents, iter_source_documents, PDF_WORKERS
+from utils import metrics
 import os
-import os
-def extract_pdf_text(pdfs):
+import re
+
+# Directory of the vectorstore. Set PERSIST_DIRECTORY to use another one; relative paths start from the working directory
+PERSIST_DIRECTORY = os.getenv("PERSIST_DIRECTORY", "Vector_DB - Documents")
+# The manifest lives next to the Chroma files and records what has already been ingested
+MANIFEST_FILENAME = "ingest_manifest.json"
+# Small chunks keep prompts short: the retriever packs the best of them into a token budget instead of pasting whole pages
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 150
+# The BM25 index used for lexical retrieval is persisted beside the Chroma files
+BM25_DIRNAME = "bm25"
+# Every source type is stored in its own Chroma collection (shard) with its own BM25 index. The documents shard keeps
+# Chroma's default collection name, so vectorstores created before shards existed keep working
+DEFAULT_SHARD = "documents"
+SHARD_COLLECTIONS = {DEFAULT_SHARD: "langchain"}
+VIDEO_FILES = ("video_text.txt", "video_transcription.txt")
+# The crawler keeps a copy of every page in this folder, but the pages are ingested under their URL, not as files
+WEB_DOCS_DIRECTORY = os.path.join("docs", "web")
+# Set VECTOR_BACKEND=numpy to keep the vectors in memory-mapped quantized NumPy matrices instead of Chroma
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Storage type of the NumPy backend, int8 or float16, and the directory of its collections
+NUMPY_VECTOR_DTYPE = os.getenv("NUMPY_VECTOR_DTYPE", "int8")
+NUMPY_DIRNAME = "numpy_index"
+# Chunks identical or nearly identical to a stored chunk of the same shard are referenced instead of embedded again.
+# Set DEDUPLICATE_CHUNKS=0 to embed every chunk. The references of the chunks are recorded either way
+DEDUPLICATE_CHUNKS = os.getenv("DEDUPLICATE_CHUNKS", "1") != "0"
+DEDUP_FILENAME = "dedup.sqlite3"
+EMBEDDING_MODEL = "models/embedding-001"
+# Set EMBEDDING_BACKEND=fake to use the offline hashing embedder (benchmarks and runs without an API key)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google")
+# Embeddings are cached on disk so re-chunking, rebuilding the index and repeated queries do not call the API again
+EMBEDDING_CACHE_FILENAME = "embedding_cache.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+def iter_text_chunks(docs):
     """
-    Extract text from PDF documents
+    Split text into chunks, one document at a time
+
+    Chunks of documents that have a character offset (sections of text files) get the offset of the chunk itself.
 
     Parameters:
-    - pdfs (list): List of PDF documents
+    - docs (iterable): Text documents. Consumed lazily
 
-    Returns:
-    - docs: List of text extracted from PDF documents
+    Yields:
+    - Document: Text chunks
     """
-    docs = []
-    for pdf in pdfs:
-        pdf_path = os.path.join("docs", pdf)
-        docs.extend(PyPDFLoader(pdf_path).load())
-    return docs
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=["\n\n", "\n", " ", ""], add_start_index=True)
+    for doc in docs:
+        for chunk in text_splitter.split_documents([doc]):
+            start = chunk.metadata.pop("start_index")
+            if "offset" in doc.metadata:
+                chunk.metadata["offset"] = doc.metadata["offset"] + start
+            yield chunk
 
 def get_text_chunks(docs):
     """
@@ -31,67 +74,548 @@ def get_text_chunks(docs):
     Returns:
     - chunks: List of text chunks
     """
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=8000, chunk_overlap=800, separators=["\n\n", "\n", " ", ""])
-    chunks = text_splitter.split_documents(docs)
-    return chunks
+    return list(iter_text_chunks(docs))
+
+def shard_for_source(source):
+    """
+    Get the shard a source is stored in
+
+    Web pages and scraped text go to the web shard and video text to the video shard. Files in a subfolder of docs
+    go to a shard named after the subfolder, so groups of documents can be searched on their own. Every other file
+    goes to the documents shard.
+
+    Parameters:
+    - source (str): Source of the documents
+
+    Returns:
+    - str: Name of the shard
+    """
+    if source.startswith(("http://", "https://")) or source == "scraped_text":
+        return "web"
+    if os.path.basename(source) in VIDEO_FILES:
+        return "video"
+    parts = os.path.normpath(source).split(os.sep)
+    if len(parts) > 2 and parts[0] == "docs":
+        # Collection names only allow letters, digits, underscores and hyphens
+        return ("group_" + re.sub(r"[^A-Za-z0-9_-]", "_", parts[1]))[:63].rstrip("_-")
+    return DEFAULT_SHARD
+
+def get_collection_name(shard):
+    """
+    Get the name of the Chroma collection of a shard
+
+    Parameters:
+    - shard (str): Name of the shard
+
+    Returns:
+    - str: Name of the collection
+    """
+    return SHARD_COLLECTIONS.get(shard, shard)
+
+def get_shard_name(collection_name):
+    """
+    Get the shard stored in a Chroma collection
+
+    Parameters:
+    - collection_name (str): Name of the collection
+
+    Returns:
+    - str: Name of the shard
+    """
+    return next((shard for shard, name in SHARD_COLLECTIONS.items() if name == collection_name), collection_name)
+
+class ShardedStore:
+    """
+    The shards of a vectorstore, one Chroma collection per source type or document group.
+
+    Two stores are equal when they hold the same Chroma objects, so chains built for a store are reused across reruns.
+    """
+    def __init__(self, persist_directory, shards):
+        """
+        Parameters:
+        - persist_directory (str): Directory of the vectorstore
+        - shards (dict): Chroma object of every shard, by shard name
+        """
+        self.persist_directory = persist_directory
+        self.shards = shards
+
+    @property
+    def embeddings(self):
+        return get_embedding(self.persist_directory)
+
+    @property
+    def names(self):
+        return sorted(self.shards)
+
+    def count(self):
+        """
+        Count the chunks stored in every shard
+
+        Returns:
+        - int: Number of chunks
+        """
+        return sum(vectordb._collection.count() for vectordb in self.shards.values())
+
+    def select(self, names):
+        """
+        Get a store restricted to some shards
+
+        Parameters:
+        - names (list): Names of the shards to keep. Unknown names are ignored
+
+        Returns:
+        - ShardedStore: The restricted store
+        """
+        return ShardedStore(self.persist_directory, {name: self.shards[name] for name in names if name in self.shards})
+
+    def _key(self):
+        return self.persist_directory, tuple(sorted((name, id(vectordb)) for name, vectordb in self.shards.items()))
+
+    def __eq__(self, other):
+        return isinstance(other, ShardedStore) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+def get_embedding(persist_directory=PERSIST_DIRECTORY):
+    """
+    Get the embedder used by the vectorstore, wrapped in the on-disk embedding cache. It is built once per process
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore, where the cache file is kept
+
+    Returns:
+    - CachedEmbeddings: The cached embedder
+    """
+    def build():
+        from utils.embedding_cache import CachedEmbeddings
+        from utils.resilient_client import ResilientEmbeddings, get_client
+        load_dotenv()
+        if EMBEDDING_BACKEND == "fake":
+            from utils.fakes import HashingEmbeddings
+            embedding = HashingEmbeddings()
+        else:
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+            embedding = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+        cache_path = os.path.join(persist_directory, EMBEDDING_CACHE_FILENAME)
+        # Requests missing the cache go through the shared embedding client, which coalesces, caps and retries them
+        return CachedEmbeddings(ResilientEmbeddings(embedding, get_client("embedding")), cache_path, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+
+    return get_resource("embedding", build, fingerprint=(persist_directory, EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_CACHE_MAX_ENTRIES))
+
+def get_index_version(persist_directory=PERSIST_DIRECTORY):
+    """
+    Get the version of the index, which changes every time ingestion changes the corpus
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - int: Version of the index
+    """
+    return read_index_version(os.path.join(persist_directory, MANIFEST_FILENAME))
+
+def get_committed_version(vectordb):
+    """
+    Get the last committed index version of a vectorstore, which is what the chat should query
+
+    Parameters:
+    - vectordb (Chroma or ShardedStore): The vectorstore
+
+    Returns:
+    - int: The committed version, or None for a vectorstore that is not persisted (and has no manifest)
+    """
+    persist_directory = vectordb.persist_directory if isinstance(vectordb, ShardedStore) else vectordb._persist_directory
+    return get_index_version(persist_directory) if persist_directory else None
 
-def get_vectorstore(pdfs, scraped_text=None, from_session_state=False):
+def open_vectorstore(persist_directory=PERSIST_DIRECTORY, shard=DEFAULT_SHARD):
     """
-    Create or retrieve a vectorstore from PDF documents and scraped content.
+    Get the shared vectorstore object of a shard. It is reopened only when the index version, the embedder or the
+    backend changes
 
     Parameters:
-    - pdfs (list): List of PDF file paths
+    - persist_directory (str): Directory of the vectorstore
+    - shard (str): Name of the shard
+
+    Returns:
+    - Chroma or NumpyVectorStore: The vectorstore object of the shard
+    """
+    embedding = get_embedding(persist_directory)
+
+    def build():
+        with metrics.span("chroma_open", shard=shard, backend=VECTOR_BACKEND):
+            if VECTOR_BACKEND == "numpy":
+                from utils.numpy_vectorstore import NumpyVectorStore
+                return NumpyVectorStore(persist_directory, embedding, collection_name=get_collection_name(shard), dtype=NUMPY_VECTOR_DTYPE, directory_name=NUMPY_DIRNAME)
+            from langchain_community.vectorstores import Chroma
+            return Chroma(collection_name=get_collection_name(shard), persist_directory=persist_directory, embedding_function=embedding)
+
+    return get_resource(f"vectordb:{shard}", build, fingerprint=(persist_directory, embedding, VECTOR_BACKEND, get_index_version(persist_directory)))
+
+def list_shards(persist_directory=PERSIST_DIRECTORY):
+    """
+    List the shards stored in a vectorstore
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - list: Names of the shards
+    """
+    if VECTOR_BACKEND == "numpy":
+        from utils.numpy_vectorstore import NumpyVectorStore
+        open_vectorstore(persist_directory)  # Creates the default shard, as Chroma does
+        return sorted(get_shard_name(name) for name in NumpyVectorStore.list_collections(persist_directory, NUMPY_DIRNAME))
+    client = open_vectorstore(persist_directory)._client
+    return sorted(get_shard_name(collection.name) for collection in client.list_collections())
+
+def list_ingested_shards(persist_directory=PERSIST_DIRECTORY):
+    """
+    List the shards that sources were ingested into, from the manifest, without opening the vectorstore
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - list: Names of the shards
+    """
+    def build():
+        manifest = get_manifest(persist_directory)
+        return sorted({manifest.get_shard(source) or DEFAULT_SHARD for source in manifest.sources})
+
+    return get_resource("ingested_shards", build, fingerprint=(persist_directory, get_index_version(persist_directory)))
+
+def open_sharded_store(persist_directory=PERSIST_DIRECTORY, shards=None):
+    """
+    Get the shards of a vectorstore
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+    - shards (list, optional): Names of the shards to open. Defaults to every shard of the vectorstore
+
+    Returns:
+    - ShardedStore: The shards
+    """
+    available = list_shards(persist_directory)
+    names = available if shards is None else [shard for shard in shards if shard in available]
+    return ShardedStore(persist_directory, {shard: open_vectorstore(persist_directory, shard) for shard in names})
+
+def get_bm25_dirname(vectordb):
+    """
+    Get the name of the directory of the BM25 index of a shard
+
+    Parameters:
+    - vectordb (Chroma): The vectorstore of the shard
+
+    Returns:
+    - str: Name of the directory, inside the directory of the vectorstore
+    """
+    collection_name = vectordb._collection.name
+    # The documents shard keeps the index directory used before shards existed
+    return BM25_DIRNAME if collection_name == get_collection_name(DEFAULT_SHARD) else f"{BM25_DIRNAME}_{collection_name}"
+
+def get_bm25_index(vectordb):
+    """
+    Get the BM25 index of a shard, shared by ingestion and retrieval
+
+    If the shard has chunks but no BM25 index yet, the index is built from the stored chunks, and chunks stored
+    before index versions existed are tagged as part of version 0.
+
+    Parameters:
+    - vectordb (Chroma): The vectorstore of the shard
+
+    Returns:
+    - BM25Index: The index
+    """
+    persist_directory = vectordb._persist_directory
+    collection_name = vectordb._collection.name
+
+    def build():
+        index_directory = os.path.join(persist_directory, get_bm25_dirname(vectordb)) if persist_directory else None
+        index = BM25Index.load(index_directory) if index_directory else BM25Index()
+        stored_count = vectordb._collection.count()
+        if not len(index) and stored_count:
+            # Index the chunks ingested before the BM25 index existed
+            for offset in range(0, stored_count, 1000):
+                batch = vectordb.get(include=["documents", "metadatas"], limit=1000, offset=offset)
+                for chunk_id, text in zip(batch["ids"], batch["documents"]):
+                    index.add(chunk_id, text)
+                # Chunks stored before index versions existed belong to every committed version
+                legacy = [(chunk_id, metadata) for chunk_id, metadata in zip(batch["ids"], batch["metadatas"]) if "index_version" not in (metadata or {})]
+                if legacy:
+                    vectordb._collection.update(ids=[chunk_id for chunk_id, _ in legacy], metadatas=[{**(metadata or {}), "index_version": 0} for _, metadata in legacy])
+            if index_directory:
+                index.save(index_directory)
+        return index
+
+    # Like the vectorstore, the index is reloaded when another process changed the corpus
+    return get_resource(f"bm25_index:{collection_name}", build, fingerprint=(persist_directory, get_index_version(persist_directory)) if persist_directory else vectordb)
+
+def get_manifest(persist_directory=PERSIST_DIRECTORY):
+    """
+    Load the ingestion manifest of a vectorstore
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - IngestionManifest: The manifest. Chunks produced with another chunking configuration are treated as changed
+    """
+    fingerprint = f"chunk_size={CHUNK_SIZE};chunk_overlap={CHUNK_OVERLAP}"
+    # The backends keep separate files, so switching backend ingests every source again into the new one
+    if VECTOR_BACKEND != "chroma":
+        fingerprint += f";vector_backend={VECTOR_BACKEND}"
+    return IngestionManifest(os.path.join(persist_directory, MANIFEST_FILENAME), fingerprint=fingerprint)
+
+def get_dedup_path(persist_directory=PERSIST_DIRECTORY):
+    """
+    Get the path of the index of the stored chunks of a vectorstore
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - str: Path of the SQLite file
+    """
+    # The backends keep separate files, so each one has its own record of the stored chunks
+    dedup_filename = DEDUP_FILENAME if VECTOR_BACKEND == "chroma" else f"{VECTOR_BACKEND}_{DEDUP_FILENAME}"
+    return os.path.join(persist_directory, dedup_filename)
+
+def open_dedup_index(persist_directory=PERSIST_DIRECTORY):
+    """
+    Open the index of the stored chunks of a vectorstore. While it is open, other writers of the vectorstore wait
+    until it is closed
+
+    Parameters:
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - DedupIndex: The index
+    """
+    return DedupIndex(get_dedup_path(persist_directory), detect=DEDUPLICATE_CHUNKS)
+
+def ingest_documents(vectordb, manifest, index, source, content_hash, docs, progress=None, shard=None, dedup=None):
+    """
+    Chunk the documents of a source and write them to the vectorstore, recording them in the manifest
+
+    The chunks are tagged with the index version they will belong to once the ingestion is committed, so readers that
+    filter on the committed version do not see them before that. The chunks of the previous version of the source
+    are left in place; the caller deletes them when it commits. Chunks that duplicate a stored chunk are not
+    embedded: the source records the stored chunk among its chunks instead. If the source fails, the chunks already
+    written for it are deleted, so the commit of the other sources does not publish them.
+
+    Parameters:
+    - vectordb (Chroma): The vectorstore to write to
+    - manifest (IngestionManifest): Manifest where the source is recorded
+    - index (BM25Index): Lexical index updated with the chunks
+    - source (str): Source the documents come from
+    - content_hash (str): Hash of the source content
+    - docs (iterable): Documents extracted from the source. Consumed lazily
+    - progress (callable, optional): Called as progress(stage, **counters) while the source is chunked and embedded
+    - shard (str, optional): Shard the vectorstore belongs to, recorded in the manifest
+    - dedup (DedupIndex, optional): Index of the stored chunks, used to skip duplicates
+
+    Returns:
+    - tuple: (IDs of the chunks of the previous version of the source that are no longer used, number of duplicate chunks skipped)
+    """
+    chunk_ids = []
+    written_ids = []
+    referenced = set()
+    duplicates = 0
+
+    def identified_chunks():
+        nonlocal duplicates
+        for position, chunk in enumerate(iter_text_chunks(docs)):
+            chunk_id = make_chunk_id(source, content_hash, position)
+            metrics.increment("chunks_created_total")
+            duplicate_of, kind = dedup.check(shard or DEFAULT_SHARD, chunk_id, source, chunk.page_content) if dedup else (None, None)
+            if duplicate_of is not None:
+                duplicates += 1
+                metrics.increment("duplicate_chunks_total", kind=kind)
+                if duplicate_of not in referenced:
+                    referenced.add(duplicate_of)
+                    chunk_ids.append(duplicate_of)
+                if progress:
+                    progress("chunk", chunks=len(chunk_ids), duplicates=duplicates)
+                continue
+            chunk.metadata.update({"chunk_id": chunk_id, "chunk_index": position, "index_version": manifest.version + 1})
+            chunk_ids.append(chunk_id)
+            written_ids.append(chunk_id)
+            referenced.add(chunk_id)
+            index.add(chunk_id, chunk.page_content)
+            if progress:
+                progress("chunk", chunks=len(chunk_ids), duplicates=duplicates)
+            yield chunk_id, chunk
+
+    # Embed in concurrent batches and write each batch as soon as its vectors arrive
+    try:
+        embed_and_store(vectordb, vectordb.embeddings, identified_chunks(), progress=progress)
+    except Exception:
+        # The manifest never records these chunks, so nothing else would delete them
+        if written_ids:
+            vectordb.delete(ids=written_ids)
+            index.delete(written_ids)
+        raise
+    new_ids = set(chunk_ids)
+    stale_ids = [chunk_id for chunk_id in manifest.get_chunk_ids(source) if chunk_id not in new_ids]
+    manifest.record(source, content_hash, chunk_ids, shard)
+    return stale_ids, duplicates
+
+def ingest_sources(sources, persist_directory=PERSIST_DIRECTORY, progress=None):
+    """
+    Ingest a stream of sources into the shards of the vectorstore and commit the changes once at the end
+
+    Every source is written to the shard of its type. Until the commit, readers that filter on the committed index
+    version keep seeing the previous content. Duplicate chunks are skipped, and the number skipped is printed.
+
+    Parameters:
+    - sources (iterable): Tuples of (source, content_hash, docs). Unchanged sources are skipped without reading their documents
+    - persist_directory (str): Directory of the vectorstore
+    - progress (callable, optional): Called as progress(stage, **counters) for the extract, chunk, embed and persist stages
+
+    Returns:
+    - tuple: (ShardedStore, number of sources that were ingested)
+    """
+    if not os.path.exists(persist_directory):
+        os.makedirs(persist_directory)  # Ensure the directory is created
+    # The manifest is read once no other writer can change it
+    dedup = open_dedup_index(persist_directory)
+    manifest = get_manifest(persist_directory)
+    opened = {}
+    changed_sources = 0
+    duplicates = 0
+    stale_ids = []
+
+    def open_shard(shard):
+        # Shards are only opened when a source is written to them
+        if shard not in opened:
+            vectordb = open_vectorstore(persist_directory, shard)
+            opened[shard] = (vectordb, get_bm25_index(vectordb))
+        return opened[shard]
+
+    try:
+        for source, content_hash, docs in sources:
+            # Skip sources that were already ingested with the same content
+            if manifest.is_unchanged(source, content_hash):
+                continue
+            if progress:
+                progress("extract", source=source, sources_done=changed_sources)
+            shard = shard_for_source(source)
+            previous_shard = manifest.get_shard(source) or DEFAULT_SHARD
+            previous_ids = manifest.get_chunk_ids(source)
+            vectordb, index = open_shard(shard)
+            dedup.start_source()
+            try:
+                with metrics.span("ingest_source", shard=shard):
+                    unused_ids, source_duplicates = ingest_documents(vectordb, manifest, index, source, content_hash, docs, progress, shard, dedup)
+            except Exception:
+                dedup.abort_source()
+                raise
+            dedup.finish_source(source)
+            duplicates += source_duplicates
+            # A source that moved to another shard leaves all of its previous chunks behind
+            stale_ids.append((previous_shard, previous_ids if previous_shard != shard else unused_ids))
+            changed_sources += 1
+            metrics.increment("sources_ingested_total", shard=shard)
+    finally:
+        # Commit what was ingested, even if a later source failed
+        if changed_sources:
+            if progress:
+                progress("persist", sources_done=changed_sources)
+            with metrics.span("persist"):
+                for vectordb, index in opened.values():
+                    vectordb.persist()  # Persist changes
+                    # Saved before the commit, so the index reloaded for the new version has the new chunks
+                    index.save(os.path.join(persist_directory, get_bm25_dirname(vectordb)))
+                dedup.commit()
+                manifest.commit()
+                # The previous chunks are removed only after the new version is committed, unless another source still uses them
+                for shard, ids in stale_ids:
+                    ids = dedup.unreferenced(ids)
+                    if ids:
+                        vectordb, index = open_shard(shard)
+                        vectordb.delete(ids=ids)
+                        index.delete(ids)
+                dedup.update_references(lambda shard: open_shard(shard)[0])
+                dedup.commit()
+                for vectordb, index in opened.values():
+                    index.save(os.path.join(persist_directory, get_bm25_dirname(vectordb)))
+        dedup.close()
+        if duplicates:
+            print(f"Skipped {duplicates} duplicate chunks.")
+    return open_sharded_store(persist_directory), changed_sources
+
+def iter_file_sources(paths, manifest):
+    """
+    Hash files and extract the ones that are new or changed since they were ingested
+
+    Parameters:
+    - paths (list): Paths of the files, PDF or text. Missing files are skipped
+    - manifest (IngestionManifest): Manifest of the vectorstore
+
+    Yields:
+    - tuple: (path, content_hash, docs) for every new or changed file, in the format of ingest_sources
+    """
+    content_hashes = {}
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        content_hash = hash_file(path)
+        # Only the documents that are new or changed are extracted
+        if not manifest.is_unchanged(path, content_hash):
+            content_hashes[path] = content_hash
+    # Documents are extracted by the loader of their type and streamed straight into chunking and embedding
+    for path, docs in iter_source_documents(list(content_hashes)):
+        yield path, content_hashes[path], docs
+
+def get_vectorstore(pdfs, scraped_text=None, from_session_state=False, progress=None):
+    """
+    Create or retrieve a vectorstore from PDF documents, text files and scraped content.
+
+    Only new or changed documents are embedded: the ingestion manifest keeps the content hash of every document,
+    so unchanged documents are skipped and the chunks of changed ones are replaced. Each file is read by the loader
+    of its type; text files such as scraped pages and video transcripts are streamed, so their size does not matter.
+
+    Parameters:
+    - pdfs (list): Names of the files in the docs folder, PDF or text
     - scraped_text (str, optional): Scraped text content to add to vectorstore
     - from_session_state (bool): Flag to indicate if the vectorstore should be loaded from session state
+    - progress (callable, optional): Called as progress(stage, **counters) while the documents are ingested
 
     Returns:
-    - Chroma: The vectorstore object
+    - ShardedStore: The shards of the vectorstore
     """
-    load_dotenv()
-    embedding = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    
-    # Set the correct path for the vectorstore directory
-    persist_directory = r'L:\test4\RAG-chatbot\Vector_DB - Documents'
-    
+    persist_directory = PERSIST_DIRECTORY
+
     if not os.path.exists(persist_directory):
         os.makedirs(persist_directory)  # Ensure the directory is created
 
     # Retrieve vectorstore from existing one
     if from_session_state and os.path.exists(persist_directory):
         try:
-            vectordb = Chroma(persist_directory=persist_directory, embedding_function=embedding)
-            return vectordb
+            return open_sharded_store(persist_directory)
         except Exception as e:
             print(f"Error loading vectorstore from '{persist_directory}': {e}")
             return None
-    
+
     # Create or update vectorstore
     elif not from_session_state:
-        docs = extract_pdf_text(pdfs)  # Extract text from PDFs
-        
-        # Directly add scraped text as a document if provided
-        if scraped_text:
-            docs.append(scraped_text)  # Ensure scraped text is added as a separate document
-
-        # Ensure documents are processed
-        if not docs:
-            print("No documents found for creating vectorstore.")
-            return None
+        from langchain_core.documents import Document
+        manifest = get_manifest(persist_directory)
+
+        def sources():
+            yield from iter_file_sources([os.path.join("docs", name) for name in pdfs], manifest)
+            # Directly add scraped text as a document if provided
+            if scraped_text:
+                yield "scraped_text", hash_text(scraped_text), [Document(page_content=scraped_text, metadata={"source": "scraped_text", "page": 0})]
 
-        chunks = get_text_chunks(docs)  # Chunk the documents
-        
         try:
-            if os.path.exists(persist_directory) and len(chunks) > 0:
-                vectordb = Chroma(persist_directory=persist_directory, embedding_function=embedding)
-                vectordb.add_documents(documents=chunks)  # Append new data to the existing vectorstore
-                vectordb.persist()  # Persist changes
-            else:
-                vectordb = Chroma.from_documents(documents=chunks, embedding=embedding, persist_directory=persist_directory)
-                vectordb.persist()  # Ensure persistence
-            
+            vectordb, changed_sources = ingest_sources(sources(), persist_directory, progress)
+            if not changed_sources:
+                print("No new or changed documents found for the vectorstore.")
             return vectordb
         except Exception as e:
             print(f"Error creating or appending to vectorstore: {e}")
             return None
-    
+
     return None
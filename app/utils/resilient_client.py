@@ -0,0 +1,342 @@
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
+from typing import Any
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from utils.resources import get_resource
+from utils import metrics
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+# Requests sent to a model API at the same time, per API. Later requests wait in a queue
+CLIENT_MAX_CONCURRENCY = int(os.getenv("CLIENT_MAX_CONCURRENCY", "8"))
+# Seconds a caller waits for a request, retries included
+CLIENT_TIMEOUT_SECONDS = float(os.getenv("CLIENT_TIMEOUT_SECONDS", "60"))
+# Throttled or transient failures are retried this many times, after a random delay of up to base * 2^attempt seconds
+CLIENT_MAX_RETRIES = int(os.getenv("CLIENT_MAX_RETRIES", "4"))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20.0
+
+def is_retryable(error):
+    """
+    Check if an error is worth retrying: the API is throttling requests or failed transiently
+
+    Parameters:
+    - error (Exception): Error raised by the model API
+
+    Returns:
+    - bool: True if the request should be retried later
+    """
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "ConnectionError"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "503" in message or "quota" in message or "rate limit" in message
+
+def request_key(*parts):
+    """
+    Build the key under which identical requests are coalesced
+
+    Parameters:
+    - parts: Everything the answer of the request depends on. Values that are not JSON are keyed by their repr
+
+    Returns:
+    - str: Hex digest of the parts
+    """
+    return hashlib.sha256(json.dumps(parts, default=repr, sort_keys=True).encode("utf-8")).hexdigest()
+
+class SharedStream:
+    """Chunks produced by one streamed request, read by every caller that asked for it"""
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def append(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+class ResilientClient:
+    """
+    Shared gateway for the requests sent to one model API.
+
+    Identical requests in flight are coalesced: the first caller sends the request and every caller with the same
+    key gets its result, streamed answers included. At most max_concurrency requests run at the same time, the others
+    wait in a queue. Every call has a deadline, and throttled or transient failures are retried with exponential
+    backoff and full jitter while the deadline allows it. A request that outlives its deadline keeps its place until
+    the API answers, but its callers stop waiting.
+
+    Queue depth and requests in flight are exported as gauges, request and call latency as histograms, and
+    retries, timeouts, errors and coalesced calls as counters, all labelled with the name of the client.
+    """
+    def __init__(self, name, max_concurrency=CLIENT_MAX_CONCURRENCY, timeout=CLIENT_TIMEOUT_SECONDS, max_retries=CLIENT_MAX_RETRIES, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        """
+        Parameters:
+        - name (str): Name of the API, used as the label of the metrics
+        - max_concurrency (int): Maximum number of requests running at the same time
+        - timeout (float): Default deadline of a call in seconds
+        - max_retries (int): Maximum number of retries of a request
+        - base_delay (float): Maximum delay in seconds before the first retry
+        - max_delay (float): Maximum delay in seconds between retries
+        """
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"{name}_client")
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self._queued = 0
+        self._running = 0
+
+    def _update_gauges(self):
+        metrics.set_gauge("client_queue_depth", self._queued, client=self.name)
+        metrics.set_gauge("client_in_flight", self._running, client=self.name)
+
+    def _run(self, function):
+        # Runs on a worker of the executor, which caps the concurrency
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._update_gauges()
+        start = time.perf_counter()
+        try:
+            return function()
+        finally:
+            metrics.observe("client_request_seconds", time.perf_counter() - start, client=self.name)
+            with self._lock:
+                self._running -= 1
+                self._update_gauges()
+
+    def _submit(self, function):
+        with self._lock:
+            self._queued += 1
+            self._update_gauges()
+        return self._executor.submit(self._run, function)
+
+    def _timeout_error(self):
+        metrics.increment("client_timeouts_total", client=self.name)
+        return TimeoutError(f"The {self.name} request did not finish before its deadline")
+
+    def _retry_delay(self, error, attempt, deadline):
+        # Returns the delay before the next attempt, or None if the error should be raised
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if attempt >= self.max_retries or not is_retryable(error) or time.monotonic() + delay >= deadline:
+            metrics.increment("client_errors_total", client=self.name, error=type(error).__name__)
+            return None
+        metrics.increment("client_retries_total", client=self.name)
+        return delay
+
+    def _call_with_retries(self, function, deadline):
+        attempt = 0
+        while True:
+            future = self._submit(function)
+            try:
+                return future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                if not future.done():
+                    # A request that did not start yet gives its place back
+                    if future.cancel():
+                        with self._lock:
+                            self._queued -= 1
+                            self._update_gauges()
+                    raise self._timeout_error() from None
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def call(self, key, function, timeout=None):
+        """
+        Send a request, or wait for the identical request already in flight
+
+        Parameters:
+        - key (str): Key of the request, from request_key. None disables coalescing
+        - function (callable): Function without arguments that sends the request
+        - timeout (float, optional): Deadline in seconds. Defaults to the timeout of the client
+
+        Returns:
+        - The result of the request
+        """
+        start = time.perf_counter()
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            shared = self._calls.get(key) if key is not None else None
+            leader = shared is None
+            if leader:
+                shared = Future()
+                if key is not None:
+                    self._calls[key] = shared
+        if leader:
+            try:
+                shared.set_result(self._call_with_retries(function, deadline))
+            except Exception as e:
+                shared.set_exception(e)
+            finally:
+                with self._lock:
+                    if key is not None and self._calls.get(key) is shared:
+                        del self._calls[key]
+        else:
+            metrics.increment("client_coalesced_total", client=self.name)
+        try:
+            return shared.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            if shared.done():
+                raise
+            raise self._timeout_error() from None
+        finally:
+            metrics.observe("client_call_seconds", time.perf_counter() - start, client=self.name, coalesced=not leader)
+
+    def stream(self, key, function, timeout=None):
+        """
+        Send a streamed request, or follow the identical stream already in flight from its first chunk
+
+        A failure before the first chunk is retried. The whole answer must arrive before the deadline.
+
+        Parameters:
+        - key (str): Key of the request, from request_key. None disables coalescing
+        - function (callable): Function without arguments that sends the request and returns an iterator of chunks
+        - timeout (float, optional): Deadline in seconds. Defaults to the timeout of the client
+
+        Yields:
+        - The chunks of the answer
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            shared = self._streams.get(key) if key is not None else None
+            leader = shared is None
+            if leader:
+                shared = SharedStream()
+                if key is not None:
+                    self._streams[key] = shared
+        if leader:
+            self._submit(partial(self._produce, key, shared, function, deadline))
+        else:
+            metrics.increment("client_coalesced_total", client=self.name)
+        position = 0
+        while True:
+            with shared.condition:
+                if not shared.condition.wait_for(lambda: shared.done or len(shared.chunks) > position, timeout=max(0.0, deadline - time.monotonic())):
+                    raise self._timeout_error()
+                chunks = shared.chunks[position:]
+                done, error = shared.done, shared.error
+            position += len(chunks)
+            yield from chunks
+            if done and position == len(shared.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    def _produce(self, key, shared, function, deadline):
+        # Reads the upstream stream into the shared one, retrying while nothing was produced
+        attempt = 0
+        try:
+            while True:
+                try:
+                    for chunk in function():
+                        shared.append(chunk)
+                    shared.finish()
+                    return
+                except Exception as e:
+                    delay = None if shared.chunks else self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        shared.finish(e)
+                        return
+                    time.sleep(delay)
+                    attempt += 1
+        finally:
+            with self._lock:
+                if key is not None and self._streams.get(key) is shared:
+                    del self._streams[key]
+
+def get_client(name):
+    """
+    Get the shared client of a model API. It is built once per process and rebuilt if its configuration changes
+
+    Parameters:
+    - name (str): Name of the API, e.g. llm or embedding
+
+    Returns:
+    - ResilientClient: The client
+    """
+    return get_resource(f"client:{name}", lambda: ResilientClient(name), fingerprint=(CLIENT_MAX_CONCURRENCY, CLIENT_TIMEOUT_SECONDS, CLIENT_MAX_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY))
+
+class ResilientEmbeddings(Embeddings):
+    """Embedder that sends the requests of another embedder through a ResilientClient"""
+    def __init__(self, embedding, client):
+        """
+        Parameters:
+        - embedding (Embeddings): The embedder that calls the API
+        - client (ResilientClient): Client the requests go through
+        """
+        self.embedding = embedding
+        self.client = client
+        # Read by the embedding cache to key its vectors
+        self.model = getattr(embedding, "model", None) or type(embedding).__name__
+
+    def embed_documents(self, texts):
+        """
+        Embed a list of documents
+
+        Parameters:
+        - texts (list): Texts to embed
+
+        Returns:
+        - list: One vector per text
+        """
+        texts = list(texts)
+        return self.client.call(request_key("documents", self.model, texts), partial(self.embedding.embed_documents, texts))
+
+    def embed_query(self, text):
+        """
+        Embed a query
+
+        Parameters:
+        - text (str): Query to embed
+
+        Returns:
+        - list: The query vector
+        """
+        return self.client.call(request_key("query", self.model, text), partial(self.embedding.embed_query, text))
+
+class ResilientChatModel(BaseChatModel):
+    """Chat model that sends the requests of another chat model through a ResilientClient"""
+    model: BaseChatModel
+    client: Any
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self):
+        return f"resilient-{self.model._llm_type}"
+
+    @property
+    def _identifying_params(self):
+        return self.model._identifying_params
+
+    def _request_key(self, messages, stop, kwargs):
+        return request_key(self.model._llm_type, self.model._identifying_params, [(message.type, message.content) for message in messages], stop, kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return self.client.call(self._request_key(messages, stop, kwargs), partial(self.model._generate, messages, stop=stop, **kwargs))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for chunk in self.client.stream(self._request_key(messages, stop, kwargs), partial(self.model._stream, messages, stop=stop, **kwargs)):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -0,0 +1,69 @@
+import threading
+
+# Shared objects of the process (models, vectorstore clients, chains), reused across Streamlit reruns and sessions
+_resources = {}
+# One lock per resource, so building a slow resource does not block the lookups of the others
+_build_locks = {}
+_lock = threading.Lock()
+
+def get_resource(name, factory, fingerprint=None):
+    """
+    Get a shared resource, building it on first use
+
+    The resource is rebuilt when the fingerprint differs from the one it was built with, so a change of
+    configuration or of index version replaces it instead of piling up new instances. The replaced resource is closed.
+
+    Parameters:
+    - name (str): Name of the resource
+    - factory (callable): Function without arguments that builds the resource
+    - fingerprint (optional): Value describing what the resource depends on
+
+    Returns:
+    - The shared resource
+    """
+    entry = _resources.get(name)
+    if entry is not None and entry[0] == fingerprint:
+        return entry[1]
+    with _lock:
+        build_lock = _build_locks.setdefault(name, threading.RLock())
+    with build_lock:
+        # Another thread may have built it while this one was waiting
+        entry = _resources.get(name)
+        if entry is not None and entry[0] == fingerprint:
+            return entry[1]
+        resource = factory()
+        with _lock:
+            _resources[name] = (fingerprint, resource)
+    if entry is not None:
+        close_resource(entry[1])
+    return resource
+
+def close_resource(resource):
+    """
+    Release the connections and files of a resource that was replaced or dropped, if it has a close method
+
+    Parameters:
+    - resource: The resource
+    """
+    close = getattr(resource, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            print(f"Error closing {type(resource).__name__}: {e}")
+
+def invalidate(name=None):
+    """
+    Drop a shared resource so it is rebuilt on next use
+
+    Parameters:
+    - name (str, optional): Name of the resource. All resources are dropped if not given
+    """
+    with _lock:
+        if name is None:
+            dropped = list(_resources.values())
+            _resources.clear()
+        else:
+            dropped = [_resources.pop(name)] if name in _resources else []
+    for _, resource in dropped:
+        close_resource(resource)
@@ -1,6 +1,6 @@
 import os
 import os
-from utils.prepare_vectordb import get_vectorstore
+from utils.chat_memory import ConversationMemory
 
 def initialize_session_state_variables(st):
     """
@@ -12,7 +12,7 @@ def initialize_session_state_variables(st):
     # Get the list of uploaded documents
     upload_docs = os.listdir("docs")
     # List of session state variables to initialize
-    variables_to_initialize = ["chat_history", "uploaded_pdfs", "processed_documents", "vectordb", "previous_upload_docs_length"]
+    variables_to_initialize = ["chat_memory", "uploaded_pdfs", "processed_documents", "vectordb", "response_metrics", "submitted_uploads"]
     # Iterate over the variables and initializes them if not present in the session state 
     for variable in variables_to_initialize:
         if variable not in st.session_state:
@@ -20,10 +20,10 @@ def initialize_session_state_variables(st):
                 # Set to the name of the files present in the docs folder
                 st.session_state.processed_documents = upload_docs
             elif variable == "vectordb":
-                # Is set to none if its the first time the app is initialized. If not, is set to the vector database that already exists
-                st.session_state.vectordb = get_vectorstore(upload_docs, from_session_state=True)
-            elif variable == "previous_upload_docs_length":
-                # Set to the quantity of documents in the docs folder during app startup
-                st.session_state.previous_upload_docs_length = len(upload_docs)
+                # Opened when the first question is asked, so a new session does not wait for the vectorstore
+                st.session_state.vectordb = None
+            elif variable == "chat_memory":
+                # Recent messages word for word and a rolling summary of the older ones
+                st.session_state.chat_memory = ConversationMemory()
             else:
                 st.session_state[variable] = []
\ No newline at end of file
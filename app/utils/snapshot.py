@@ -0,0 +1,318 @@
+from utils.prepare_vectordb import (EMBEDDING_MODEL, PERSIST_DIRECTORY, get_bm25_index, get_dedup_path, get_manifest, list_shards,
+                                    open_dedup_index, open_vectorstore)
+from utils.resources import invalidate
+from utils import metrics, prepare_vectordb
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+
+# A snapshot starts with the magic bytes, then the format version, the length and the SHA-256 of its JSON header
+SNAPSHOT_MAGIC = b"RAGSNAP\x00"
+SNAPSHOT_FORMAT_VERSION = 1
+PRELUDE = struct.Struct("<8sIQ32s")
+# Sections start on multiples of this many bytes, so every array can be memory mapped in place
+SECTION_ALIGNMENT = 64
+# Number of chunks read from the vectorstore or written to it per batch
+SNAPSHOT_BATCH_SIZE = 1000
+# Columns of every shard stored as strings: one array of offsets and one blob of UTF-8 bytes per column
+STRING_COLUMNS = ("ids", "documents", "metadatas")
+
+def file_sha256(path, block_size=1 << 20):
+    """
+    Compute the SHA-256 of a file without reading it fully into memory
+
+    Parameters:
+    - path (str): Path of the file
+    - block_size (int): Number of bytes read per iteration
+
+    Returns:
+    - str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class Snapshot:
+    """
+    Read-only view of a snapshot file.
+
+    A snapshot holds the whole index in one file: the ingestion manifest and the description of every section in a
+    JSON header, then the sections. Every shard has a float32 matrix of vectors and, for the IDs, texts and metadata
+    of its chunks, an array of offsets into a blob of UTF-8 strings. The index of the stored chunks is kept as a
+    SQLite file. Sections are memory mapped, so opening a snapshot reads only its header.
+    """
+    def __init__(self, path):
+        """
+        Parameters:
+        - path (str): Path of the snapshot file
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            prelude = f.read(PRELUDE.size)
+            if len(prelude) < PRELUDE.size:
+                raise ValueError(f"'{path}' is not a snapshot")
+            magic, format_version, header_length, header_sha256 = PRELUDE.unpack(prelude)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"'{path}' is not a snapshot")
+            if format_version > SNAPSHOT_FORMAT_VERSION:
+                raise ValueError(f"Snapshot format {format_version} is newer than the supported format {SNAPSHOT_FORMAT_VERSION}")
+            header = f.read(header_length)
+        if hashlib.sha256(header).digest() != header_sha256:
+            raise ValueError(f"The header of snapshot '{path}' is corrupted")
+        self.format_version = format_version
+        self.header = json.loads(header.decode("utf-8"))
+
+    @property
+    def index_version(self):
+        return self.header["index_version"]
+
+    @property
+    def shards(self):
+        return self.header["shards"]
+
+    def _section(self, name):
+        section = self.header["sections"][name]
+        if not section["length"]:
+            return np.zeros(section["shape"], dtype=section["dtype"])
+        return np.memmap(self.path, dtype=section["dtype"], mode="r", offset=section["offset"], shape=tuple(section["shape"]))
+
+    def vectors(self, shard):
+        """
+        Get the vectors of a shard
+
+        Parameters:
+        - shard (str): Name of the shard
+
+        Returns:
+        - np.memmap: Matrix of float32 vectors, one row per chunk
+        """
+        return self._section(f"{shard}/vectors")
+
+    def strings(self, shard, column, start=0, end=None):
+        """
+        Read a string column of a shard
+
+        Parameters:
+        - shard (str): Name of the shard
+        - column (str): ids, documents or metadatas. Metadata is decoded from JSON
+        - start (int): Position of the first chunk
+        - end (int, optional): Position after the last chunk. Defaults to the end of the shard
+
+        Returns:
+        - list: The values
+        """
+        offsets = self._section(f"{shard}/{column}_offsets")
+        data = self._section(f"{shard}/{column}_data")
+        end = len(offsets) - 1 if end is None else end
+        values = [bytes(data[offsets[position]:offsets[position + 1]]).decode("utf-8") for position in range(start, end)]
+        return [json.loads(value) for value in values] if column == "metadatas" else values
+
+    def verify(self):
+        """Check the SHA-256 of every section, raising ValueError if one does not match"""
+        for name, section in self.header["sections"].items():
+            digest = hashlib.sha256()
+            with open(self.path, "rb") as f:
+                f.seek(section["offset"])
+                remaining = section["length"]
+                while remaining:
+                    block = f.read(min(remaining, 1 << 20))
+                    if not block:
+                        break
+                    digest.update(block)
+                    remaining -= len(block)
+            if remaining or digest.hexdigest() != section["sha256"]:
+                raise ValueError(f"Section '{name}' of snapshot '{self.path}' is corrupted")
+
+    def extract(self, name, path):
+        """
+        Copy a section to a file
+
+        Parameters:
+        - name (str): Name of the section
+        - path (str): Path of the file written
+        """
+        section = self.header["sections"][name]
+        with open(self.path, "rb") as source, open(path, "wb") as target:
+            source.seek(section["offset"])
+            remaining = section["length"]
+            while remaining:
+                block = source.read(min(remaining, 1 << 20))
+                target.write(block)
+                remaining -= len(block)
+
+def write_snapshot(path, header, sections):
+    """
+    Write a snapshot file from its header and the files of its sections. The file is replaced atomically
+
+    Parameters:
+    - path (str): Path of the snapshot file
+    - header (dict): Header of the snapshot. The description of the sections is added to it
+    - sections (list): Tuples of (name, file path, dtype, shape) in the order they are written
+    """
+    described = {}
+    for name, section_path, dtype, shape in sections:
+        described[name] = {"dtype": dtype, "shape": list(shape), "length": os.path.getsize(section_path), "sha256": file_sha256(section_path)}
+    # Offsets depend on the length of the header, which depends on the offsets: reserve room for the largest offsets
+    header = {**header, "sections": described}
+    for section in described.values():
+        section["offset"] = 1 << 62
+    data_start = PRELUDE.size + len(json.dumps(header).encode("utf-8"))
+    position = data_start
+    for section in described.values():
+        position = -(-position // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+        section["offset"] = position
+        position += section["length"]
+    header_bytes = json.dumps(header).encode("utf-8")
+    # Smaller offsets never make the header longer than the reserved room, padding fills the difference
+    header_bytes += b" " * (data_start - PRELUDE.size - len(header_bytes))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PRELUDE.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(header_bytes), hashlib.sha256(header_bytes).digest()))
+        f.write(header_bytes)
+        for name, section_path, _, _ in sections:
+            f.write(b"\0" * (described[name]["offset"] - f.tell()))
+            with open(section_path, "rb") as section_file:
+                shutil.copyfileobj(section_file, f, 1 << 20)
+    os.replace(tmp_path, path)
+
+def export_snapshot(path, persist_directory=PERSIST_DIRECTORY):
+    """
+    Export the whole index to a snapshot file: the vectors, texts and metadata of every shard, the ingestion
+    manifest and the index of the stored chunks. Ingestion waits while the snapshot is written, so it holds one
+    committed index version
+
+    Parameters:
+    - path (str): Path of the snapshot file
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - dict: Header of the snapshot
+    """
+    dedup = open_dedup_index(persist_directory)
+    try:
+        manifest = get_manifest(persist_directory)
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as staging, metrics.span("snapshot_export"):
+            sections = []
+            shards = {}
+            for shard in list_shards(persist_directory):
+                collection = open_vectorstore(persist_directory, shard)._collection
+                files = {"vectors": open(os.path.join(staging, f"{shard}.vectors"), "wb")}
+                offsets = {column: [0] for column in STRING_COLUMNS}
+                for column in STRING_COLUMNS:
+                    files[column] = open(os.path.join(staging, f"{shard}.{column}"), "wb")
+                count, dim = 0, 0
+                try:
+                    for offset in range(0, collection.count(), SNAPSHOT_BATCH_SIZE):
+                        batch = collection.get(limit=SNAPSHOT_BATCH_SIZE, offset=offset, include=["embeddings", "documents", "metadatas"])
+                        if not batch["ids"]:
+                            break
+                        vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+                        dim = vectors.shape[1]
+                        vectors.tofile(files["vectors"])
+                        values = {"ids": batch["ids"], "documents": [document or "" for document in batch["documents"]],
+                                  "metadatas": [json.dumps(metadata or {}, ensure_ascii=False) for metadata in batch["metadatas"]]}
+                        for column, column_values in values.items():
+                            for value in column_values:
+                                encoded = value.encode("utf-8")
+                                files[column].write(encoded)
+                                offsets[column].append(offsets[column][-1] + len(encoded))
+                        count += len(batch["ids"])
+                finally:
+                    for f in files.values():
+                        f.close()
+                shards[shard] = {"count": count, "dim": dim}
+                sections.append((f"{shard}/vectors", files["vectors"].name, "float32", (count, dim)))
+                for column in STRING_COLUMNS:
+                    offsets_path = os.path.join(staging, f"{shard}.{column}_offsets")
+                    np.asarray(offsets[column], dtype=np.int64).tofile(offsets_path)
+                    sections.append((f"{shard}/{column}_offsets", offsets_path, "int64", (count + 1,)))
+                    sections.append((f"{shard}/{column}_data", files[column].name, "uint8", (offsets[column][-1],)))
+            # A consistent copy of the index of the stored chunks, read while no ingestion can change it
+            dedup_path = os.path.join(staging, "dedup.sqlite3")
+            source_connection = sqlite3.connect(get_dedup_path(persist_directory))
+            target_connection = sqlite3.connect(dedup_path)
+            try:
+                source_connection.backup(target_connection)
+            finally:
+                target_connection.close()
+                source_connection.close()
+            sections.append(("dedup", dedup_path, "uint8", (os.path.getsize(dedup_path),)))
+            header = {"created_at": time.time(), "index_version": manifest.version, "vector_backend": prepare_vectordb.VECTOR_BACKEND,
+                      "embedding": {"backend": prepare_vectordb.EMBEDDING_BACKEND, "model": EMBEDDING_MODEL},
+                      "manifest": {"version": manifest.version, "fingerprint": manifest.fingerprint, "sources": manifest.sources}, "shards": shards}
+            write_snapshot(path, header, sections)
+        return Snapshot(path).header
+    finally:
+        dedup.close()
+
+def chunking_fingerprint(fingerprint):
+    """
+    Get the chunking settings of a manifest fingerprint, without the vector backend
+
+    Parameters:
+    - fingerprint (str): Fingerprint recorded for a source, e.g. chunk_size=1500;chunk_overlap=150;vector_backend=numpy
+
+    Returns:
+    - str: The chunk size and overlap parts of the fingerprint
+    """
+    return ";".join(part for part in (fingerprint or "").split(";") if not part.startswith("vector_backend="))
+
+def import_snapshot(path, persist_directory=PERSIST_DIRECTORY):
+    """
+    Load a snapshot into an empty vectorstore directory, without embedding anything
+
+    The checksums are verified first. The vectorstore gets the index version of the snapshot, so every node that
+    imports the same snapshot serves the same corpus version. The BM25 indexes are rebuilt from the texts.
+
+    Parameters:
+    - path (str): Path of the snapshot file
+    - persist_directory (str): Directory of the vectorstore. Must be empty or missing
+
+    Returns:
+    - dict: Header of the snapshot
+    """
+    snapshot = Snapshot(path)
+    snapshot.verify()
+    embedding = snapshot.header["embedding"]
+    if embedding["backend"] != prepare_vectordb.EMBEDDING_BACKEND or (embedding["backend"] != "fake" and embedding["model"] != EMBEDDING_MODEL):
+        raise ValueError(f"The snapshot was embedded with {embedding['backend']} {embedding['model']}, which does not match the {prepare_vectordb.EMBEDDING_BACKEND} embedder of this node")
+    if os.path.isdir(persist_directory) and os.listdir(persist_directory):
+        raise ValueError(f"'{persist_directory}' is not empty. Snapshots are imported into an empty directory")
+    os.makedirs(persist_directory, exist_ok=True)
+    try:
+        with metrics.span("snapshot_import"):
+            for shard, info in snapshot.shards.items():
+                vectordb = open_vectorstore(persist_directory, shard)
+                vectors = snapshot.vectors(shard)
+                for start in range(0, info["count"], SNAPSHOT_BATCH_SIZE):
+                    end = min(start + SNAPSHOT_BATCH_SIZE, info["count"])
+                    vectordb._collection.add(ids=snapshot.strings(shard, "ids", start, end), embeddings=np.asarray(vectors[start:end]).tolist(),
+                                             documents=snapshot.strings(shard, "documents", start, end), metadatas=snapshot.strings(shard, "metadatas", start, end))
+                vectordb.persist()
+            snapshot.extract("dedup", get_dedup_path(persist_directory))
+            # The manifest is written last: a directory without it was never imported completely
+            exported = snapshot.header["manifest"]
+            manifest = get_manifest(persist_directory)
+            manifest.version = exported["version"]
+            manifest.sources = exported["sources"]
+            # Sources chunked like this node does are not ingested again, even if the snapshot comes from another backend.
+            # The others keep their fingerprint, so the next ingestion chunks them again with the local settings
+            for entry in manifest.sources.values():
+                if chunking_fingerprint(entry.get("fingerprint")) == chunking_fingerprint(manifest.fingerprint):
+                    entry["fingerprint"] = manifest.fingerprint
+            manifest.save()
+            for shard in snapshot.shards:
+                get_bm25_index(open_vectorstore(persist_directory, shard))
+    except Exception:
+        invalidate()
+        shutil.rmtree(persist_directory, ignore_errors=True)
+        raise
+    return snapshot.header
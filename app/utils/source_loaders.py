@@ -0,0 +1,194 @@
+from pypdf import PdfReader
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
+from utils import metrics
+import os
+
+# Large PDFs are split into page ranges that are parsed in parallel by a process pool
+PDF_WORKERS = os.cpu_count() or 1
+PAGES_PER_TASK = 25
+# Files read as plain text. They are streamed in sections, so their size does not matter
+TEXT_EXTENSIONS = (".txt", ".md")
+# Text files are read this many characters at a time and cut into sections of about SECTION_CHARS characters at a
+# paragraph, line or word break. Chunks are split inside a section, so memory depends on these sizes only
+READ_BLOCK_CHARS = 1 << 20
+SECTION_CHARS = 1 << 16
+
+def extract_page_range(pdf_path, start, end):
+    """
+    Extract the text of a range of pages of a PDF. Runs inside the worker processes
+
+    Parameters:
+    - pdf_path (str): Path to the PDF
+    - start (int): First page of the range
+    - end (int): Page after the last page of the range
+
+    Returns:
+    - docs: One document per page, with the same metadata as PyPDFLoader
+    """
+    from langchain_core.documents import Document
+    reader = PdfReader(pdf_path)
+    return [Document(page_content=reader.pages[page].extract_text(), metadata={"source": pdf_path, "page": page}) for page in range(start, end)]
+
+def iter_page_ranges(pdf_paths, max_workers=PDF_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """
+    Extract page ranges of PDFs in parallel and yield them in document order
+
+    Only a bounded number of ranges is in flight at any time, so memory does not grow with the size of the corpus.
+
+    Parameters:
+    - pdf_paths (list): Paths to the PDFs
+    - max_workers (int): Number of worker processes. With 1 the pages are extracted in this process
+    - pages_per_task (int): Number of pages extracted by each task
+
+    Yields:
+    - tuple: (pdf_path, docs) for each page range. PDFs without pages yield one empty range
+    """
+    tasks = []
+    for pdf_path in pdf_paths:
+        try:
+            page_count = len(PdfReader(pdf_path).pages)
+        except Exception as e:
+            print(f"Error extracting text from '{pdf_path}': {e}")
+            continue
+        tasks.extend((pdf_path, start, min(start + pages_per_task, page_count)) for start in range(0, max(page_count, 1), pages_per_task))
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        for pdf_path, start, end in tasks:
+            with metrics.span("extract_pages", pages=end - start):
+                docs = extract_page_range(pdf_path, start, end)
+            metrics.increment("pages_extracted_total", len(docs))
+            yield pdf_path, docs
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for pdf_path, start, end in tasks:
+            pending.append((pdf_path, executor.submit(extract_page_range, pdf_path, start, end)))
+            if len(pending) >= max_workers * 2:
+                pdf_path, future = pending.popleft()
+                docs = future.result()
+                metrics.increment("pages_extracted_total", len(docs))
+                yield pdf_path, docs
+        while pending:
+            pdf_path, future = pending.popleft()
+            docs = future.result()
+            metrics.increment("pages_extracted_total", len(docs))
+            yield pdf_path, docs
+
+def iter_pdf_documents(pdf_paths, max_workers=PDF_WORKERS):
+    """
+    Stream the pages of several PDFs, grouped by PDF
+
+    Each group must be consumed before moving on to the next one.
+
+    Parameters:
+    - pdf_paths (list): Paths to the PDFs
+    - max_workers (int): Number of worker processes
+
+    Yields:
+    - tuple: (pdf_path, pages) where pages is a generator of page documents
+    """
+    for pdf_path, ranges in groupby(iter_page_ranges(pdf_paths, max_workers), key=itemgetter(0)):
+        yield pdf_path, (page for _, docs in ranges for page in docs)
+
+def extract_pdf_text(pdfs, max_workers=PDF_WORKERS):
+    """
+    Extract text from PDF documents
+
+    Parameters:
+    - pdfs (list): List of PDF documents
+    - max_workers (int): Number of worker processes used to parse the PDFs
+
+    Returns:
+    - docs: List of text extracted from PDF documents
+    """
+    pdf_paths = [os.path.join("docs", pdf) for pdf in pdfs]
+    return [page for _, docs in iter_page_ranges(pdf_paths, max_workers) for page in docs]
+
+def get_loader(path):
+    """
+    Get the kind of loader that reads a file, from its extension
+
+    Parameters:
+    - path (str): Path to the file
+
+    Returns:
+    - str: pdf or text, or None if the file type is not supported
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        return "pdf"
+    if extension in TEXT_EXTENSIONS:
+        return "text"
+    return None
+
+def find_section_end(text, limit):
+    """
+    Find where to cut the start of a text into a section, preferring a paragraph break, then a line break, then a space
+
+    Parameters:
+    - text (str): The text
+    - limit (int): Maximum length of the section
+
+    Returns:
+    - int: Length of the section
+    """
+    for separator in ("\n\n", "\n", " "):
+        position = text.rfind(separator, limit // 2, limit)
+        if position != -1:
+            return position + len(separator)
+    return limit
+
+def iter_text_sections(path, section_chars=SECTION_CHARS, block_chars=READ_BLOCK_CHARS):
+    """
+    Stream a text file as documents of about section_chars characters, without reading the whole file
+
+    Parameters:
+    - path (str): Path to the text file
+    - section_chars (int): Maximum length of a section
+    - block_chars (int): Number of characters read at a time
+
+    Yields:
+    - Document: The sections, with the source and the character offset of the section in the file as metadata
+    """
+    from langchain_core.documents import Document
+    offset = 0
+    buffer = ""
+    # Undecodable bytes are replaced, so a corrupt byte in an OCR dump does not stop the ingestion
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(block_chars)
+            buffer += block
+            while len(buffer) >= section_chars or (not block and buffer):
+                end = find_section_end(buffer, section_chars) if len(buffer) > section_chars else len(buffer)
+                if buffer[:end].strip():
+                    yield Document(page_content=buffer[:end], metadata={"source": path, "offset": offset})
+                offset += end
+                buffer = buffer[end:]
+            if not block:
+                return
+
+def iter_source_documents(paths, max_workers=PDF_WORKERS):
+    """
+    Stream the documents of several files, picking the loader by file type. Files of other types are skipped
+
+    PDF pages are extracted in parallel and text files are streamed in sections. Each group must be consumed before
+    moving on to the next one.
+
+    Parameters:
+    - paths (list): Paths to the files
+    - max_workers (int): Number of worker processes used to parse the PDFs
+
+    Yields:
+    - tuple: (path, docs) where docs is a generator of documents
+    """
+    for path in paths:
+        if get_loader(path) is None:
+            print(f"Skipping '{path}': unsupported file type")
+    yield from iter_pdf_documents([path for path in paths if get_loader(path) == "pdf"], max_workers)
+    for path in paths:
+        if get_loader(path) == "text":
+            yield path, iter_text_sections(path)
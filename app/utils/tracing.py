@@ -0,0 +1,49 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from utils.embedding_pipeline import estimate_tokens
+from utils import metrics
+import time
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Callback handler that records the steps run inside the retrieval chain as spans.
+
+    The prompt formatting is recorded as prompt_assembly and the model call as llm_call, and the estimated number of
+    prompt tokens sent to the model is counted and kept in prompt_tokens.
+    """
+    def __init__(self):
+        self._runs = {}
+        self.prompt_tokens = 0
+
+    def _start(self, run_id, name):
+        self._runs[run_id] = (name, time.time(), time.perf_counter())
+
+    def _end(self, run_id, **attributes):
+        started = self._runs.pop(run_id, None)
+        if started is not None:
+            name, start, perf_start = started
+            metrics.record_span(name, start, time.perf_counter() - perf_start, parent="answer", **attributes)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, run_type=None, **kwargs):
+        if run_type == "prompt":
+            self._start(run_id, "prompt_assembly")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=type(error).__name__)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        tokens = sum(estimate_tokens(str(message.content)) for batch in messages for message in batch)
+        metrics.increment("llm_requests_total")
+        metrics.increment("llm_tokens_sent_total", tokens)
+        metrics.observe("prompt_tokens", tokens, buckets=metrics.TOKEN_BUCKETS)
+        self.prompt_tokens += tokens
+        self._start(run_id, "llm_call")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        metrics.increment("llm_errors_total")
+        self._end(run_id, error=type(error).__name__)
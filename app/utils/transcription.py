@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from utils import metrics
+import numpy as np
+import wave
+
+# Length of the audio segments sent to the backend. Cuts are moved to the quietest moment near the end of the window
+SEGMENT_SECONDS = 30
+SILENCE_SEARCH_SECONDS = 3
+TRANSCRIPTION_WORKERS = 4
+
+class TranscriptionBackend:
+    """
+    Interface of the engines that turn speech into text.
+
+    Backends receive one segment of mono 16-bit PCM audio at a time, so any engine (remote API, local model or fake)
+    can be plugged into the transcription pipeline.
+    """
+    def transcribe(self, samples, sample_rate):
+        """
+        Transcribe a segment of audio
+
+        Parameters:
+        - samples (numpy.ndarray): Mono 16-bit samples
+        - sample_rate (int): Samples per second
+
+        Returns:
+        - str: Text spoken in the segment, empty if nothing was understood
+        """
+        raise NotImplementedError
+
+class GoogleSpeechBackend(TranscriptionBackend):
+    """Backend that uses the Google Web Speech API through speech_recognition"""
+    def __init__(self, language="en-US"):
+        """
+        Parameters:
+        - language (str): Language spoken in the audio
+        """
+        import speech_recognition as sr
+        self.sr = sr
+        self.language = language
+
+    def transcribe(self, samples, sample_rate):
+        audio = self.sr.AudioData(samples.astype(np.int16).tobytes(), sample_rate, 2)
+        try:
+            return self.sr.Recognizer().recognize_google(audio, language=self.language)
+        except self.sr.UnknownValueError:
+            # No speech in this segment
+            return ""
+
+def find_quietest_sample(samples, sample_rate, window_seconds=0.05):
+    """
+    Find the quietest moment of a stretch of audio
+
+    Parameters:
+    - samples (numpy.ndarray): Mono samples
+    - sample_rate (int): Samples per second
+    - window_seconds (float): Length of the windows whose energy is compared
+
+    Returns:
+    - int: Index of the sample at the start of the quietest window
+    """
+    window = max(1, int(sample_rate * window_seconds))
+    count = len(samples) // window
+    if count == 0:
+        return 0
+    energy = np.square(samples[:count * window].astype(np.float64)).reshape(count, window).mean(axis=1)
+    return int(np.argmin(energy)) * window
+
+def iter_audio_segments(wav_path, segment_seconds=SEGMENT_SECONDS, silence_search_seconds=SILENCE_SEARCH_SECONDS):
+    """
+    Read a WAV file segment by segment, cutting each segment at the quietest moment of its last seconds
+
+    Only one segment is held in memory at a time. Multi channel audio is mixed down to mono.
+
+    Parameters:
+    - wav_path (str): Path to a 16-bit PCM WAV file
+    - segment_seconds (float): Target length of the segments
+    - silence_search_seconds (float): Length of the stretch at the end of each window searched for silence
+
+    Yields:
+    - tuple: (start in seconds, mono samples, sample rate)
+    """
+    with wave.open(wav_path, "rb") as wav_file:
+        sample_rate = wav_file.getframerate()
+        channels = wav_file.getnchannels()
+        segment_frames = int(segment_seconds * sample_rate)
+        search_frames = min(int(silence_search_seconds * sample_rate), segment_frames // 2)
+        carry = np.zeros(0, dtype=np.int16)
+        start = 0
+        while True:
+            frames = wav_file.readframes(segment_frames - len(carry))
+            samples = np.frombuffer(frames, dtype=np.int16)
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+            samples = np.concatenate([carry, samples])
+            if len(samples) == 0:
+                return
+            if len(samples) < segment_frames:
+                yield start / sample_rate, samples, sample_rate
+                return
+            cut = segment_frames - search_frames + find_quietest_sample(samples[-search_frames:], sample_rate) if search_frames else segment_frames
+            yield start / sample_rate, samples[:cut], sample_rate
+            carry = samples[cut:]
+            start += cut
+
+def transcribe_audio(wav_path, backend, segment_seconds=SEGMENT_SECONDS, max_workers=TRANSCRIPTION_WORKERS):
+    """
+    Transcribe a WAV file by sending its segments to the backend concurrently
+
+    A segment that fails is logged and left empty, so one failed request does not lose the whole transcription.
+
+    Parameters:
+    - wav_path (str): Path to a 16-bit PCM WAV file
+    - backend (TranscriptionBackend): Engine used to transcribe the segments
+    - segment_seconds (float): Target length of the segments
+    - max_workers (int): Number of segments transcribed at the same time
+
+    Returns:
+    - list: Tuples of (start, end, text) in seconds, in order
+    """
+    def transcribe_segment(samples, sample_rate):
+        try:
+            with metrics.span("transcribe_segment"):
+                return backend.transcribe(samples, sample_rate)
+        except Exception as e:
+            print(f"Error transcribing audio segment: {e}")
+            metrics.increment("audio_segment_errors_total")
+            return ""
+
+    segments = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for start, samples, sample_rate in iter_audio_segments(wav_path, segment_seconds):
+            pending.append((start, start + len(samples) / sample_rate, executor.submit(transcribe_segment, samples, sample_rate)))
+            metrics.increment("audio_segments_total")
+            if len(pending) >= max_workers * 2:
+                start, end, future = pending.popleft()
+                segments.append((start, end, future.result()))
+        while pending:
+            start, end, future = pending.popleft()
+            segments.append((start, end, future.result()))
+    return segments
+
+def format_timestamp(seconds):
+    """
+    Format a number of seconds as HH:MM:SS
+
+    Parameters:
+    - seconds (float): Seconds to format
+
+    Returns:
+    - str: The formatted timestamp
+    """
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def format_transcript(segments):
+    """
+    Stitch transcribed segments into a timestamped transcript
+
+    Parameters:
+    - segments (list): Tuples of (start, end, text)
+
+    Returns:
+    - str: One line per segment with speech
+    """
+    return "\n".join(f"[{format_timestamp(start)} - {format_timestamp(end)}] {text}" for start, end, text in segments if text)
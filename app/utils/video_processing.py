@@ -1,18 +1,122 @@
 import pytesseract
-import speech_recognition as sr
 from moviepy.editor import VideoFileClip
+from utils.transcription import GoogleSpeechBackend, transcribe_audio, format_transcript
+from utils import metrics
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import numpy as np
 import os
 import tempfile
 
 # Set the path to the tesseract executable
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
-def process_video(video_file_path):
+# Frames sampled per second of video. Slides and captions rarely change faster than this
+FRAME_SAMPLE_RATE = 1.0
+# Mean difference (0 to 1) between the thumbnails of two frames for the second one to be considered a new scene
+FRAME_CHANGE_THRESHOLD = 0.03
+OCR_WORKERS = os.cpu_count() or 1
+
+def frame_thumbnail(frame, size=32):
+    """
+    Reduce a frame to a small grayscale thumbnail used to compare frames
+
+    Parameters:
+    - frame (numpy.ndarray): RGB frame of shape (height, width, 3)
+    - size (int): Approximate width and height of the thumbnail
+
+    Returns:
+    - numpy.ndarray: Thumbnail with values between 0 and 1
+    """
+    gray = frame.mean(axis=2) if frame.ndim == 3 else frame
+    step_y = max(1, gray.shape[0] // size)
+    step_x = max(1, gray.shape[1] // size)
+    return gray[::step_y, ::step_x].astype(np.float32) / 255.0
+
+def iter_changed_frames(video_clip, sample_rate=FRAME_SAMPLE_RATE, threshold=FRAME_CHANGE_THRESHOLD):
+    """
+    Sample the frames of a video and yield only the ones that differ visually from the last yielded frame
+
+    Parameters:
+    - video_clip (VideoFileClip): The video
+    - sample_rate (float): Frames sampled per second of video
+    - threshold (float): Minimum mean thumbnail difference for a frame to be yielded
+
+    Yields:
+    - tuple: (time in seconds, frame)
+    """
+    previous = None
+    for frame_time, frame in video_clip.iter_frames(fps=sample_rate, with_times=True):
+        thumbnail = frame_thumbnail(frame)
+        if previous is None or np.abs(thumbnail - previous).mean() > threshold:
+            previous = thumbnail
+            yield frame_time, frame
+
+def ocr_frame(frame):
+    """
+    Extract the text shown on a frame. Runs inside the worker processes
+
+    Parameters:
+    - frame (numpy.ndarray): RGB frame
+
+    Returns:
+    - str: Text found on the frame
+    """
+    return pytesseract.image_to_string(frame)
+
+def deduplicate_lines(texts):
+    """
+    Join texts keeping only the first occurrence of every line
+
+    Parameters:
+    - texts (iterable): Texts extracted from consecutive frames
+
+    Returns:
+    - str: The unique non empty lines, in order of appearance
+    """
+    seen = set()
+    lines = []
+    for text in texts:
+        for line in text.splitlines():
+            key = " ".join(line.split()).lower()
+            if key and key not in seen:
+                seen.add(key)
+                lines.append(line.strip())
+    return "\n".join(lines)
+
+def extract_frame_text(video_clip, sample_rate=FRAME_SAMPLE_RATE, threshold=FRAME_CHANGE_THRESHOLD, max_workers=OCR_WORKERS):
+    """
+    Extract the text shown in a video, running OCR in parallel on the frames where the picture changes
+
+    Parameters:
+    - video_clip (VideoFileClip): The video
+    - sample_rate (float): Frames sampled per second of video
+    - threshold (float): Minimum mean thumbnail difference for a frame to be read
+    - max_workers (int): Number of OCR worker processes
+
+    Returns:
+    - str: Text found in the video, without repeated lines
+    """
+    texts = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Only a few frames are in flight at once, so memory does not grow with the length of the video
+        pending = deque()
+        for _, frame in iter_changed_frames(video_clip, sample_rate, threshold):
+            pending.append(executor.submit(ocr_frame, frame))
+            metrics.increment("frames_ocr_total")
+            if len(pending) >= max_workers * 2:
+                texts.append(pending.popleft().result())
+        while pending:
+            texts.append(pending.popleft().result())
+    return deduplicate_lines(texts)
+
+def process_video(video_file_path, transcription_backend=None):
     """
     Process the video file to extract text from video frames and transcribe speech from the audio.
 
     Parameters:
     - video_file_path (str): Path to the video file
+    - transcription_backend (TranscriptionBackend, optional): Engine used to transcribe the audio. Defaults to the Google Web Speech API
 
     Returns:
     - tuple: (text_content, transcription_content)
@@ -24,26 +128,29 @@ def process_video(video_file_path):
     # Load the video and process frames
     video_clip = VideoFileClip(video_file_path)
 
-    # Extract text from video frames
-    for frame in video_clip.iter_frames():
-        text_content += pytesseract.image_to_string(frame)
+    # Extract text from the video frames where the picture changes
+    with metrics.span("ocr_frames"):
+        text_content = extract_frame_text(video_clip)
 
-    # Save the extracted audio as a WAV file in a temporary file
+    if video_clip.audio is None:
+        return text_content, transcription_content
+
+    # Save the extracted audio as a mono 16 kHz WAV file in a temporary file
     with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio_file:
         temp_audio_path = temp_audio_file.name
-        video_clip.audio.write_audiofile(temp_audio_path, codec="pcm_s16le")
+    with metrics.span("extract_audio"):
+        video_clip.audio.write_audiofile(temp_audio_path, fps=16000, codec="pcm_s16le", ffmpeg_params=["-ac", "1"], logger=None)
 
-    # Transcribe audio using speech recognition
-    recognizer = sr.Recognizer()
+    # Transcribe the audio segment by segment and stitch the timestamped results
     try:
-        with sr.AudioFile(temp_audio_path) as source:
-            audio = recognizer.record(source)
-            transcription_content = recognizer.recognize_google(audio)
+        with metrics.span("transcribe_audio"):
+            segments = transcribe_audio(temp_audio_path, transcription_backend or GoogleSpeechBackend())
+        transcription_content = format_transcript(segments)
     except Exception as e:
         transcription_content = f"Error transcribing audio: {e}"
-
-    # Clean up the temporary audio file
-    os.remove(temp_audio_path)
+    finally:
+        # Clean up the temporary audio file
+        os.remove(temp_audio_path)
 
     return text_content, transcription_content
 
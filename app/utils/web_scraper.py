@@ -1,25 +1,287 @@
-import requests
+import aiohttp
+import asyncio
 from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+from urllib.parse import urljoin, urldefrag, urlparse
+from urllib.robotparser import RobotFileParser
+from utils.ingest_manifest import hash_text
+from utils.prepare_vectordb import PERSIST_DIRECTORY, WEB_DOCS_DIRECTORY, ingest_sources
+import hashlib
+import json
 import os
-def scrape_website(url):
+import queue
+import threading
+import time
+
+# Every crawled page is stored as its own text file in WEB_DOCS_DIRECTORY, with the crawl metadata kept in a JSON
+# file beside them
+CRAWL_STATE_FILENAME = "crawl_state.json"
+MAX_DEPTH = 1
+MAX_PAGES = 50
+PER_HOST_CONCURRENCY = 4
+REQUEST_TIMEOUT = 20
+# Name the crawler sends and looks for in robots.txt
+USER_AGENT = "RAG-chatbot-crawler"
+
+def extract_page(html, url):
+    """
+    Extract the title, readable text and links of an HTML page
+
+    Parameters:
+    - html (str): Content of the page
+    - url (str): URL of the page, used to resolve relative links
+
+    Returns:
+    - tuple: (title, text, links)
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text(strip=True) if soup.title else url
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        link = urldefrag(urljoin(url, anchor["href"]))[0]
+        if urlparse(link).scheme in ("http", "https"):
+            links.append(link)
+    # Drop the parts of the page that are not content
+    for element in soup(["script", "style", "noscript", "nav", "header", "footer", "form"]):
+        element.decompose()
+    lines = (line.strip() for line in soup.get_text("\n").splitlines())
+    text = "\n".join(line for line in lines if line)
+    return title, text, list(dict.fromkeys(links))
+
+def load_crawl_state(directory=WEB_DOCS_DIRECTORY):
+    """
+    Load the metadata of the pages crawled before
+
+    Parameters:
+    - directory (str): Directory where the crawled pages are stored
+
+    Returns:
+    - dict: Metadata of every crawled URL
+    """
+    path = os.path.join(directory, CRAWL_STATE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_crawl_state(state, directory=WEB_DOCS_DIRECTORY):
+    """
+    Save the metadata of the crawled pages
+
+    Parameters:
+    - state (dict): Metadata of every crawled URL
+    - directory (str): Directory where the crawled pages are stored
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, CRAWL_STATE_FILENAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+async def fetch_robots(session, start_url):
+    """
+    Download and parse the robots.txt of the host of a URL
+
+    As in urllib.robotparser, every page is disallowed when robots.txt is protected (401 or 403) and allowed when it
+    is missing or cannot be downloaded.
+
+    Parameters:
+    - session (aiohttp.ClientSession): Session of the crawl
+    - start_url (str): URL where the crawl starts
+
+    Returns:
+    - RobotFileParser: The rules of the host
+    """
+    robots = RobotFileParser()
+    try:
+        async with session.get(urljoin(start_url, "/robots.txt")) as response:
+            if response.status in (401, 403):
+                robots.disallow_all = True
+            elif response.status == 200:
+                robots.parse((await response.text(errors="replace")).splitlines())
+            else:
+                robots.allow_all = True
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error fetching robots.txt of '{start_url}': {e}")
+        robots.allow_all = True
+    return robots
+
+async def crawl(start_url, state, max_depth=MAX_DEPTH, max_pages=MAX_PAGES, per_host_concurrency=PER_HOST_CONCURRENCY, timeout=REQUEST_TIMEOUT):
     """
-    Scrape the content of a website.
+    Crawl a website breadth first, yielding every page whose content changed since the last crawl
+
+    Pages are requested with the ETag and Last-Modified of the previous crawl, so unchanged pages are answered with
+    304 and their stored links are followed without downloading them again. Only links on the same host that its
+    robots.txt allows are followed.
 
     Parameters:
-    - url (str): URL of the website to scrape
+    - start_url (str): URL where the crawl starts
+    - state (dict): Metadata of the pages crawled before. Not modified: the metadata of every downloaded page is
+      yielded with it, to be saved once the page is stored
+    - max_depth (int): Number of links followed away from the start URL
+    - max_pages (int): Maximum number of pages requested
+    - per_host_concurrency (int): Maximum number of requests sent to the same host at the same time
+    - timeout (float): Timeout in seconds of every request
+
+    Yields:
+    - tuple: (url, title, text, metadata) of every new or changed page
+    """
+    host = urlparse(start_url).netloc
+    semaphores = {}
+    visited = {start_url}
+    requested = 0
+
+    async def fetch(session, url):
+        previous = state.get(url, {})
+        headers = {}
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+        semaphore = semaphores.setdefault(urlparse(url).netloc, asyncio.Semaphore(per_host_concurrency))
+        async with semaphore:
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return url, None, previous.get("links", [])
+                    if response.status != 200 or "html" not in response.headers.get("Content-Type", "html"):
+                        return url, None, []
+                    html = await response.text(errors="replace")
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error fetching '{url}': {e}")
+                return url, None, []
+        title, text, links = extract_page(html, url)
+        metadata = {**previous, "etag": etag, "last_modified": last_modified, "title": title, "links": links, "fetched_at": time.time()}
+        return url, (title, text, metadata), links
+
+    # One pooled session keeps connections alive across all the requests of the crawl
+    connector = aiohttp.TCPConnector(limit=per_host_concurrency * 4)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout), headers={"User-Agent": USER_AGENT}) as session:
+        robots = await fetch_robots(session, start_url)
+        frontier = [start_url] if robots.can_fetch(USER_AGENT, start_url) else []
+        if not frontier:
+            print(f"robots.txt does not allow crawling '{start_url}'.")
+        for depth in range(max_depth + 1):
+            batch = frontier[:max_pages - requested]
+            requested += len(batch)
+            next_frontier = []
+            for task in asyncio.as_completed([fetch(session, url) for url in batch]):
+                url, page, links = await task
+                if page is not None:
+                    yield url, *page
+                if depth < max_depth:
+                    for link in links:
+                        if link not in visited and urlparse(link).netloc == host and robots.can_fetch(USER_AGENT, link):
+                            visited.add(link)
+                            next_frontier.append(link)
+            frontier = next_frontier
+            if not frontier or requested >= max_pages:
+                break
+
+def store_page(url, title, text, metadata, directory=WEB_DOCS_DIRECTORY):
+    """
+    Store a crawled page as its own text file
+
+    Parameters:
+    - url (str): URL of the page
+    - title (str): Title of the page
+    - text (str): Text of the page
+    - metadata (dict): Crawl metadata of the page, updated with the path of the file
+    - directory (str): Directory where the crawled pages are stored
 
     Returns:
-    - str: The scraped text content
-    """
-    response = requests.get(url)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.content, 'html.parser')
-        # Extract text from paragraphs
-        paragraphs = soup.find_all('p')
-        text = "\n".join([para.get_text() for para in paragraphs])
-        return text
-    else:
-        return "Error: Unable to fetch the webpage."
-
-# Example usage:
-# print(scrape_website("https://example.com"))
+    - Document: The page, with its URL, title and file path as metadata
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, hashlib.sha1(url.encode("utf-8")).hexdigest()[:16] + ".txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    metadata["path"] = path
+    return Document(page_content=text, metadata={"source": url, "title": title, "path": path})
+
+def iter_crawled_pages(start_url, state, max_depth=MAX_DEPTH, max_pages=MAX_PAGES, directory=WEB_DOCS_DIRECTORY):
+    """
+    Crawl a website and yield every new or changed page as soon as it is downloaded
+
+    The crawl runs on its own event loop in a background thread. A bounded queue between the crawl and the caller
+    keeps downloads from running far ahead of chunking and embedding.
+
+    Parameters:
+    - start_url (str): URL where the crawl starts
+    - state (dict): Metadata of the pages crawled before, from load_crawl_state. Not modified
+    - max_depth (int): Number of links followed away from the start URL
+    - max_pages (int): Maximum number of pages requested
+    - directory (str): Directory where the crawled pages are stored
+
+    Yields:
+    - tuple: (Document, metadata) of a stored page. The caller saves the metadata once the page is ingested
+    """
+    pages = queue.Queue(maxsize=PER_HOST_CONCURRENCY * 2)
+    done = object()
+    errors = []
+    stopped = threading.Event()
+
+    async def produce():
+        async for page in crawl(start_url, state, max_depth, max_pages):
+            if stopped.is_set():
+                break
+            await asyncio.to_thread(pages.put, page)
+
+    def run():
+        try:
+            asyncio.run(produce())
+        except Exception as e:
+            errors.append(e)
+        finally:
+            pages.put(done)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            page = pages.get()
+            if page is done:
+                break
+            url, title, text, metadata = page
+            yield store_page(url, title, text, metadata, directory), metadata
+    finally:
+        # If the caller stopped early, unblock the crawl so its thread can finish
+        stopped.set()
+        while thread.is_alive():
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    if errors:
+        raise errors[0]
+
+def crawl_website(start_url, max_depth=MAX_DEPTH, max_pages=MAX_PAGES, progress=None, persist_directory=PERSIST_DIRECTORY):
+    """
+    Crawl a website and stream its new or changed pages into the vectorstore, one document per URL
+
+    Parameters:
+    - start_url (str): URL where the crawl starts
+    - max_depth (int): Number of links followed away from the start URL
+    - max_pages (int): Maximum number of pages requested
+    - progress (callable, optional): Called as progress(stage, **counters) while the pages are ingested
+    - persist_directory (str): Directory of the vectorstore
+
+    Returns:
+    - int: Number of pages added or updated in the vectorstore
+    """
+    state = load_crawl_state()
+    downloaded = {}
+
+    def sources():
+        for page, metadata in iter_crawled_pages(start_url, state, max_depth, max_pages):
+            downloaded[page.metadata["source"]] = metadata
+            yield page.metadata["source"], hash_text(page.page_content), [page]
+
+    _, changed_pages = ingest_sources(sources(), persist_directory, progress)
+    # The ETag and Last-Modified of the pages are only saved once their chunks are committed. If ingestion fails
+    # they are dropped, so the next crawl downloads the pages again instead of being answered with 304
+    state.update(downloaded)
+    save_crawl_state(state)
+    return changed_pages
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app modules import each other as utils.*, from the app folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+# Tests run offline, with the deterministic fake embedder and chat model. They must be selected before the app modules are imported
+os.environ.setdefault("EMBEDDING_BACKEND", "fake")
+os.environ.setdefault("LLM_BACKEND", "fake")
@@ -0,0 +1,33 @@
+from langchain_core.messages import AIMessage, HumanMessage
+from utils.answer_cache import SemanticAnswerCache
+from utils.chatbot import get_answer_cache, get_response
+from utils.fakes import HashingEmbeddings
+from utils.prepare_vectordb import get_manifest, ingest_sources, iter_file_sources, open_sharded_store
+from utils import metrics
+
+def test_answer_is_only_reused_after_the_same_summary():
+    cache = SemanticAnswerCache(HashingEmbeddings())
+    history = [HumanMessage(content="And the second one?"), AIMessage(content="It starts in May.")]
+    cache.store("When does it end?", history, 1, "In June.", [], 1.0, summary="The user asked about the first project.")
+    assert cache.lookup("When does it end?", history, 1, summary="The user asked about the first project.") == ("In June.", [])
+    assert cache.lookup("When does it end?", history, 1, summary="The user asked about the budget.") is None
+    assert cache.lookup("When does it end?", history, 1) is None
+
+def test_hit_rate_and_seconds_saved_are_exported_as_gauges(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    path = tmp_path / "budget.txt"
+    path.write_text("The budget of the project is twelve thousand euros, approved in March.", encoding="utf-8")
+    ingest_sources(iter_file_sources([str(path)], get_manifest(persist_directory)), persist_directory)
+    vectordb = open_sharded_store(persist_directory)
+    metrics.reset()
+
+    first = get_response("What is the budget of the project?", [], vectordb)
+    second = get_response("What is the budget of the project?", [], vectordb)
+
+    assert second == first
+    gauges = {gauge["name"]: gauge["value"] for gauge in metrics.export_json()["gauges"]}
+    stats = get_answer_cache(vectordb).stats()
+    assert stats["hits"] >= 1
+    assert gauges["answer_cache_hit_rate"] == stats["hit_rate"]
+    assert gauges["answer_cache_seconds_saved"] == stats["seconds_saved"]
+    assert gauges["answer_cache_entries"] == stats["entries"]
@@ -0,0 +1,45 @@
+from utils.bm25_index import BM25Index
+
+def build_index():
+    index = BM25Index()
+    index.add("pump", "the serial number of the pump is XK42")
+    index.add("budget", "the budget of the project is twelve thousand euros")
+    index.add("agenda", "agenda of the meeting about the budget")
+    index.add("weather", "notes about the weather of the week")
+    return index
+
+def test_rare_terms_rank_first():
+    index = build_index()
+
+    assert [chunk_id for chunk_id, _ in index.search("XK42", 4)] == ["pump"]
+    # budget appears in two chunks, project in one, so the chunk with both ranks first
+    results = index.search("budget of the project", 4)
+    assert [chunk_id for chunk_id, _ in results][:2] == ["budget", "agenda"]
+    assert results[0][1] > results[1][1] > 0
+
+def test_deleted_and_replaced_chunks_are_not_found():
+    index = build_index()
+
+    index.delete(["pump"])
+    index.add("agenda", "agenda of the meeting about the holidays")
+
+    assert index.search("XK42", 4) == []
+    assert [chunk_id for chunk_id, _ in index.search("budget", 4)] == ["budget"]
+    assert len(index) == 3
+
+def test_saved_and_compacted_index_scores_like_the_original(tmp_path):
+    index = build_index()
+    index.add("stale", "the stale copy of the pump notes XK42")
+    index.delete(["stale", "weather"])
+    expected = index.search("the budget of the pump", 4)
+
+    index.save(str(tmp_path / "bm25"))
+    loaded = BM25Index.load(str(tmp_path / "bm25"))
+
+    assert loaded.search("the budget of the pump", 4) == expected
+    loaded.compact()
+    assert len(loaded.chunk_ids) == 3
+    assert [chunk_id for chunk_id, _ in loaded.search("the budget of the pump", 4)] == [chunk_id for chunk_id, _ in expected]
+    # Chunks added after loading extend the postings that are views of the saved arrays
+    loaded.add("valve", "the valve of the pump")
+    assert "valve" in [chunk_id for chunk_id, _ in loaded.search("valve pump", 4)]
@@ -0,0 +1,56 @@
+from langchain_core.messages import AIMessage, HumanMessage
+from utils.chat_memory import ConversationMemory, summarize_messages
+from utils.fakes import FakeChatModel
+
+class RecordingChatModel(FakeChatModel):
+    """Fake chat model that keeps the prompts it receives"""
+    prompts: list = []
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        self.prompts.append(messages[-1].content)
+        return super()._call(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+def test_window_stays_bounded_and_older_messages_are_folded_in_order():
+    memory = ConversationMemory(window_messages=4, fold_messages=2)
+    folded = []
+
+    def summarize(summary, messages):
+        folded.extend(messages)
+        return f"{summary} {len(messages)} messages".strip()
+
+    for turn in range(10):
+        memory.add_turn(f"question {turn}", f"answer {turn}")
+        if memory.needs_folding():
+            memory.fold(summarize)
+        assert len(memory.messages()) <= 4
+
+    assert [text for _, text in folded] == [text for turn in range(8) for text in (f"question {turn}", f"answer {turn}")]
+    assert memory.messages() == [HumanMessage(content="question 8"), AIMessage(content="answer 8"), HumanMessage(content="question 9"), AIMessage(content="answer 9")]
+    assert memory.summary == "2 messages 2 messages 2 messages 2 messages 2 messages 2 messages 2 messages 2 messages"
+    assert len(memory.transcript) == 20
+
+def test_summary_is_written_by_the_chat_model():
+    llm = RecordingChatModel(responses=["  The user asked for the budget, twelve thousand euros.  "], prompts=[])
+
+    summary = summarize_messages(llm, "The user works on the pump project.", [("human", "what is the budget?"), ("ai", "twelve thousand euros")], max_tokens=100)
+
+    assert summary == "The user asked for the budget, twelve thousand euros."
+    assert "The user works on the pump project." in llm.prompts[0]
+    assert "User: what is the budget?\nChatbot: twelve thousand euros" in llm.prompts[0]
+    assert "at most 75 words" in llm.prompts[0]
+
+def test_messages_are_kept_in_a_bounded_summary_when_the_summarizer_fails():
+    memory = ConversationMemory(window_messages=2, fold_messages=2, summary_max_tokens=10)
+
+    def fail(summary, messages):
+        raise RuntimeError("model unavailable")
+
+    for turn in range(6):
+        memory.add_turn(f"question {turn}", f"answer {turn}")
+        if memory.needs_folding():
+            memory.fold(fail)
+
+    assert len(memory.summary) <= 40
+    # The oldest part of the summary is the one dropped
+    assert memory.summary.endswith("ai: answer 4")
+    assert memory.messages() == [HumanMessage(content="question 5"), AIMessage(content="answer 5")]
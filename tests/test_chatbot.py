@@ -0,0 +1,17 @@
+from utils.chatbot import FAKE_ANSWER, get_response
+from utils.prepare_vectordb import get_manifest, ingest_sources, iter_file_sources, open_sharded_store
+
+def build_store(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    path = tmp_path / "budget.txt"
+    path.write_text("The budget of the project is twelve thousand euros, approved in March.", encoding="utf-8")
+    ingest_sources(iter_file_sources([str(path)], get_manifest(persist_directory)), persist_directory)
+    return open_sharded_store(persist_directory)
+
+def test_fake_models_answer_through_the_retrieval_chain(tmp_path):
+    vectordb = build_store(tmp_path)
+
+    answer, context = get_response("What is the budget of the project?", [], vectordb, use_cache=False)
+
+    assert answer == FAKE_ANSWER
+    assert any("twelve thousand euros" in document.page_content for document in context)
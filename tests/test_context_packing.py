@@ -0,0 +1,57 @@
+from langchain_core.documents import Document
+from utils.context_packing import join_overlapping, merge_neighbours, pack_context, select_mmr
+from utils.embedding_pipeline import estimate_tokens
+from utils.hybrid_retriever import HybridRetriever
+from utils.prepare_vectordb import get_bm25_index, ingest_sources, open_vectorstore
+from utils import prepare_vectordb
+
+def chunk(source, index, text):
+    return Document(page_content=text, metadata={"source": source, "chunk_index": index})
+
+def test_mmr_moves_a_repeated_passage_after_a_different_one():
+    vectors = [[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]]
+
+    assert select_mmr([1.0, 0.95, 0.8], vectors, lambda_mult=0.7) == [0, 2, 1]
+    # With a weight of 1 only the relevance counts
+    assert select_mmr([1.0, 0.95, 0.8], vectors, lambda_mult=1.0) == [0, 1, 2]
+    assert select_mmr([], []) == []
+
+def test_neighbouring_chunks_are_merged_without_repeating_their_overlap():
+    assert join_overlapping("the budget of the project", "of the project is twelve thousand euros") == "the budget of the project is twelve thousand euros"
+    assert join_overlapping("first part", "unrelated part") == "first part\nunrelated part"
+
+    passages = merge_neighbours([chunk("docs/a.txt", 1, "the project is late"), chunk("docs/b.txt", 0, "other file"),
+                                 chunk("docs/a.txt", 0, "minutes: the project"), chunk("docs/a.txt", 3, "far away")])
+
+    assert [passage.page_content for passage in passages] == ["minutes: the project is late", "other file", "far away"]
+    assert passages[0].metadata == {"source": "docs/a.txt", "chunk_index": 0, "merged_chunks": 2}
+
+def test_passages_that_do_not_fit_are_skipped_and_later_ones_still_tried():
+    docs = [chunk("docs/a.txt", 0, "a" * 200), chunk("docs/b.txt", 0, "b" * 400), chunk("docs/c.txt", 0, "c" * 100)]
+
+    passages = pack_context(docs, token_budget=90)
+
+    assert [passage.metadata["source"] for passage in passages] == ["docs/a.txt", "docs/c.txt"]
+    assert sum(estimate_tokens(passage.page_content) for passage in passages) <= 90
+
+def test_first_passage_is_cut_to_the_budget():
+    passages = pack_context([chunk("docs/a.txt", 0, "a" * 1000), chunk("docs/b.txt", 0, "b" * 10)], token_budget=50)
+
+    assert [passage.page_content for passage in passages] == ["a" * 200]
+
+def test_retriever_packs_its_hits_into_the_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(prepare_vectordb, "CHUNK_SIZE", 200)
+    monkeypatch.setattr(prepare_vectordb, "CHUNK_OVERLAP", 20)
+    persist_directory = str(tmp_path / "db")
+    text = " ".join(f"Step {i} of the pump maintenance checks the valve number {i}." for i in range(40))
+    ingest_sources([("docs/manual.txt", "manual", [Document(page_content=text, metadata={"source": "docs/manual.txt"})])], persist_directory)
+    vectordb = open_vectorstore(persist_directory)
+
+    passages = HybridRetriever(vectordb=vectordb, index=get_bm25_index(vectordb), k=6, fetch_k=20, token_budget=150).invoke("pump maintenance valve")
+
+    assert passages
+    assert sum(estimate_tokens(passage.page_content) for passage in passages) <= 150
+    # Every passage is a part of the manual, with neighbouring chunks merged into one
+    assert all(passage.page_content in text for passage in passages)
+    indexes = sorted(passage.metadata["chunk_index"] for passage in passages)
+    assert all(second - first > 1 for first, second in zip(indexes, indexes[1:]))
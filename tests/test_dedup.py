@@ -0,0 +1,91 @@
+from utils.prepare_vectordb import get_manifest, ingest_sources, iter_file_sources, open_vectorstore
+from utils.dedup import DedupIndex
+import random
+import sqlite3
+import threading
+import time
+
+def write_paragraphs(path, paragraphs):
+    path.write_text("\n\n".join(" ".join(words) for words in paragraphs), encoding="utf-8")
+
+def ingest(path, persist_directory):
+    ingest_sources(iter_file_sources([str(path)], get_manifest(persist_directory)), persist_directory)
+    return set(open_vectorstore(persist_directory).get()["documents"])
+
+def test_edited_chunks_of_a_reingested_file_are_stored(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    rng = random.Random(0)
+    vocabulary = [f"w{number}" for number in range(1000, 10000)]
+    # Every paragraph is one chunk of 200 words
+    paragraphs = [[rng.choice(vocabulary) for _ in range(200)] for _ in range(10)]
+    path = tmp_path / "notes.txt"
+    write_paragraphs(path, paragraphs)
+    assert len(ingest(path, persist_directory)) == 10
+
+    # One word of every paragraph changes, so every chunk is a near duplicate of its previous version
+    for words in paragraphs:
+        words[100] = "revised"
+    write_paragraphs(path, paragraphs)
+    stored = ingest(path, persist_directory)
+
+    assert len(stored) == 10
+    assert all("revised" in text.split() for text in stored)
+
+def test_unchanged_chunks_of_a_reingested_file_are_reused(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    rng = random.Random(1)
+    vocabulary = [f"w{number}" for number in range(1000, 10000)]
+    paragraphs = [[rng.choice(vocabulary) for _ in range(200)] for _ in range(4)]
+    path = tmp_path / "notes.txt"
+    write_paragraphs(path, paragraphs)
+    ingest(path, persist_directory)
+    first_ids = set(get_manifest(persist_directory).get_chunk_ids(str(path)))
+
+    paragraphs[0][0] = "revised"
+    write_paragraphs(path, paragraphs)
+    stored = ingest(path, persist_directory)
+    second_ids = set(get_manifest(persist_directory).get_chunk_ids(str(path)))
+
+    assert len(stored) == 4
+    # Only the edited chunk is new, the identical ones keep their stored chunk
+    assert len(second_ids - first_ids) == 1
+
+def test_near_duplicate_of_another_source_is_skipped(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    rng = random.Random(2)
+    words = [f"w{rng.randrange(1000, 10000)}" for _ in range(200)]
+    first, second = tmp_path / "first.txt", tmp_path / "second.txt"
+    write_paragraphs(first, [words])
+    # A copy that lost its last word, as a page cut slightly differently would give
+    write_paragraphs(second, [words[:-1]])
+    ingest_sources(iter_file_sources([str(first), str(second)], get_manifest(persist_directory)), persist_directory)
+
+    stored = open_vectorstore(persist_directory).get()
+    assert len(stored["ids"]) == 1
+    assert stored["metadatas"][0]["duplicate_sources"] == str(second)
+
+def test_second_writer_waits_for_the_first_to_close(tmp_path, monkeypatch):
+    # A short SQLite busy timeout, so a writer that relied on it would fail while the first one is open
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *args, **kwargs: connect(*args, **{**kwargs, "timeout": 0.1}))
+    path = str(tmp_path / "dedup.sqlite3")
+    first = DedupIndex(path)
+    opened = threading.Event()
+    errors = []
+
+    def open_second():
+        try:
+            second = DedupIndex(path)
+            opened.set()
+            second.commit()
+            second.close()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=open_second)
+    thread.start()
+    time.sleep(0.5)
+    assert thread.is_alive() and not opened.is_set()
+    first.close()
+    thread.join(timeout=10)
+    assert opened.is_set() and not errors
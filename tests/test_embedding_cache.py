@@ -0,0 +1,86 @@
+from utils.embedding_cache import CachedEmbeddings
+from utils.fakes import HashingEmbeddings
+from utils.prepare_vectordb import MANIFEST_FILENAME, get_embedding, get_manifest, ingest_sources, iter_file_sources, open_vectorstore
+from utils import prepare_vectordb
+import os
+import pytest
+
+def test_cached_texts_are_not_embedded_again(tmp_path):
+    embedding = HashingEmbeddings()
+    cache = CachedEmbeddings(embedding, str(tmp_path / "cache.sqlite3"))
+
+    first = cache.embed_documents(["alpha beta", "gamma delta"])
+    second = cache.embed_documents(["gamma delta", "alpha beta", "epsilon"])
+
+    assert embedding.calls == 2
+    # Cached vectors are stored as float32
+    assert second[0] == pytest.approx(first[1], abs=1e-6)
+    assert second[1] == pytest.approx(first[0], abs=1e-6)
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+
+def test_texts_that_differ_in_whitespace_share_an_entry(tmp_path):
+    embedding = HashingEmbeddings()
+    cache = CachedEmbeddings(embedding, str(tmp_path / "cache.sqlite3"))
+
+    cache.embed_documents(["alpha  beta\n"])
+    cache.embed_documents(["alpha beta"])
+
+    assert embedding.calls == 1
+
+def test_queries_and_documents_are_cached_apart(tmp_path):
+    embedding = HashingEmbeddings()
+    cache = CachedEmbeddings(embedding, str(tmp_path / "cache.sqlite3"))
+
+    cache.embed_documents(["alpha beta"])
+    cache.embed_query("alpha beta")
+    cache.embed_query("alpha beta")
+
+    assert embedding.calls == 2
+
+def test_least_recently_used_vectors_are_evicted(tmp_path):
+    embedding = HashingEmbeddings()
+    cache = CachedEmbeddings(embedding, str(tmp_path / "cache.sqlite3"), max_entries=2)
+
+    cache.embed_documents(["first"])
+    cache.embed_documents(["second"])
+    cache.embed_documents(["first"])
+    cache.embed_documents(["third"])
+    assert cache.stats()["entries"] == 2
+    calls = embedding.calls
+
+    # second was the least recently used, so it is the only one embedded again
+    cache.embed_documents(["first", "third"])
+    assert embedding.calls == calls
+    cache.embed_documents(["second"])
+    assert embedding.calls == calls + 1
+
+def test_cache_persists_across_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = CachedEmbeddings(HashingEmbeddings(), path)
+    vector = first.embed_query("alpha beta")
+    first.close()
+
+    embedding = HashingEmbeddings()
+    second = CachedEmbeddings(embedding, path)
+
+    assert second.embed_query("alpha beta") == pytest.approx(vector, abs=1e-6)
+    assert embedding.calls == 0
+
+def test_ingesting_the_same_chunks_again_makes_no_embedding_calls(tmp_path, monkeypatch):
+    # Without duplicate detection every chunk of the second run reaches the embedder, so only the cache can answer
+    monkeypatch.setattr(prepare_vectordb, "DEDUPLICATE_CHUNKS", False)
+    persist_directory = str(tmp_path / "db")
+    path = tmp_path / "notes.txt"
+    path.write_text("\n\n".join(f"paragraph {number} " + "about the budget of the project " * 40 for number in range(5)), encoding="utf-8")
+    ingest_sources(iter_file_sources([str(path)], get_manifest(persist_directory)), persist_directory)
+    backend = get_embedding(persist_directory).embedding.embedding
+    assert backend.calls > 0
+
+    # Forgetting the manifest makes the file new again, as rebuilding the index would
+    os.remove(os.path.join(persist_directory, MANIFEST_FILENAME))
+    backend.calls = 0
+    ingest_sources(iter_file_sources([str(path)], get_manifest(persist_directory)), persist_directory)
+
+    assert backend.calls == 0
+    assert len(open_vectorstore(persist_directory).get()["ids"]) >= 5
@@ -0,0 +1,84 @@
+from langchain_core.documents import Document
+from utils.embedding_pipeline import batch_chunks, embed_and_store, estimate_tokens
+from utils.fakes import HashingEmbeddings
+import threading
+
+def make_chunks(texts):
+    return [(f"chunk-{position}", Document(page_content=text)) for position, text in enumerate(texts)]
+
+class RecordingStore:
+    """Vectorstore stand-in that keeps what embed_and_store upserts"""
+    def __init__(self):
+        self._collection = self
+        self.rows = {}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for chunk_id, vector, text in zip(ids, embeddings, documents):
+            self.rows[chunk_id] = (vector, text)
+
+class RecordingEmbeddings(HashingEmbeddings):
+    """Fake embedder that records the size of every request and the most requests in flight at once"""
+    def __init__(self):
+        super().__init__(latency=0.01)
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.batches.append(len(texts))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            return super().embed_documents(texts)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+def test_batches_are_split_at_the_chunk_limit():
+    batches = list(batch_chunks(make_chunks([f"chunk number {i}" for i in range(25)]), max_batch_size=10))
+
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [chunk_id for batch in batches for chunk_id, _ in batch] == [f"chunk-{i}" for i in range(25)]
+
+def test_batches_are_split_at_the_token_limit():
+    text = "x" * 396  # 100 estimated tokens
+    assert estimate_tokens(text) == 100
+
+    batches = list(batch_chunks(make_chunks([text] * 7), max_batch_tokens=250))
+
+    assert [len(batch) for batch in batches] == [2, 2, 2, 1]
+
+def test_chunk_larger_than_the_token_limit_gets_its_own_batch():
+    batches = list(batch_chunks(make_chunks(["short", "y" * 4000, "short"]), max_batch_tokens=100))
+
+    assert [[chunk.page_content[:5] for _, chunk in batch] for batch in batches] == [["short"], ["yyyyy"], ["short"]]
+
+def test_chunks_are_consumed_lazily():
+    consumed = []
+
+    def chunks():
+        for chunk_id, chunk in make_chunks([f"chunk number {i}" for i in range(30)]):
+            consumed.append(chunk_id)
+            yield chunk_id, chunk
+
+    batches = batch_chunks(chunks(), max_batch_size=10)
+    next(batches)
+
+    # The eleventh chunk is read to know the first batch is full
+    assert len(consumed) == 11
+
+def test_every_chunk_is_stored_with_its_own_vector():
+    embedding = RecordingEmbeddings()
+    store = RecordingStore()
+    texts = [f"note {i} about the budget" for i in range(95)]
+
+    stored = embed_and_store(store, embedding, make_chunks(texts), max_workers=3, max_batch_size=10)
+
+    assert stored == 95
+    assert sorted(embedding.batches) == [5] + [10] * 9
+    assert embedding.max_active <= 3
+    reference = HashingEmbeddings()
+    for chunk_id, chunk in make_chunks(texts):
+        assert store.rows[chunk_id] == (reference.embed_query(chunk.page_content), chunk.page_content)
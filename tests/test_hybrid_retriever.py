@@ -0,0 +1,71 @@
+from langchain_core.documents import Document
+from utils.hybrid_retriever import HybridRetriever
+from utils.prepare_vectordb import get_bm25_index, get_manifest, ingest_sources, open_vectorstore
+import os
+import subprocess
+import sys
+
+def ingest_notes(persist_directory, notes):
+    ingest_sources([(f"docs/{name}.txt", name, [Document(page_content=text, metadata={"source": f"docs/{name}.txt"})]) for name, text in notes.items()], persist_directory)
+    vectordb = open_vectorstore(persist_directory)
+    return vectordb, get_bm25_index(vectordb)
+
+def test_uncommitted_lexical_hits_do_not_take_the_places_of_committed_chunks(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    vectordb, index = ingest_notes(persist_directory, {"serial": "the serial number of the pump is XK42",
+                                                       **{f"filler{i}": f"filler note {i} about the weather" for i in range(6)}})
+    version = get_manifest(persist_directory).version
+    # A background ingestion wrote chunks of the next version, which the BM25 index already knows
+    ids = [f"pending{i}" for i in range(5)]
+    vectordb.add_texts(["XK42 XK42 XK42"] * 5, metadatas=[{"source": "docs/pending.txt", "chunk_id": chunk_id, "index_version": version + 1} for chunk_id in ids], ids=ids)
+    for chunk_id in ids:
+        index.add(chunk_id, "XK42 XK42 XK42")
+
+    results = HybridRetriever(vectordb=vectordb, index=index, max_version=version, k=3, fetch_k=3).search("XK42")
+
+    assert len(results) == 3
+    assert all(doc.metadata["index_version"] <= version for doc, _ in results)
+    assert "the serial number of the pump is XK42" in [doc.page_content for doc, _ in results]
+
+def test_index_is_reloaded_after_another_process_ingests(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    vectordb, index = ingest_notes(persist_directory, {"first": "minutes of the first meeting"})
+    assert not index.search("quarterly", 4)
+    script = ("from langchain_core.documents import Document\n"
+              "from utils.prepare_vectordb import ingest_sources\n"
+              f"ingest_sources([('docs/second.txt', 'second', [Document(page_content='the quarterly budget', metadata={{'source': 'docs/second.txt'}})])], {persist_directory!r})\n")
+    environment = {**os.environ, "PYTHONPATH": os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")}
+    subprocess.run([sys.executable, "-c", script], env=environment, check=True, capture_output=True)
+
+    vectordb = open_vectorstore(persist_directory)
+    assert [chunk_id for chunk_id, _ in get_bm25_index(vectordb).search("quarterly", 4)] == get_manifest(persist_directory).get_chunk_ids("docs/second.txt")
+
+def test_hits_are_fused_by_reciprocal_rank(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    vectordb, index = ingest_notes(persist_directory, {"pump": "the serial number of the pump is XK42",
+                                                       "valve": "maintenance of the valve of the pump",
+                                                       "budget": "the budget of the maintenance is twelve thousand euros",
+                                                       "weather": "notes about the weather of the week"})
+    retriever = HybridRetriever(vectordb=vectordb, index=index, k=4, fetch_k=4, rrf_k=60)
+    query = "pump maintenance XK42"
+
+    expected = {}
+    for rank, doc in enumerate(vectordb.similarity_search_by_vector(vectordb.embeddings.embed_query(query), k=4)):
+        expected[doc.metadata["chunk_id"]] = 1 / (60 + rank + 1)
+    for rank, (chunk_id, _) in enumerate(index.search(query, 4)):
+        expected[chunk_id] = expected.get(chunk_id, 0.0) + 1 / (60 + rank + 1)
+    results = retriever.search(query)
+
+    assert [(doc.metadata["chunk_id"], score) for doc, score in results] == sorted(expected.items(), key=lambda item: item[1], reverse=True)
+    # The chunk with the identifier is the best hit of both lists
+    assert results[0][0].page_content == "the serial number of the pump is XK42"
+
+def test_chunks_found_only_by_bm25_are_loaded_from_the_vectorstore(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    vectordb, index = ingest_notes(persist_directory, {f"note{i}": f"note {i} about the weather of the week" for i in range(6)}
+                                   | {"pump": "XK42"})
+
+    results = HybridRetriever(vectordb=vectordb, index=index, k=2, fetch_k=1).search("weather XK42")
+
+    assert "XK42" in [doc.page_content for doc, _ in results]
+    assert all(doc.metadata["source"].startswith("docs/") for doc, _ in results)
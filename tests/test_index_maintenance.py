@@ -0,0 +1,40 @@
+from utils.index_maintenance import reconcile_docs
+from utils.prepare_vectordb import get_manifest, ingest_sources, iter_file_sources, list_shards, open_vectorstore
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+def test_reconcile_covers_subfolders_of_docs(tmp_path, monkeypatch):
+    # Sources are recorded relative to the app folder, as docs/... and docs/<group>/...
+    monkeypatch.chdir(tmp_path)
+    persist_directory = str(tmp_path / "db")
+    write(tmp_path / "docs" / "b.txt", "notes about the budget of the project")
+    write(tmp_path / "docs" / "grp" / "c.txt", "minutes of the meeting of the group")
+    result = reconcile_docs("docs", persist_directory)
+    assert result["ingested_sources"] == 2
+    assert "group_grp" in list_shards(persist_directory)
+
+    (tmp_path / "docs" / "grp" / "c.txt").unlink()
+    write(tmp_path / "docs" / "grp" / "d.txt", "agenda of the next meeting of the group")
+    result = reconcile_docs("docs", persist_directory)
+
+    assert result["removed_sources"] == ["docs/grp/c.txt"]
+    assert result["ingested_sources"] == 1
+    assert set(get_manifest(persist_directory).sources) == {"docs/b.txt", "docs/grp/d.txt"}
+    stored = open_vectorstore(persist_directory, "group_grp").get()
+    assert {metadata["source"] for metadata in stored["metadatas"]} == {"docs/grp/d.txt"}
+
+def test_reconcile_leaves_other_sources_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    persist_directory = str(tmp_path / "db")
+    write(tmp_path / "docs" / "b.txt", "notes about the budget of the project")
+    write(tmp_path / "other" / "e.txt", "a file ingested from outside the docs folder")
+    reconcile_docs("docs", persist_directory)
+    ingest_sources(iter_file_sources(["other/e.txt"], get_manifest(persist_directory)), persist_directory)
+    (tmp_path / "other" / "e.txt").unlink()
+
+    result = reconcile_docs("docs", persist_directory)
+
+    assert result["removed_sources"] == []
+    assert "other/e.txt" in get_manifest(persist_directory).sources
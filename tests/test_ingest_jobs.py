@@ -0,0 +1,72 @@
+from langchain_core.documents import Document
+from utils.fakes import HashingEmbeddings
+from utils.ingest_jobs import IngestionWorker, JobQueue
+from utils.prepare_vectordb import get_bm25_index, get_manifest, ingest_sources, open_vectorstore
+from utils import ingest_jobs
+import pytest
+import time
+
+def wait_for_job(jobs, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = next(job for job in jobs.recent() if job["id"] == job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+def start_worker(tmp_path, monkeypatch):
+    # Jobs read the docs folder of the working directory, like the app
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ingest_jobs, "PERSIST_DIRECTORY", str(tmp_path / "db"))
+    jobs = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    IngestionWorker(jobs).start()
+    return jobs
+
+def test_documents_job_is_done_once_ingested(tmp_path, monkeypatch):
+    jobs = start_worker(tmp_path, monkeypatch)
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "notes.txt").write_text("notes about the budget of the project", encoding="utf-8")
+
+    job = wait_for_job(jobs, jobs.submit("documents", {"files": ["notes.txt"]}))
+
+    assert job["status"] == "done"
+    assert job["error"] is None
+    assert list(get_manifest(str(tmp_path / "db")).sources) == ["docs/notes.txt"]
+
+def test_documents_job_that_fails_is_reported_as_failed(tmp_path, monkeypatch):
+    jobs = start_worker(tmp_path, monkeypatch)
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "notes.txt").write_text("notes about the budget of the project", encoding="utf-8")
+
+    def fail(self, texts):
+        raise ValueError("400 API key not valid")
+    monkeypatch.setattr(HashingEmbeddings, "embed_documents", fail)
+
+    job = wait_for_job(jobs, jobs.submit("documents", {"files": ["notes.txt"]}))
+
+    assert job["status"] == "failed"
+    assert "API key not valid" in job["error"]
+    assert not get_manifest(str(tmp_path / "db")).sources
+
+def test_chunks_of_a_failed_source_are_not_committed(tmp_path, monkeypatch):
+    persist_directory = str(tmp_path / "db")
+    embed_documents = HashingEmbeddings.embed_documents
+
+    def fail_last_batch(self, texts):
+        # The last batch of the second source fails after its first batches were written
+        if any(text.startswith("part 249 ") for text in texts):
+            time.sleep(0.3)
+            raise ValueError("400 API key not valid")
+        return embed_documents(self, texts)
+    monkeypatch.setattr(HashingEmbeddings, "embed_documents", fail_last_batch)
+    parts = [Document(page_content=f"part {i} of the long report", metadata={"source": "docs/long.txt"}) for i in range(250)]
+
+    with pytest.raises(ValueError):
+        ingest_sources([("docs/short.txt", "a", [Document(page_content="a short note", metadata={"source": "docs/short.txt"})]),
+                        ("docs/long.txt", "b", iter(parts))], persist_directory)
+
+    assert list(get_manifest(persist_directory).sources) == ["docs/short.txt"]
+    stored = open_vectorstore(persist_directory).get()
+    assert {metadata["source"] for metadata in stored["metadatas"]} == {"docs/short.txt"}
+    assert not get_bm25_index(open_vectorstore(persist_directory)).search("report", 10)
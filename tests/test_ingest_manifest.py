@@ -0,0 +1,56 @@
+from utils.ingest_manifest import IngestionManifest, hash_text, read_index_version
+from utils.prepare_vectordb import get_index_version, get_manifest, ingest_sources, iter_file_sources, open_vectorstore
+
+def ingest_notes(tmp_path, text):
+    # Writes docs/notes.txt relative to tmp_path and ingests it like the app does
+    persist_directory = str(tmp_path / "db")
+    (tmp_path / "docs").mkdir(exist_ok=True)
+    (tmp_path / "docs" / "notes.txt").write_text(text, encoding="utf-8")
+    _, changed = ingest_sources(iter_file_sources(["docs/notes.txt"], get_manifest(persist_directory)), persist_directory)
+    return changed
+
+def test_unchanged_source_is_skipped_and_keeps_the_version(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert ingest_notes(tmp_path, "the budget of the project is twelve thousand euros") == 1
+    assert get_index_version(str(tmp_path / "db")) == 1
+
+    assert ingest_notes(tmp_path, "the budget of the project is twelve thousand euros") == 0
+
+    assert get_index_version(str(tmp_path / "db")) == 1
+
+def test_changed_source_bumps_the_version_and_replaces_its_chunks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ingest_notes(tmp_path, "the budget of the project is twelve thousand euros")
+    previous_ids = get_manifest(str(tmp_path / "db")).get_chunk_ids("docs/notes.txt")
+
+    assert ingest_notes(tmp_path, "the budget of the project is fifteen thousand euros") == 1
+
+    manifest = get_manifest(str(tmp_path / "db"))
+    assert manifest.version == 2
+    stored = open_vectorstore(str(tmp_path / "db")).get(include=["documents", "metadatas"])
+    assert set(stored["ids"]) == set(manifest.get_chunk_ids("docs/notes.txt"))
+    assert not set(previous_ids) & set(stored["ids"])
+    assert stored["documents"] == ["the budget of the project is fifteen thousand euros"]
+    assert stored["metadatas"][0]["index_version"] == 2
+
+def test_source_chunked_with_another_fingerprint_is_changed(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestionManifest(path, fingerprint="chunk_size=1500;chunk_overlap=150")
+    manifest.record("docs/notes.txt", hash_text("notes"), ["a", "b"])
+    manifest.commit()
+
+    assert IngestionManifest(path, fingerprint="chunk_size=1500;chunk_overlap=150").is_unchanged("docs/notes.txt", hash_text("notes"))
+    assert not IngestionManifest(path, fingerprint="chunk_size=1500;chunk_overlap=150").is_unchanged("docs/notes.txt", hash_text("other notes"))
+    assert not IngestionManifest(path, fingerprint="chunk_size=800;chunk_overlap=150").is_unchanged("docs/notes.txt", hash_text("notes"))
+
+def test_index_version_is_read_again_when_the_manifest_changes(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    assert read_index_version(path) == 0
+    manifest = IngestionManifest(path)
+    manifest.commit()
+    assert read_index_version(path) == 1
+
+    manifest.commit()
+
+    assert read_index_version(path) == 2
+    assert IngestionManifest(path).version == 2
@@ -0,0 +1,156 @@
+from langchain_core.documents import Document
+from utils.fakes import HashingEmbeddings
+from utils.index_maintenance import build_ivf_indexes
+from utils.numpy_vectorstore import NumpyVectorStore
+from utils.prepare_vectordb import get_manifest, ingest_sources, open_vectorstore
+from utils import prepare_vectordb
+import numpy as np
+import os
+import pytest
+
+class LockCheckingConnection:
+    """Connection that fails if it is used without the lock of its store"""
+    def __init__(self, store):
+        self.store = store
+        self.connection = store._connection
+
+    def __getattr__(self, name):
+        assert self.store._lock._is_owned(), f"connection.{name} used without the lock of the store"
+        return getattr(self.connection, name)
+
+@pytest.mark.parametrize("use", [
+    lambda store: store.count(),
+    lambda store: store.get(ids=["a"]),
+    lambda store: store.get(where={"kind": "text"}, include=["embeddings"]),
+    lambda store: store.similarity_search("first chunk", k=1),
+    lambda store: store.add_texts(["third chunk"], ids=["c"]),
+    lambda store: store.delete(ids=["b"]),
+])
+def test_connection_is_only_used_under_the_lock(tmp_path, use):
+    # The ingestion worker writes while the app reads, and the sqlite connection is shared between the threads
+    store = NumpyVectorStore(str(tmp_path), HashingEmbeddings())
+    store.add_texts(["first chunk", "second chunk"], metadatas=[{"kind": "text"}] * 2, ids=["a", "b"])
+    store._connection = LockCheckingConnection(store)
+    use(store)
+
+def random_store(path, count=600, dim=48, dtype="int8", clusters=None, seed=0):
+    # Stores random unit vectors, optionally drawn around a few centres, and returns them with the store
+    rng = np.random.default_rng(seed)
+    if clusters:
+        centres = rng.normal(size=(clusters, dim))
+        vectors = centres[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dim))
+    else:
+        vectors = rng.normal(size=(count, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    store = NumpyVectorStore(str(path), HashingEmbeddings(), dtype=dtype)
+    store.upsert([f"c{i}" for i in range(count)], vectors.tolist(), [f"chunk {i}" for i in range(count)], [{"i": i} for i in range(count)])
+    return store, vectors
+
+def exact_top(vectors, query, k):
+    return set(np.argsort(-(vectors @ query))[:k].tolist())
+
+def found_top(store, query, k):
+    return {doc.metadata["i"] for doc in store.similarity_search_by_vector(query.tolist(), k=k)}
+
+@pytest.mark.parametrize("dtype, min_recall", [("int8", 0.9), ("float16", 0.98)])
+def test_quantized_search_recalls_the_exact_neighbours(tmp_path, dtype, min_recall):
+    store, vectors = random_store(tmp_path, dtype=dtype)
+    queries = vectors[:30] + 0.1 * np.random.default_rng(1).normal(size=(30, vectors.shape[1]))
+
+    recall = np.mean([len(found_top(store, query, 10) & exact_top(vectors, query, 10)) / 10 for query in queries])
+
+    assert recall >= min_recall
+    stored = np.array(store.get(ids=["c0", "c1"], include=["embeddings"])["embeddings"])
+    assert np.allclose(stored, vectors[:2], atol=0.02)
+
+def test_ivf_search_agrees_with_the_flat_search(tmp_path):
+    store, vectors = random_store(tmp_path, count=2000, clusters=32)
+    queries = vectors[:40]
+    flat = [found_top(store, query, 5) for query in queries]
+
+    store.build_ivf(n_lists=32)
+
+    assert store._centroids is not None
+    agreement = np.mean([len(found_top(store, query, 5) & expected) / 5 for query, expected in zip(queries, flat)])
+    assert agreement >= 0.9
+    # Chunks added after the partition are assigned to a list and found
+    store.upsert(["late"], [vectors[7].tolist()], ["late chunk"], [{"i": -1}])
+    assert -1 in found_top(store, vectors[7], 2)
+
+def test_deleted_chunks_are_gone_and_compaction_keeps_the_others(tmp_path):
+    store, vectors = random_store(tmp_path, count=100)
+    store.delete(ids=[f"c{i}" for i in range(0, 100, 2)])
+
+    assert store.count() == 50
+    assert all(doc.metadata["i"] % 2 for doc in store.similarity_search_by_vector(vectors[10].tolist(), k=10))
+    assert store.compact() == 50
+    assert store.rows == 50
+    stored = store.get(include=["documents", "metadatas", "embeddings"])
+    assert stored["ids"] == [f"c{i}" for i in range(1, 100, 2)]
+    assert stored["documents"] == [f"chunk {i}" for i in range(1, 100, 2)]
+    assert np.allclose(np.array(stored["embeddings"]), vectors[1::2], atol=0.02)
+    assert found_top(store, vectors[11], 1) == {11}
+
+def test_reopening_finishes_a_compaction_interrupted_after_its_commit(tmp_path):
+    store, vectors = random_store(tmp_path, count=100)
+    store.delete(ids=[f"c{i}" for i in range(50)])
+
+    def crash():
+        raise RuntimeError("process killed")
+    store._finish_compaction = crash
+    with pytest.raises(RuntimeError):
+        store.compact()
+
+    reopened = NumpyVectorStore(str(tmp_path), HashingEmbeddings())
+    assert reopened.count() == 50 and reopened.rows == 50
+    stored = reopened.get(include=["documents", "embeddings"])
+    assert stored["documents"] == [f"chunk {i}" for i in range(50, 100)]
+    assert np.allclose(np.array(stored["embeddings"]), vectors[50:], atol=0.02)
+    assert found_top(reopened, vectors[60], 1) == {60}
+
+def test_reopening_drops_a_compaction_interrupted_before_its_commit(tmp_path):
+    store, vectors = random_store(tmp_path, count=100)
+    store.delete(ids=[f"c{i}" for i in range(50)])
+    # A compaction that died while writing its segments leaves them beside the store, with nothing committed
+    os.makedirs(store.directory + ".compact")
+    np.save(os.path.join(store.directory + ".compact", "segment_00000_vectors.npy"), np.zeros((1, 1)))
+
+    reopened = NumpyVectorStore(str(tmp_path), HashingEmbeddings())
+
+    assert not os.path.exists(store.directory + ".compact")
+    assert reopened.count() == 50
+    assert found_top(reopened, vectors[60], 1) == {60}
+
+def test_build_ivf_indexes_partitions_every_shard(tmp_path, monkeypatch):
+    monkeypatch.setattr(prepare_vectordb, "VECTOR_BACKEND", "numpy")
+    persist_directory = str(tmp_path / "db")
+    notes = [(f"docs/note{i}.txt", str(i), [Document(page_content=f"note {i} about topic {i % 5}", metadata={"source": f"docs/note{i}.txt"})]) for i in range(40)]
+    ingest_sources(notes + [("https://example.com/", "web", [Document(page_content="a web page", metadata={"source": "https://example.com/"})])], persist_directory)
+    version = get_manifest(persist_directory).version
+
+    assert build_ivf_indexes(persist_directory, n_lists=4) == {"documents": 40, "web": 1}
+
+    assert get_manifest(persist_directory).version == version + 1
+    vectordb = open_vectorstore(persist_directory)
+    assert vectordb._centroids is not None and len(vectordb._centroids) == 4
+    assert vectordb.similarity_search("note 7 about topic 2", k=1)[0].page_content == "note 7 about topic 2"
+
+def test_build_ivf_indexes_needs_the_numpy_backend(tmp_path):
+    with pytest.raises(ValueError):
+        build_ivf_indexes(str(tmp_path / "db"))
+
+def test_store_replaced_by_a_new_index_version_is_closed_and_still_usable(tmp_path, monkeypatch):
+    monkeypatch.setattr(prepare_vectordb, "VECTOR_BACKEND", "numpy")
+    persist_directory = str(tmp_path / "db")
+    ingest_sources([("docs/a.txt", "a", [Document(page_content="first note", metadata={"source": "docs/a.txt"})])], persist_directory)
+    old = open_vectorstore(persist_directory)
+    old.count()
+
+    ingest_sources([("docs/b.txt", "b", [Document(page_content="second note", metadata={"source": "docs/b.txt"})])], persist_directory)
+    new = open_vectorstore(persist_directory)
+
+    assert new is not old
+    assert old._database is None and not old._segments
+    # A reader that still holds the old store gets it opened again
+    assert old.count() == new.count() == 2
+    assert old.similarity_search("second note", k=1)[0].page_content == "second note"
@@ -0,0 +1,54 @@
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+from utils.source_loaders import extract_pdf_text, iter_page_ranges, iter_pdf_documents
+
+def write_pdf(path, pages):
+    # One line of Helvetica text per page, which pypdf extracts back as is
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type1"), NameObject("/BaseFont"): NameObject("/Helvetica")}))
+    for text in pages:
+        page = writer.add_blank_page(612, 792)
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1"))
+        page[NameObject("/Contents")] = writer._add_object(content)
+        page[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+    writer.write(str(path))
+    return str(path)
+
+def test_page_ranges_are_yielded_in_document_order(tmp_path):
+    report = write_pdf(tmp_path / "report.pdf", [f"page {i} of the report" for i in range(5)])
+
+    ranges = list(iter_page_ranges([report], max_workers=1, pages_per_task=2))
+
+    assert [len(docs) for _, docs in ranges] == [2, 2, 1]
+    pages = [doc for _, docs in ranges for doc in docs]
+    assert [doc.page_content for doc in pages] == [f"page {i} of the report" for i in range(5)]
+    assert [doc.metadata for doc in pages] == [{"source": report, "page": i} for i in range(5)]
+
+def test_worker_processes_extract_the_same_pages(tmp_path):
+    paths = [write_pdf(tmp_path / f"report{n}.pdf", [f"page {i} of report {n}" for i in range(7)]) for n in range(3)]
+
+    in_process = [(path, [doc.page_content for doc in docs]) for path, docs in iter_page_ranges(paths, max_workers=1, pages_per_task=3)]
+    in_workers = [(path, [doc.page_content for doc in docs]) for path, docs in iter_page_ranges(paths, max_workers=2, pages_per_task=3)]
+
+    assert in_workers == in_process
+    assert len(in_workers) == 9
+
+def test_pages_are_grouped_by_pdf_and_unreadable_pdfs_are_skipped(tmp_path):
+    first = write_pdf(tmp_path / "first.pdf", ["first page", "second page"])
+    broken = str(tmp_path / "broken.pdf")
+    (tmp_path / "broken.pdf").write_bytes(b"not a pdf")
+    second = write_pdf(tmp_path / "second.pdf", ["only page"])
+
+    groups = [(path, [doc.page_content for doc in pages]) for path, pages in iter_pdf_documents([first, broken, second], max_workers=1)]
+
+    assert groups == [(first, ["first page", "second page"]), (second, ["only page"])]
+
+def test_pdfs_are_read_from_the_docs_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "docs").mkdir()
+    write_pdf(tmp_path / "docs" / "report.pdf", ["budget of the project", "agenda of the meeting"])
+
+    docs = extract_pdf_text(["report.pdf"], max_workers=1)
+
+    assert [(doc.metadata["source"], doc.page_content) for doc in docs] == [("docs/report.pdf", "budget of the project"), ("docs/report.pdf", "agenda of the meeting")]
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+from utils.fakes import FakeChatModel, FakeRateLimitError, HashingEmbeddings
+from utils.resilient_client import ResilientChatModel, ResilientClient, ResilientEmbeddings
+from utils import fakes, metrics
+import pytest
+import threading
+import time
+
+class Draws:
+    """Replaces the random draws of the fake backends, so they fail on chosen calls"""
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def random(self):
+        return next(self.values, 1.0)
+
+def test_identical_concurrent_calls_reach_the_backend_once():
+    embedding = HashingEmbeddings(latency=0.2)
+    client = ResilientEmbeddings(embedding, ResilientClient("test_coalesce", timeout=5))
+
+    with ThreadPoolExecutor(20) as executor:
+        vectors = list(executor.map(lambda _: client.embed_query("same question"), range(20)))
+
+    assert embedding.calls == 1
+    assert all(vector == vectors[0] for vector in vectors)
+
+def test_different_calls_are_not_coalesced():
+    embedding = HashingEmbeddings(latency=0.05)
+    client = ResilientEmbeddings(embedding, ResilientClient("test_distinct", timeout=5))
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda number: client.embed_query(f"question {number}"), range(4)))
+
+    assert embedding.calls == 4
+
+def test_max_concurrency_is_respected():
+    embedding = HashingEmbeddings(latency=0.1)
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def embed(text):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        try:
+            return embedding.embed_query(text)
+        finally:
+            with lock:
+                running -= 1
+
+    client = ResilientClient("test_cap", max_concurrency=2, timeout=5)
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda number: client.call(f"key {number}", lambda: embed(f"question {number}")), range(8)))
+
+    assert peak == 2
+    assert embedding.calls == 8
+
+def test_throttled_calls_are_retried():
+    embedding = HashingEmbeddings(failure_rate=0.5)
+    client = ResilientEmbeddings(embedding, ResilientClient("test_retry", timeout=30, max_retries=20, base_delay=0.001, max_delay=0.01))
+
+    assert all(client.embed_query(f"question {number}") for number in range(20))
+    assert embedding.calls > 20
+
+def test_retries_stop_at_the_deadline():
+    embedding = HashingEmbeddings(failure_rate=1.0, latency=0.05)
+    client = ResilientEmbeddings(embedding, ResilientClient("test_deadline", timeout=0.5, max_retries=1000, base_delay=0.05, max_delay=0.1))
+
+    start = time.monotonic()
+    with pytest.raises((FakeRateLimitError, TimeoutError)):
+        client.embed_query("question")
+
+    assert time.monotonic() - start < 1.0
+    assert embedding.calls < 20
+
+def test_errors_that_are_not_throttling_are_not_retried():
+    embedding = HashingEmbeddings()
+    client = ResilientClient("test_no_retry", base_delay=0.001)
+
+    def fail():
+        embedding.embed_query("question")
+        raise ValueError("400 invalid argument")
+
+    with pytest.raises(ValueError):
+        client.call("key", fail)
+    assert embedding.calls == 1
+
+def test_queued_call_times_out_and_leaves_the_queue():
+    client = ResilientClient("test_queue", max_concurrency=1, timeout=5)
+    slow = ResilientEmbeddings(HashingEmbeddings(latency=0.5), client)
+    blocker = threading.Thread(target=slow.embed_query, args=("slow question",))
+    blocker.start()
+    time.sleep(0.05)
+
+    with pytest.raises(TimeoutError):
+        client.call("queued", lambda: "answer", timeout=0.1)
+
+    blocker.join()
+    gauges = {gauge["name"]: gauge["value"] for gauge in metrics.export_json()["gauges"] if gauge["labels"] == {"client": "test_queue"}}
+    assert gauges == {"client_queue_depth": 0, "client_in_flight": 0}
+
+def test_identical_chat_requests_reach_the_model_once():
+    model = FakeChatModel(responses=["the answer"], latency=0.2)
+    chat = ResilientChatModel(model=model, client=ResilientClient("test_chat", timeout=5))
+
+    with ThreadPoolExecutor(10) as executor:
+        answers = list(executor.map(lambda _: chat.invoke("question").content, range(10)))
+
+    assert model.calls == 1
+    assert answers == ["the answer"] * 10
+
+def test_stream_that_fails_before_its_first_chunk_is_retried(monkeypatch):
+    monkeypatch.setattr(fakes, "random", Draws([0.0]))
+    model = FakeChatModel(responses=["streamed answer"], failure_rate=0.5)
+    chat = ResilientChatModel(model=model, client=ResilientClient("test_stream_retry", timeout=5, base_delay=0.001))
+
+    assert "".join(chunk.content for chunk in chat.stream("question")) == "streamed answer"
+    assert model.calls == 2
+
+def test_stream_that_fails_after_its_first_chunk_is_not_retried():
+    model = FakeChatModel(responses=["streamed answer"], error_on_chunk_number=3)
+    chat = ResilientChatModel(model=model, client=ResilientClient("test_stream_error", timeout=5, base_delay=0.001))
+
+    received = []
+    with pytest.raises(Exception):
+        for chunk in chat.stream("question"):
+            received.append(chunk.content)
+
+    assert "".join(received) == "str"
+    assert model.calls == 1
+
+def test_coalesced_streams_start_from_the_first_chunk():
+    # Every chunk takes 20 ms, so the second caller joins while the answer is being streamed
+    model = FakeChatModel(responses=["streamed answer"], sleep=0.02)
+    chat = ResilientChatModel(model=model, client=ResilientClient("test_stream_coalesce", timeout=5))
+    first = chat.stream("question")
+    received = [next(first).content]
+
+    second = "".join(chunk.content for chunk in chat.stream("question"))
+    received += [chunk.content for chunk in first]
+
+    assert model.calls == 1
+    assert second == "streamed answer"
+    assert "".join(received) == "streamed answer"
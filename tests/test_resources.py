@@ -0,0 +1,63 @@
+from utils.resources import get_resource, invalidate
+import threading
+
+def test_slow_resource_does_not_block_other_lookups():
+    release = threading.Event()
+    started = threading.Event()
+
+    def build_slow():
+        started.set()
+        release.wait(10)
+        return "slow"
+
+    thread = threading.Thread(target=get_resource, args=("test:slow", build_slow))
+    thread.start()
+    try:
+        assert started.wait(10)
+        other = []
+        lookup = threading.Thread(target=lambda: other.append(get_resource("test:fast", lambda: "fast")))
+        lookup.start()
+        lookup.join(timeout=2)
+        assert other == ["fast"]
+    finally:
+        release.set()
+        thread.join(timeout=10)
+        invalidate("test:slow")
+        invalidate("test:fast")
+
+def test_resource_is_built_once_by_concurrent_callers():
+    builds = []
+    release = threading.Event()
+
+    def build():
+        builds.append(1)
+        release.wait(10)
+        return object()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get_resource("test:shared", build))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    invalidate("test:shared")
+    assert len(builds) == 1
+    assert len(results) == 4 and all(result is results[0] for result in results)
+
+class Closeable:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_replaced_and_dropped_resources_are_closed():
+    first = get_resource("test:closeable", Closeable, fingerprint=1)
+    assert get_resource("test:closeable", Closeable, fingerprint=1) is first and not first.closed
+
+    second = get_resource("test:closeable", Closeable, fingerprint=2)
+
+    assert first.closed and not second.closed
+    invalidate("test:closeable")
+    assert second.closed
@@ -0,0 +1,71 @@
+from langchain_core.documents import Document
+from utils.chatbot import build_retriever
+from utils.embedding_cache import CachedEmbeddings
+from utils.hybrid_retriever import HybridRetriever, ShardedRetriever
+from utils.prepare_vectordb import get_bm25_index, get_manifest, ingest_sources, open_sharded_store, shard_for_source
+
+def note(source, text):
+    return source, text, [Document(page_content=text, metadata={"source": source})]
+
+def test_sources_are_routed_to_the_shard_of_their_type():
+    assert shard_for_source("https://example.com/pricing") == "web"
+    assert shard_for_source("scraped_text") == "web"
+    assert shard_for_source("docs/video_transcription.txt") == "video"
+    assert shard_for_source("docs/contracts/lease.pdf") == "group_contracts"
+    assert shard_for_source("docs/Q3 reports/summary.txt") == "group_Q3_reports"
+    assert shard_for_source("docs/report.pdf") == "documents"
+
+def test_every_source_is_stored_in_its_own_shard(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    ingest_sources([note("docs/report.txt", "the budget of the project is twelve thousand euros"),
+                    note("docs/contracts/lease.txt", "the lease of the office ends in March"),
+                    note("https://example.com/pricing", "the pricing page of the pump")], persist_directory)
+
+    store = open_sharded_store(persist_directory)
+    manifest = get_manifest(persist_directory)
+
+    assert {source: manifest.get_shard(source) for source in manifest.sources} == {"docs/report.txt": "documents", "docs/contracts/lease.txt": "group_contracts", "https://example.com/pricing": "web"}
+    assert store.names == ["documents", "group_contracts", "web"]
+    assert {name: vectordb.get()["documents"] for name, vectordb in store.shards.items()} == {"documents": ["the budget of the project is twelve thousand euros"],
+                                                                                            "group_contracts": ["the lease of the office ends in March"],
+                                                                                            "web": ["the pricing page of the pump"]}
+    assert open_sharded_store(persist_directory, ["web", "unknown"]).names == ["web"]
+    assert store.select(["group_contracts"]).count() == 1
+
+def test_hits_of_every_shard_are_merged_by_score(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    ingest_sources([note("docs/report.txt", "the budget of the pump project"),
+                    note("docs/notes.txt", "the weather of the week"),
+                    note("docs/contracts/lease.txt", "the budget of the office lease"),
+                    note("https://example.com/pricing", "the pricing page of the pump"),
+                    note("https://example.com/pricing-copy", "the pricing page of the pump")], persist_directory)
+    store = open_sharded_store(persist_directory)
+    retrievers = [HybridRetriever(vectordb=vectordb, index=get_bm25_index(vectordb), k=4) for vectordb in store.shards.values()]
+    query = "budget of the pump"
+
+    docs = ShardedRetriever(retrievers=retrievers, k=3, max_workers=3).invoke(query)
+
+    # The best hit of every shard has the same fused score, so ties keep the order of the shards
+    shard_hits = sorted(((score, doc.page_content) for retriever in retrievers for doc, score in retriever.search(query)), key=lambda hit: hit[0], reverse=True)
+    expected = list(dict.fromkeys(text for _, text in shard_hits))[:3]
+    assert [doc.page_content for doc in docs] == expected
+    # Identical chunks of two sources are only passed to the model once
+    assert len({doc.page_content for doc in docs}) == 3
+    assert {shard_for_source(doc.metadata["source"]) for doc in docs} == {"documents", "group_contracts", "web"}
+
+def test_chat_retriever_searches_every_shard_with_one_query_embedding(tmp_path, monkeypatch):
+    persist_directory = str(tmp_path / "db")
+    ingest_sources([note("docs/report.txt", "the budget of the pump project"),
+                    note("docs/contracts/lease.txt", "the lease of the office"),
+                    note("https://example.com/pricing", "the pricing page of the pump")], persist_directory)
+    store = open_sharded_store(persist_directory)
+    retriever = build_retriever(store)
+    queries = []
+    embed_query = CachedEmbeddings.embed_query
+    monkeypatch.setattr(CachedEmbeddings, "embed_query", lambda self, text: queries.append(text) or embed_query(self, text))
+
+    docs = retriever.invoke("pump lease")
+
+    assert queries == ["pump lease"]
+    assert isinstance(retriever, ShardedRetriever) and len(retriever.retrievers) == 3
+    assert {doc.metadata["source"] for doc in docs} == {"docs/report.txt", "docs/contracts/lease.txt", "https://example.com/pricing"}
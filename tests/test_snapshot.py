@@ -0,0 +1,89 @@
+from langchain_core.documents import Document
+from utils.chatbot import build_retriever
+from utils.prepare_vectordb import get_bm25_index, get_manifest, ingest_sources, iter_file_sources, open_sharded_store
+from utils.snapshot import Snapshot, export_snapshot, import_snapshot
+from utils import prepare_vectordb
+import numpy as np
+import pytest
+
+def export_notes(tmp_path):
+    # Exports a vectorstore with two text files, as docs/<name>.txt relative to tmp_path
+    persist_directory = str(tmp_path / "source_db")
+    (tmp_path / "docs").mkdir()
+    for name, text in {"budget": "the budget of the project is twelve thousand euros", "agenda": "agenda of the meeting in March"}.items():
+        (tmp_path / "docs" / f"{name}.txt").write_text(text, encoding="utf-8")
+    ingest_sources(iter_file_sources(["docs/budget.txt", "docs/agenda.txt"], get_manifest(persist_directory)), persist_directory)
+    path = str(tmp_path / "index.rsnap")
+    export_snapshot(path, persist_directory)
+    return path, persist_directory
+
+def changed_after_import(tmp_path, persist_directory):
+    return [source for source, _, _ in iter_file_sources(["docs/budget.txt", "docs/agenda.txt"], get_manifest(persist_directory))]
+
+def test_sources_chunked_like_this_node_are_not_ingested_again_after_import(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path, _ = export_notes(tmp_path)
+    # The node uses the other vector backend, with the same chunking
+    monkeypatch.setattr(prepare_vectordb, "VECTOR_BACKEND", "numpy")
+
+    import_snapshot(path, str(tmp_path / "node_db"))
+
+    assert changed_after_import(tmp_path, str(tmp_path / "node_db")) == []
+
+def test_sources_chunked_with_other_settings_are_ingested_again_after_import(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path, _ = export_notes(tmp_path)
+    monkeypatch.setattr(prepare_vectordb, "CHUNK_SIZE", 500)
+
+    import_snapshot(path, str(tmp_path / "node_db"))
+
+    assert sorted(changed_after_import(tmp_path, str(tmp_path / "node_db"))) == ["docs/agenda.txt", "docs/budget.txt"]
+
+def stored_chunks(persist_directory):
+    return {shard: vectordb.get(include=["embeddings", "documents", "metadatas"]) for shard, vectordb in open_sharded_store(persist_directory).shards.items()}
+
+def test_imported_index_matches_the_exported_one(tmp_path):
+    source_directory = str(tmp_path / "source_db")
+    ingest_sources([("docs/report.txt", "report", [Document(page_content="the budget of the project is twelve thousand euros", metadata={"source": "docs/report.txt"})]),
+                    ("https://example.com/pricing", "pricing", [Document(page_content="the pricing page of the XK42 pump", metadata={"source": "https://example.com/pricing"})])], source_directory)
+    ingest_sources([("docs/report.txt", "report v2", [Document(page_content="the budget of the project is fifteen thousand euros", metadata={"source": "docs/report.txt"})])], source_directory)
+
+    header = export_snapshot(str(tmp_path / "index.rsnap"), source_directory)
+    import_snapshot(str(tmp_path / "index.rsnap"), str(tmp_path / "node_db"))
+
+    assert header["index_version"] == 2
+    assert header["shards"] == {"documents": {"count": 1, "dim": 256}, "web": {"count": 1, "dim": 256}}
+    exported, imported = stored_chunks(source_directory), stored_chunks(str(tmp_path / "node_db"))
+    assert sorted(imported) == sorted(exported)
+    for shard in exported:
+        for column in ("ids", "documents", "metadatas"):
+            assert imported[shard][column] == exported[shard][column]
+        assert np.allclose(imported[shard]["embeddings"], exported[shard]["embeddings"])
+    manifest = get_manifest(str(tmp_path / "node_db"))
+    assert manifest.version == 2
+    assert manifest.sources == get_manifest(source_directory).sources
+    # The imported node answers from the vectors and the rebuilt BM25 index, without embedding the chunks again
+    store = open_sharded_store(str(tmp_path / "node_db"))
+    assert [chunk_id for chunk_id, _ in get_bm25_index(store.shards["web"]).search("XK42", 4)] == imported["web"]["ids"]
+    assert [doc.page_content for doc in build_retriever(store).invoke("budget of the project")][0] == "the budget of the project is fifteen thousand euros"
+
+def test_corrupted_snapshot_is_not_imported(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path, _ = export_notes(tmp_path)
+    section = Snapshot(path).header["sections"]["documents/documents_data"]
+    with open(path, "r+b") as f:
+        f.seek(section["offset"])
+        first = f.read(1)
+        f.seek(section["offset"])
+        f.write(bytes([first[0] ^ 1]))
+
+    with pytest.raises(ValueError, match="corrupted"):
+        import_snapshot(path, str(tmp_path / "node_db"))
+    assert not (tmp_path / "node_db").exists()
+
+def test_snapshot_is_only_imported_into_an_empty_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path, persist_directory = export_notes(tmp_path)
+
+    with pytest.raises(ValueError, match="not empty"):
+        import_snapshot(path, persist_directory)
@@ -0,0 +1,51 @@
+from utils.prepare_vectordb import iter_text_chunks
+from utils.source_loaders import get_loader, iter_source_documents, iter_text_sections
+from utils import prepare_vectordb
+
+def write_manual(path, paragraphs=300):
+    # Paragraphs of different lengths, with accented characters so character and byte offsets differ
+    text = "\n\n".join(f"Étape {i} : vérifier la pompe numéro {i}. " + "Contrôle du débit. " * (i % 7) for i in range(paragraphs))
+    path.write_text(text, encoding="utf-8")
+    return text
+
+def test_sections_cover_the_file_at_their_character_offsets(tmp_path):
+    text = write_manual(tmp_path / "manual.txt")
+
+    sections = list(iter_text_sections(str(tmp_path / "manual.txt"), section_chars=2000, block_chars=700))
+
+    assert len(sections) > 5
+    assert "".join(section.page_content for section in sections) == text
+    for section in sections:
+        assert len(section.page_content) <= 2000
+        assert text[section.metadata["offset"]:].startswith(section.page_content)
+    # Sections are cut at a paragraph break
+    assert all(section.page_content.endswith("\n\n") for section in sections[:-1])
+
+def test_chunks_get_their_offset_in_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(prepare_vectordb, "CHUNK_SIZE", 300)
+    monkeypatch.setattr(prepare_vectordb, "CHUNK_OVERLAP", 30)
+    text = write_manual(tmp_path / "manual.txt")
+
+    chunks = list(iter_text_chunks(iter_text_sections(str(tmp_path / "manual.txt"), section_chars=2000, block_chars=700)))
+
+    assert len(chunks) > 20
+    for chunk in chunks:
+        assert text[chunk.metadata["offset"]:chunk.metadata["offset"] + len(chunk.page_content)] == chunk.page_content
+    assert [chunk.metadata["offset"] for chunk in chunks] == sorted(chunk.metadata["offset"] for chunk in chunks)
+
+def test_blank_sections_are_skipped_and_undecodable_bytes_replaced(tmp_path):
+    (tmp_path / "scan.txt").write_bytes(b"first page\xff\n\n" + b" " * 50 + b"\n\nlast page")
+
+    sections = list(iter_text_sections(str(tmp_path / "scan.txt"), section_chars=20, block_chars=8))
+
+    assert [section.page_content.strip() for section in sections] == ["first page�", "last page"]
+    assert sections[-1].metadata["offset"] == len("first page�\n\n" + " " * 50 + "\n\n")
+
+def test_files_are_read_by_the_loader_of_their_type(tmp_path):
+    (tmp_path / "notes.md").write_text("# Notes\n\nthe budget of the project", encoding="utf-8")
+    (tmp_path / "image.png").write_bytes(b"\x89PNG")
+
+    groups = [(path, [doc.page_content for doc in docs]) for path, docs in iter_source_documents([str(tmp_path / "image.png"), str(tmp_path / "notes.md")], max_workers=1)]
+
+    assert [get_loader(name) for name in ("a.PDF", "b.txt", "c.md", "d.png")] == ["pdf", "text", "text", None]
+    assert groups == [(str(tmp_path / "notes.md"), ["# Notes\n\nthe budget of the project"])]
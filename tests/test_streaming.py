@@ -0,0 +1,36 @@
+from utils.chatbot import FAKE_ANSWER, stream_response
+from utils.fakes import FakeChatModel
+from utils.prepare_vectordb import get_manifest, ingest_sources, iter_file_sources, open_sharded_store
+from utils import metrics
+
+def build_store(tmp_path):
+    persist_directory = str(tmp_path / "db")
+    path = tmp_path / "budget.txt"
+    path.write_text("The budget of the project is twelve thousand euros, approved in March.", encoding="utf-8")
+    ingest_sources(iter_file_sources([str(path)], get_manifest(persist_directory)), persist_directory)
+    return open_sharded_store(persist_directory)
+
+def test_fake_models_stream_through_the_retrieval_chain(tmp_path):
+    vectordb = build_store(tmp_path)
+
+    parts = list(stream_response("What is the budget of the project?", [], vectordb, use_cache=False))
+
+    kinds = [kind for kind, _ in parts]
+    assert kinds[0] == "context" and kinds[-1] == "metrics"
+    assert "".join(value for kind, value in parts if kind == "token") == FAKE_ANSWER
+    assert parts[-1][1]["time_to_first_token"] is not None
+
+def test_tokens_arrive_before_the_answer_is_complete(tmp_path):
+    vectordb = build_store(tmp_path)
+    llm = FakeChatModel(responses=["twelve thousand euros"], sleep=0.01)
+    metrics.reset()
+
+    parts = list(stream_response("What is the budget of the project?", [], vectordb, llm=llm, use_cache=False))
+
+    tokens = [value for kind, value in parts if kind == "token"]
+    assert len(tokens) > 1 and "".join(tokens) == "twelve thousand euros"
+    response_metrics = parts[-1][1]
+    assert response_metrics["time_to_retrieval"] <= response_metrics["time_to_first_token"] < response_metrics["total"]
+    assert response_metrics["total"] - response_metrics["time_to_first_token"] >= 0.01 * (len(tokens) - 1)
+    assert response_metrics["prompt_tokens"] > 0 and not response_metrics["cache_hit"]
+    assert any(histogram["name"] == "time_to_first_token_seconds" and histogram["count"] == 1 for histogram in metrics.export_json()["histograms"])
@@ -0,0 +1,74 @@
+from utils.fakes import FakeTranscriptionBackend
+from utils.transcription import format_transcript, iter_audio_segments, transcribe_audio
+import numpy as np
+import wave
+
+SAMPLE_RATE = 16000
+
+def write_wav(path, samples, channels=1):
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(samples.astype(np.int16).tobytes())
+
+def speech_with_pauses(seconds):
+    # A tone that pauses for 0.1 s every 0.3 s, so every stretch searched for a cut contains a pause
+    time = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    samples = 8000 * np.sin(2 * np.pi * 440 * time)
+    samples[(time % 0.3) >= 0.2] = 0
+    return samples
+
+def test_segments_cover_the_audio_and_are_cut_in_pauses(tmp_path):
+    samples = speech_with_pauses(5)
+    write_wav(tmp_path / "audio.wav", samples)
+
+    segments = list(iter_audio_segments(str(tmp_path / "audio.wav"), segment_seconds=1, silence_search_seconds=0.4))
+
+    assert sum(len(segment) for _, segment, _ in segments) == len(samples)
+    position = 0
+    for start, segment, sample_rate in segments:
+        assert sample_rate == SAMPLE_RATE
+        assert start == position / SAMPLE_RATE
+        position += len(segment)
+    # Every cut but the end of the audio falls in a pause
+    cuts = np.cumsum([len(segment) for _, segment, _ in segments])[:-1]
+    assert len(cuts) >= 4
+    assert all(np.abs(samples[cut:cut + 400]).max() < 1 for cut in cuts)
+
+def test_stereo_audio_is_mixed_down(tmp_path):
+    mono = speech_with_pauses(2)
+    write_wav(tmp_path / "audio.wav", np.repeat(mono, 2), channels=2)
+
+    segments = list(iter_audio_segments(str(tmp_path / "audio.wav"), segment_seconds=1, silence_search_seconds=0.4))
+
+    assert sum(len(segment) for _, segment, _ in segments) == len(mono)
+
+def test_segments_are_transcribed_concurrently_and_stitched_in_order(tmp_path):
+    write_wav(tmp_path / "audio.wav", speech_with_pauses(10))
+
+    segments = transcribe_audio(str(tmp_path / "audio.wav"), FakeTranscriptionBackend(), segment_seconds=1, max_workers=4)
+
+    assert [start for start, _, _ in segments] == sorted(start for start, _, _ in segments)
+    assert all("seconds of audio at loudness" in text for _, _, text in segments)
+    assert segments[-1][1] == 10.0
+    transcript = format_transcript(segments).splitlines()
+    assert len(transcript) == len(segments)
+    assert transcript[0].startswith("[00:00:00 - 00:00:0")
+
+def test_a_failed_segment_is_left_empty(tmp_path):
+    write_wav(tmp_path / "audio.wav", speech_with_pauses(4))
+
+    class FlakyBackend(FakeTranscriptionBackend):
+        calls = 0
+
+        def transcribe(self, samples, sample_rate):
+            self.calls += 1
+            if self.calls == 2:
+                raise RuntimeError("503 service unavailable")
+            return super().transcribe(samples, sample_rate)
+
+    segments = transcribe_audio(str(tmp_path / "audio.wav"), FlakyBackend(), segment_seconds=1, max_workers=1)
+
+    assert [bool(text) for _, _, text in segments].count(False) == 1
+    assert len(format_transcript(segments).splitlines()) == len(segments) - 1
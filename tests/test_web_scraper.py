@@ -0,0 +1,121 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.fakes import HashingEmbeddings
+from utils.index_maintenance import reconcile_docs
+from utils.prepare_vectordb import get_manifest
+from utils.web_scraper import crawl_website, load_crawl_state
+import hashlib
+import pytest
+import threading
+
+ROBOTS = "User-agent: *\nDisallow: /private/\n"
+
+class Site:
+    """Small website served on localhost, recording the requests it receives"""
+    def __init__(self):
+        self.pages = {
+            "/": '<html><title>Home</title><body><p>home page</p><a href="/a">A</a> <a href="/b">B</a> <a href="/private/secret">S</a></body></html>',
+            "/a": '<html><title>A</title><body><p>page a about apples</p><a href="/c">C</a></body></html>',
+            "/b": '<html><title>B</title><body><p>page b about bananas</p></body></html>',
+            "/c": '<html><title>C</title><body><p>page c about cherries</p></body></html>',
+            "/private/secret": '<html><title>Secret</title><body><p>not for crawlers</p></body></html>',
+        }
+        self.requests = []
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests.append((self.path, self.headers.get("If-None-Match")))
+                if self.path == "/robots.txt":
+                    return self.reply(200, ROBOTS, "text/plain")
+                if self.path not in site.pages:
+                    return self.reply(404, "not found", "text/plain")
+                body = site.pages[self.path]
+                etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.reply(200, body, "text/html", etag)
+
+            def reply(self, status, body, content_type, etag=None):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def page_requests(self):
+        return [path for path, _ in self.requests if path != "/robots.txt"]
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    # Pages are stored under docs/web of the working directory, like in the app
+    monkeypatch.chdir(tmp_path)
+    site = Site()
+    site.persist_directory = str(tmp_path / "db")
+    yield site
+    site.server.shutdown()
+    site.server.server_close()
+
+def ingested_paths(site):
+    return sorted(source[len(site.url) - 1:] for source in get_manifest(site.persist_directory).sources)
+
+def test_crawl_follows_links_up_to_the_depth_and_respects_robots_txt(site):
+    assert crawl_website(site.url, max_depth=1, max_pages=50, persist_directory=site.persist_directory) == 3
+
+    assert ingested_paths(site) == ["/", "/a", "/b"]
+    assert "/c" not in site.page_requests()
+    assert "/private/secret" not in site.page_requests()
+
+def test_crawl_stops_at_the_page_budget(site):
+    crawl_website(site.url, max_depth=2, max_pages=2, persist_directory=site.persist_directory)
+
+    assert len(site.page_requests()) == 2
+    assert len(ingested_paths(site)) == 2
+
+def test_recrawl_skips_unchanged_pages_with_304(site):
+    crawl_website(site.url, max_depth=2, persist_directory=site.persist_directory)
+    assert ingested_paths(site) == ["/", "/a", "/b", "/c"]
+    site.requests.clear()
+    site.pages["/b"] = site.pages["/b"].replace("bananas", "blueberries")
+
+    assert crawl_website(site.url, max_depth=2, persist_directory=site.persist_directory) == 1
+
+    # Every page was requested with its ETag, and only the changed one was downloaded again
+    assert sorted(site.page_requests()) == ["/", "/a", "/b", "/c"]
+    assert all(etag for path, etag in site.requests if path != "/robots.txt")
+    assert ingested_paths(site) == ["/", "/a", "/b", "/c"]
+
+def test_validators_are_not_saved_when_ingestion_fails(site, monkeypatch):
+    def fail(self, texts):
+        raise ValueError("400 API key not valid")
+    with monkeypatch.context() as patch:
+        patch.setattr(HashingEmbeddings, "embed_documents", fail)
+        with pytest.raises(ValueError):
+            crawl_website(site.url, max_depth=1, persist_directory=site.persist_directory)
+    assert load_crawl_state() == {}
+    site.requests.clear()
+
+    # The pages are downloaded again instead of being answered with 304, so they reach the vectorstore
+    assert crawl_website(site.url, max_depth=1, persist_directory=site.persist_directory) == 3
+    assert not any(etag for _, etag in site.requests)
+    assert ingested_paths(site) == ["/", "/a", "/b"]
+
+def test_reconcile_does_not_ingest_the_copies_of_crawled_pages(site):
+    crawl_website(site.url, max_depth=1, persist_directory=site.persist_directory)
+    sources = set(get_manifest(site.persist_directory).sources)
+
+    result = reconcile_docs("docs", site.persist_directory)
+
+    assert result == {"removed_sources": [], "deleted_chunks": 0, "ingested_sources": 0}
+    assert set(get_manifest(site.persist_directory).sources) == sources